@@ -124,6 +124,13 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded files, e.g. GEDCOM files waiting to be imported
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Generated GEDCOM exports, kept until the tree changes or the cache grows past EXPORT_CACHE_MAX_BYTES
+EXPORT_CACHE_DIR = os.path.join(BASE_DIR, 'export_cache')
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 LOGIN_REDIRECT_URL = '/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
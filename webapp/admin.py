@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.db import models
 from django.forms import TextInput
 
-from .models import AlternateName, LegalName, Location, Partnership, Person, Tree
+from .models import AlternateName, ImportJob, LegalName, Location, Partnership, Person, Tree
 
 text_input_size = 40
 
@@ -113,3 +113,11 @@ class PartnershipAdmin(admin.ModelAdmin):
     list_filter = ('marital_status',)
     search_fields = ('person__legal_name__first_name', 'person__legal_name__middle_name',
                      'person__legal_name__last_name')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'creator', 'status', 'processed_records', 'created', 'finished')
+    list_display_links = ('id', 'title')
+    list_filter = ('status', 'creator')
+    search_fields = ('title', 'creator__username')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class WebappConfig(AppConfig):
     name = 'webapp'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import webapp.signals  # noqa: F401
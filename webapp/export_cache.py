@@ -0,0 +1,119 @@
+import glob
+import os
+import tempfile
+
+from django.conf import settings
+
+from webapp.gedcom_generator import stream_file
+from webapp.models import Tree
+
+
+def etag(tree: Tree, export_format='ged'):
+    return f'"{tree.pk}-{tree.version}-{export_format}"'
+
+
+def cache_path(tree: Tree):
+    return os.path.join(settings.EXPORT_CACHE_DIR, f'tree-{tree.pk}-{tree.version}.ged')
+
+
+def open_cached(tree: Tree):
+    """
+    Opens the cached export of the tree's current version, and marks it as recently used.
+    :return: a binary file, or None if the export isn't cached
+    """
+    try:
+        f = open(cache_path(tree), 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(f.name)
+    except FileNotFoundError:
+        # Evicted after being opened; the open file can still be read
+        pass
+    return f
+
+
+def stream_and_cache(tree: Tree):
+    """
+    Generates the export of a tree like stream_file, while writing it to the cache. The file is only added to the cache
+    once the whole export has been generated, so a download that is cut off doesn't leave a partial file behind.
+    :return: generator of str
+    """
+    os.makedirs(settings.EXPORT_CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=settings.EXPORT_CACHE_DIR)
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') as f:
+            for chunk in stream_file(tree):
+                f.write(chunk)
+                yield chunk
+        os.replace(temp_path, cache_path(tree))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    remove_old_versions(tree)
+    evict()
+
+
+def cached_versions(tree_id):
+    """
+    :return: list of the paths of the cached exports of a tree, with the version each one is of
+    """
+    prefix = os.path.join(settings.EXPORT_CACHE_DIR, f'tree-{tree_id}-')
+    versions = list()
+    for path in glob.glob(f'{prefix}*.ged'):
+        try:
+            versions.append((path, int(path[len(prefix):-len('.ged')])))
+        except ValueError:
+            continue
+    return versions
+
+
+def remove_old_versions(tree: Tree):
+    """
+    Removes the cached exports of versions of the tree older than tree.version. Newer ones are kept, since the tree may
+    have changed and been exported again while this export was streamed.
+    """
+    for path, version in cached_versions(tree.pk):
+        if version < tree.version:
+            remove(path)
+
+
+def remove_tree(tree_id):
+    """
+    Removes every cached export of a tree, so that a tree that is given its primary key later isn't served them.
+    """
+    for path, version in cached_versions(tree_id):
+        remove(path)
+
+
+def evict(max_bytes=None):
+    """
+    Removes the least recently used exports until the cache fits in max_bytes.
+    :param max_bytes: defaults to settings.EXPORT_CACHE_MAX_BYTES
+    """
+    if max_bytes is None:
+        max_bytes = settings.EXPORT_CACHE_MAX_BYTES
+
+    entries = list()
+    for path in glob.glob(os.path.join(settings.EXPORT_CACHE_DIR, 'tree-*.ged')):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        remove(path)
+        total -= size
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Removed by another request
+        pass
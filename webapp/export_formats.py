@@ -0,0 +1,89 @@
+import zipfile
+import zlib
+
+# Name of the GEDCOM file inside a zip export, as in GEDZIP
+ZIP_MEMBER_NAME = 'gedcom.ged'
+
+# Size of the reads from a cached export
+READ_SIZE = 64 * 1024
+
+COMPRESSION_LEVEL = 6
+
+
+class ExportFormat:
+    def __init__(self, name, extension, content_type, compress=None):
+        """
+        :param compress: callable that turns a generator of uncompressed bytes into a generator of compressed bytes,
+            or None if the format isn't compressed
+        """
+        self.name = name
+        self.extension = extension
+        self.content_type = content_type
+        self.compress = compress
+
+
+def encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def read_chunks(f):
+    with f:
+        yield from iter(lambda: f.read(READ_SIZE), b'')
+
+
+def gzip_chunks(chunks):
+    """
+    Compresses chunks into a gzip stream as they arrive.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in encode(chunks):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ChunkWriter:
+    """
+    Write-only file that collects what is written to it until it is drained. ZipFile writes to it like to an
+    unseekable stream, so sizes and checksums go in data descriptors after the compressed data.
+    """
+
+    def __init__(self):
+        self.chunks = list()
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_chunks(chunks):
+    """
+    Compresses chunks into a zip archive with a single gedcom.ged member as they arrive.
+    """
+    writer = ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL) as archive:
+        with archive.open(ZIP_MEMBER_NAME, 'w') as member:
+            for chunk in encode(chunks):
+                member.write(chunk)
+                data = writer.drain()
+                if data:
+                    yield data
+    yield writer.drain()
+
+
+FORMATS = {export_format.name: export_format for export_format in (
+    ExportFormat('ged', 'ged', 'text/plain'),
+    ExportFormat('gzip', 'ged.gz', 'application/gzip', gzip_chunks),
+    ExportFormat('zip', 'zip', 'application/zip', zip_chunks),
+)}
+DEFAULT_FORMAT = 'ged'
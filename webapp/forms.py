@@ -18,7 +18,22 @@ class AddNameForm(ModelForm):
         }
 
 
-class AddPersonForm(ModelForm):
+class GedcomDateFormMixin:
+    """
+    Clears the GEDCOM value kept by an import for a date that is edited through the form, which the value would no
+    longer describe.
+    """
+    # date field -> field of its GEDCOM value
+    gedcom_date_fields = dict()
+
+    def save(self, commit=True):
+        for field, text_field in self.gedcom_date_fields.items():
+            if field in self.changed_data:
+                setattr(self.instance, text_field, '')
+        return super().save(commit)
+
+
+class AddPersonForm(GedcomDateFormMixin, ModelForm):
     blank_choice = [('', '----------------')]
     birth_city = forms.CharField(label='City/Town/Village',
                                  max_length=50, required=False)
@@ -48,6 +63,7 @@ class AddPersonForm(ModelForm):
     field_order = ['preferred_name', 'gender', 'birth_date', 'birth_city',
                    'birth_state', 'birth_country', 'living', 'death_date', 'death_city',
                    'death_state', 'death_country', 'notes']
+    gedcom_date_fields = {'birth_date': 'birth_date_gedcom', 'death_date': 'death_date_gedcom'}
 
 
 class AlternateNameForm(ModelForm):
@@ -74,15 +90,17 @@ class AddTreeForm(ModelForm):
         fields = ['title', 'notes']
 
 
-class AddPartnershipForm(ModelForm):
+class AddPartnershipForm(GedcomDateFormMixin, ModelForm):
     class Meta:
         model = Partnership
-        exclude = ['tree', 'children']
+        exclude = ['tree', 'children', 'marriage_date_gedcom', 'divorce_date_gedcom']
         widgets = {
             'marriage_date': forms.DateInput(attrs={'type': 'date'}),
             'divorce_date': forms.DateInput(attrs={'type': 'date'})
         }
 
+    gedcom_date_fields = {'marriage_date': 'marriage_date_gedcom', 'divorce_date': 'divorce_date_gedcom'}
+
     def __init__(self, *args, **kwargs):
         super(AddPartnershipForm, self).__init__(*args, **kwargs)
         # self.fields['children'].queryset = Person.objects.filter(tree=tree)
@@ -130,5 +148,19 @@ PartnershipChildFormSet = inlineformset_factory(Partnership, Partnership.childre
 
 
 class UploadFileForm(forms.Form):
-    title = forms.CharField()
+    title = forms.CharField(required=False)
     file = forms.FileField()
+    merge_into = forms.ModelChoiceField(queryset=Tree.objects.none(), required=False,
+                                        help_text='Update an existing tree with the changes in the file, e.g. a newer '
+                                                  'export of it, instead of creating a new tree')
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super(UploadFileForm, self).__init__(*args, **kwargs)
+        self.fields['merge_into'].queryset = Tree.objects.filter(creator=user)
+
+    def clean(self):
+        cleaned_data = super(UploadFileForm, self).clean()
+        if not cleaned_data.get('title') and not cleaned_data.get('merge_into'):
+            raise forms.ValidationError('A title is required for a new tree')
+        return cleaned_data
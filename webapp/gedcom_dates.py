@@ -0,0 +1,159 @@
+import calendar
+import datetime
+from functools import lru_cache
+
+# Precision of a GedcomDate
+DAY = 'day'
+MONTH = 'month'
+YEAR = 'year'
+
+MONTHS = {
+    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
+    'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12,
+}
+MONTH_NAMES = {number: name for name, number in MONTHS.items()}
+
+# Qualifiers that apply to a single date
+APPROXIMATE_QUALIFIERS = frozenset(('ABT', 'CAL', 'EST'))
+RANGE_QUALIFIERS = frozenset(('BEF', 'AFT', 'TO'))
+# Qualifiers of two-date forms, mapped to the word between the dates
+PAIR_QUALIFIERS = {'BET': 'AND', 'FROM': 'TO'}
+QUALIFIERS = APPROXIMATE_QUALIFIERS | RANGE_QUALIFIERS | frozenset(PAIR_QUALIFIERS)
+
+# Maximum number of distinct date strings whose parsed GedcomDate is kept by parse_date
+DATE_CACHE_SIZE = 4096
+
+
+class GedcomDate:
+    """
+    A parsed GEDCOM date value, e.g. "12 JAN 1998", "ABT 1900", "BET JAN 1900 AND 1910" or "FROM 1900 TO 1910".
+
+    start is the first date in the value at the earliest day it allows, e.g. 1 Jan 1900 for "ABT 1900"; end is only set
+    for BET ... AND and FROM ... TO. Instances are shared through the parse_date cache and must not be modified.
+    """
+    __slots__ = ('qualifier', 'start', 'precision', 'end', 'end_precision')
+
+    def __init__(self, start, precision=DAY, qualifier='', end=None, end_precision=DAY):
+        self.qualifier = qualifier
+        self.start = start
+        self.precision = precision
+        self.end = end
+        self.end_precision = end_precision
+
+    @classmethod
+    def from_date(cls, date: datetime.date):
+        return cls(date)
+
+    @property
+    def date(self):
+        """
+        :return: a single date that can be stored in a DateField
+        """
+        return self.start
+
+    @property
+    def is_exact(self):
+        return self.precision == DAY and not self.qualifier
+
+    def to_gedcom(self):
+        text = format_date(self.start, self.precision)
+        if self.end is not None:
+            text = f'{text} {PAIR_QUALIFIERS[self.qualifier]} {format_date(self.end, self.end_precision)}'
+        return f'{self.qualifier} {text}' if self.qualifier else text
+
+    def __eq__(self, other):
+        return isinstance(other, GedcomDate) and self.to_gedcom() == other.to_gedcom()
+
+    def __hash__(self):
+        return hash(self.to_gedcom())
+
+    def __repr__(self):
+        return f'GedcomDate({self.to_gedcom()!r})'
+
+
+def format_date(date: datetime.date, precision=DAY):
+    if precision == YEAR:
+        return str(date.year)
+    if precision == MONTH:
+        return f'{MONTH_NAMES[date.month]} {date.year}'
+    return f'{date.day:02d} {MONTH_NAMES[date.month]} {date.year}'
+
+
+def parse_parts(parts):
+    """
+    Parses the parts of a single date: [[day] month] year.
+    :return: tuple of the earliest date allowed and the precision, or None if the parts aren't a valid date
+    """
+    if not parts or len(parts) > 3:
+        return None
+
+    year = parts[-1]
+    if not year.isdigit():
+        return None
+    year = int(year)
+    if not datetime.MINYEAR <= year <= datetime.MAXYEAR:
+        return None
+    if len(parts) == 1:
+        return datetime.date(year, 1, 1), YEAR
+
+    month = MONTHS.get(parts[-2])
+    if month is None:
+        return None
+    if len(parts) == 2:
+        return datetime.date(year, month, 1), MONTH
+
+    day = parts[0]
+    if not day.isdigit() or not 1 <= int(day) <= calendar.monthrange(year, month)[1]:
+        return None
+    return datetime.date(year, month, int(day)), DAY
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(text: str):
+    """
+    Parses a GEDCOM date value. Supports exact dates, month and year precision, the ABT/CAL/EST/BEF/AFT/TO qualifiers
+    and the BET ... AND ... and FROM ... TO ... forms. Repeated values are served from a cache.
+    :return: a GedcomDate, or None if the value can't be parsed
+    """
+    parts = text.upper().split()
+    if not parts:
+        return None
+
+    qualifier = parts[0] if parts[0] in QUALIFIERS else ''
+    if qualifier:
+        parts = parts[1:]
+
+    if qualifier in PAIR_QUALIFIERS:
+        separator = PAIR_QUALIFIERS[qualifier]
+        if separator in parts:
+            i = parts.index(separator)
+            start, end = parse_parts(parts[:i]), parse_parts(parts[i + 1:])
+            if start is None or end is None:
+                return None
+            return GedcomDate(start[0], start[1], qualifier, end[0], end[1])
+        elif qualifier == 'BET':
+            return None
+
+    start = parse_parts(parts)
+    if start is None:
+        return None
+    return GedcomDate(start[0], start[1], qualifier)
+
+
+def stored_date(date: datetime.date, text: str = ''):
+    """
+    Gets the GedcomDate of a date stored as a DateField and an optional GEDCOM date value.
+    The value is only used while it still agrees with the DateField, which may have been edited since.
+    :return: a GedcomDate, or None if there is no date
+    """
+    if not date:
+        return None
+    if text:
+        gedcom_date = parse_date(text)
+        if gedcom_date is not None and gedcom_date.date == date:
+            return gedcom_date
+    return GedcomDate.from_date(date)
+
+
+def date_cache_info():
+    return parse_date.cache_info()
@@ -1,12 +1,25 @@
-from datetime import datetime
+import datetime
+from collections import defaultdict
 
+from django.db.models import BooleanField, Value
 from gedcom.element.element import Element
 from gedcom.element.individual import IndividualElement
 from gedcom.parser import Parser
 
 import webapp.tags_ext as tags
 from webapp import gedcom_helpers
-from webapp.models import Person, Partnership, Tree
+from webapp.gedcom_dates import stored_date
+from webapp.kinship import birth_order
+from webapp.models import Person, Partnership, Tree, AlternateName, PersonPartnership
+
+# Number of rows fetched at a time while generating a file
+STREAM_CHUNK_SIZE = 2000
+
+# Number of ids in the IN clauses of a subtree's queries, which stays under SQLite's limit of 999 parameters
+SUBTREE_BATCH_SIZE = 400
+
+ANCESTORS = 'ancestors'
+DESCENDANTS = 'descendants'
 
 
 def gen_head_and_submitter(tree):
@@ -30,16 +43,151 @@ def gen_head_and_submitter(tree):
         return head_element, None
 
 
-def gen_event(level, tag, date: datetime.date, location):
+def gen_event(level, tag, date: datetime.date, location, date_gedcom=''):
     event_element = Element(level, '', tag, '')
-    if date:
-        event_element.add_child_element(Element(level + 1, '', tags.GEDCOM_TAG_DATE, date.strftime("%d %b %Y").upper()))
+    gedcom_date = stored_date(date, date_gedcom)
+    if gedcom_date:
+        event_element.add_child_element(Element(level + 1, '', tags.GEDCOM_TAG_DATE, gedcom_date.to_gedcom()))
     if location:
         event_element.add_child_element(Element(level + 1, '', tags.GEDCOM_TAG_PLACE, str(location)))
     return event_element
 
 
-def gen_individual(person: Person):
+class TreeRelations:
+    """
+    The alternate names and partnership relations of every person in a tree, loaded with one query each so that
+    records can be generated without querying per person or per partnership. Only ids and genders are kept for the
+    relations.
+    """
+
+    def __init__(self, tree: Tree):
+        self.alternate_names = defaultdict(list)
+        for alternate_name in AlternateName.objects.filter(person__tree=tree).order_by('pk'):
+            self.alternate_names[alternate_name.person_id].append(alternate_name)
+
+        # person id -> ids of the partnerships the person is a partner in (FAMS) or a child of (FAMC)
+        self.spouse_families = defaultdict(list)
+        self.child_families = defaultdict(list)
+        # partnership id -> (person id, gender) of each partner, and ids of the children
+        self.partners = defaultdict(list)
+        self.children = defaultdict(list)
+
+        # Partners and children are listed in the order of Person.Meta.ordering
+        partners = PersonPartnership.objects.filter(partnership__tree=tree).order_by('person__birth_date', 'person_id')
+        for partnership_id, person_id, gender in partners.values_list('partnership_id', 'person_id', 'person__gender'):
+            self.spouse_families[person_id].append(partnership_id)
+            self.partners[partnership_id].append((person_id, gender))
+        children = Partnership.children.through.objects.filter(partnership__tree=tree) \
+            .order_by('person__birth_date', 'person_id')
+        for partnership_id, person_id in children.values_list('partnership_id', 'person_id'):
+            self.child_families[person_id].append(partnership_id)
+            self.children[partnership_id].append(person_id)
+
+        for families in (self.spouse_families, self.child_families):
+            for partnership_ids in families.values():
+                partnership_ids.sort()
+
+
+def batches(ids, size=SUBTREE_BATCH_SIZE):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class Subtree:
+    """
+    The ancestors or descendants of a person, and the relations between them, with the same attributes as
+    TreeRelations. Descendants come with the partners they had children with, or not; ancestors come without their
+    other families. Each generation is loaded with one query (per SUBTREE_BATCH_SIZE people), and relations to people
+    or partnerships outside of the subtree are left out.
+    """
+
+    def __init__(self, root: Person, direction, depth=None):
+        """
+        :param direction: ANCESTORS or DESCENDANTS
+        :param depth: number of generations to follow from root, or None to follow them all
+        """
+        if direction not in (ANCESTORS, DESCENDANTS):
+            raise ValueError(f'Unknown direction {direction}')
+        self.root = root
+        self.direction = direction
+        self.depth = depth
+        self.person_ids = {root.pk}
+        self.partnership_ids = set()
+
+        self.alternate_names = defaultdict(list)
+        self.spouse_families = defaultdict(list)
+        self.child_families = defaultdict(list)
+        self.partners = defaultdict(list)
+        self.children = defaultdict(list)
+
+        # (partnership id, person id, gender, birth date) of each relation, to be sorted like in TreeRelations
+        partner_rows = set()
+        child_rows = set()
+
+        visited = {root.pk}
+        generation = [root.pk]
+        followed = 0
+        while generation and (depth is None or followed < depth):
+            next_generation = set()
+            for batch in batches(generation):
+                for partnership_id, person_id, gender, birth_date, is_child in self.relation_rows(batch):
+                    self.partnership_ids.add(partnership_id)
+                    self.person_ids.add(person_id)
+                    row = (partnership_id, person_id, gender, birth_date)
+                    if is_child:
+                        child_rows.add(row)
+                    else:
+                        partner_rows.add(row)
+                    # Descendants are followed through children, ancestors through parents, and never through the
+                    # partners of descendants
+                    if is_child == (direction == DESCENDANTS) and person_id not in visited:
+                        visited.add(person_id)
+                        next_generation.add(person_id)
+            generation = next_generation
+            followed += 1
+
+        def order(row):
+            partnership_id, person_id, gender, birth_date = row
+            return birth_order(birth_date, person_id)
+
+        for partnership_id, person_id, gender, birth_date in sorted(partner_rows, key=order):
+            self.spouse_families[person_id].append(partnership_id)
+            self.partners[partnership_id].append((person_id, gender))
+        for partnership_id, person_id, gender, birth_date in sorted(child_rows, key=order):
+            self.child_families[person_id].append(partnership_id)
+            self.children[partnership_id].append(person_id)
+        for families in (self.spouse_families, self.child_families):
+            for partnership_ids in families.values():
+                partnership_ids.sort()
+
+        for batch in batches(self.person_ids):
+            for alternate_name in AlternateName.objects.filter(person__in=batch).order_by('pk'):
+                self.alternate_names[alternate_name.person_id].append(alternate_name)
+
+    def relation_rows(self, person_ids):
+        """
+        :return: the partners and children of the partnerships of the people if following descendants, or of the
+            partnerships they are children of if following ancestors, as (partnership id, person id, gender,
+            birth date, is child) rows
+        """
+        fields = ('partnership_id', 'person_id', 'person__gender', 'person__birth_date')
+        if self.direction == DESCENDANTS:
+            partners = PersonPartnership.objects.filter(partnership__person__in=person_ids)
+            children = Partnership.children.through.objects.filter(partnership__person__in=person_ids)
+        else:
+            partners = PersonPartnership.objects.filter(partnership__children__in=person_ids)
+            children = Partnership.children.through.objects.filter(person__in=person_ids)
+        partners = partners.annotate(is_child=Value(False, BooleanField())).values_list(*fields, 'is_child')
+        children = children.annotate(is_child=Value(True, BooleanField())).values_list(*fields, 'is_child')
+        # UNION also removes the duplicates of partnerships with several of the people in them
+        return partners.union(children)
+
+
+def gen_individual(person: Person, relations: TreeRelations = None):
+    """
+    :param relations: relations of the person's tree; when omitted, they are queried for this person
+    """
     ptr = gedcom_helpers.gen_ptr(person)
     individual_element = IndividualElement(0, ptr, tags.GEDCOM_TAG_INDIVIDUAL, '')
 
@@ -53,77 +201,141 @@ def gen_individual(person: Person):
     if legal_name.suffix:
         individual_element.add_child_element(Element(1, '', tags.GEDCOM_TAG_NAME_SUFFIX, legal_name.suffix))
 
-    for name in person.alternate_name.all():
+    if relations is not None:
+        alternate_names = relations.alternate_names.get(person.pk, ())
+        spouse_family_ids = relations.spouse_families.get(person.pk, ())
+        child_family_ids = relations.child_families.get(person.pk, ())
+    else:
+        alternate_names = person.alternate_name.all()
+        spouse_family_ids = Partnership.objects.filter(person=person).values_list('pk', flat=True)
+        child_family_ids = Partnership.objects.filter(children=person).values_list('pk', flat=True)
+
+    for name in alternate_names:
         individual_element.add_child_element(Element(1, '', tags.GEDCOM_TAG_NAME, name.full_name()))
 
     individual_element.add_child_element(Element(1, '', tags.GEDCOM_TAG_SEX, person.gender_shorthand()))
 
     if person.birth_date or person.birth_location:
         individual_element.add_child_element(
-            gen_event(1, tags.GEDCOM_TAG_BIRTH, person.birth_date, person.birth_location))
+            gen_event(1, tags.GEDCOM_TAG_BIRTH, person.birth_date, person.birth_location, person.birth_date_gedcom))
 
     if person.death_date or person.death_location:
         individual_element.add_child_element(
-            gen_event(1, tags.GEDCOM_TAG_DEATH, person.death_date, person.death_location))
+            gen_event(1, tags.GEDCOM_TAG_DEATH, person.death_date, person.death_location, person.death_date_gedcom))
 
-    for partnership in Partnership.objects.filter(person=person):
+    for partnership_id in spouse_family_ids:
         individual_element.add_child_element(
-            Element(1, '', tags.GEDCOM_TAG_FAMILY_SPOUSE, gedcom_helpers.gen_ptr(partnership)))
+            Element(1, '', tags.GEDCOM_TAG_FAMILY_SPOUSE, gedcom_helpers.format_ptr(Partnership, partnership_id)))
 
-    for partnership in Partnership.objects.filter(children=person):
+    for partnership_id in child_family_ids:
         individual_element.add_child_element(
-            Element(1, '', tags.GEDCOM_TAG_FAMILY_CHILD, gedcom_helpers.gen_ptr(partnership)))
+            Element(1, '', tags.GEDCOM_TAG_FAMILY_CHILD, gedcom_helpers.format_ptr(Partnership, partnership_id)))
 
     return ptr, individual_element
 
 
-def gen_family(partnership):
+def gen_family(partnership, relations: TreeRelations = None):
+    """
+    :param relations: relations of the partnership's tree; when omitted, they are queried for this partnership
+    """
     ptr = gedcom_helpers.gen_ptr(partnership)
     family_element = Element(0, ptr, tags.GEDCOM_TAG_FAMILY, '')
 
-    # Add spouses
-    for person in Person.objects.filter(partnerships=partnership):
-        if person.gender == Person.MALE:
-            tag = tags.GEDCOM_TAG_HUSBAND
-        elif person.gender == Person.FEMALE:
-            tag = tags.GEDCOM_TAG_WIFE
-        else:
-            # todo: determine better behavior in these cases.
-            raise ValueError(f"Not sure whether to call {person.gender} a husband or a wife")
-        family_element.add_child_element(Element(1, '', tag, gedcom_helpers.gen_ptr(person)))
+    if relations is not None:
+        partners = relations.partners.get(partnership.pk, ())
+        child_ids = relations.children.get(partnership.pk, ())
+    else:
+        partners = Person.objects.filter(partnerships=partnership).values_list('pk', 'gender')
+        child_ids = partnership.children.values_list('pk', flat=True)
+
+    # Add spouses. Partners of another or an unknown gender, which is what imports without SEX get, take the tag that
+    # the other partners left free, husband first
+    gender_tags = {Person.MALE: tags.GEDCOM_TAG_HUSBAND, Person.FEMALE: tags.GEDCOM_TAG_WIFE}
+    used_tags = {gender_tags[gender] for person_id, gender in partners if gender in gender_tags}
+    for person_id, gender in partners:
+        tag = gender_tags.get(gender)
+        if tag is None:
+            tag = tags.GEDCOM_TAG_HUSBAND if tags.GEDCOM_TAG_HUSBAND not in used_tags else tags.GEDCOM_TAG_WIFE
+            used_tags.add(tag)
+        family_element.add_child_element(Element(1, '', tag, gedcom_helpers.format_ptr(Person, person_id)))
 
     # add children
-    for person in partnership.children.all():
-        family_element.add_child_element(Element(1, '', tags.GEDCOM_TAG_CHILD, gedcom_helpers.gen_ptr(person)))
+    for person_id in child_ids:
+        family_element.add_child_element(
+            Element(1, '', tags.GEDCOM_TAG_CHILD, gedcom_helpers.format_ptr(Person, person_id)))
 
     if partnership.marriage_date:
-        family_element.add_child_element(gen_event(1, tags.GEDCOM_TAG_MARRIAGE, partnership.marriage_date, ''))
+        family_element.add_child_element(gen_event(1, tags.GEDCOM_TAG_MARRIAGE, partnership.marriage_date, '',
+                                                   partnership.marriage_date_gedcom))
 
     if partnership.divorce_date:
-        family_element.add_child_element(gen_event(1, tags.GEDCOM_TAG_DIVORCE, partnership.divorce_date, ''))
+        family_element.add_child_element(gen_event(1, tags.GEDCOM_TAG_DIVORCE, partnership.divorce_date, '',
+                                                   partnership.divorce_date_gedcom))
 
     return ptr, family_element
 
 
-def generate_file(tree: Tree):
-    parser = Parser()
-    parser.parse([])
-    root = parser.get_root_element()
+def gen_records(tree: Tree):
+    """
+    Generates the records of a tree's GEDCOM file one at a time: HEAD and SUBM first, then INDI, then FAM records.
+    People and partnerships are fetched in chunks instead of being cached by the querysets; the rest of the tree is
+    loaded by TreeRelations, so the number of queries doesn't depend on the size of the tree.
+    :return: generator of level 0 elements
+    """
     head_element, submitter_element = gen_head_and_submitter(tree)
-    root.add_child_element(head_element)
+    yield head_element
     if submitter_element is not None:
-        root.add_child_element(submitter_element)
+        yield submitter_element
 
-    # individuals = dict()
-    for person in Person.objects.filter(tree=tree):
-        ptr, individual = gen_individual(person)
-        # individuals[ptr] = individual
-        root.add_child_element(individual)
+    relations = TreeRelations(tree)
+    persons = Person.objects.filter(tree=tree).select_related('legal_name', 'birth_location', 'death_location')
+    for person in persons.iterator(chunk_size=STREAM_CHUNK_SIZE):
+        ptr, individual = gen_individual(person, relations)
+        yield individual
 
-    # families = dict()
-    for partnership in Partnership.objects.filter(tree=tree):
-        ptr, family = gen_family(partnership)
-        # families[ptr] = family
-        root.add_child_element(family)
+    for partnership in Partnership.objects.filter(tree=tree).iterator(chunk_size=STREAM_CHUNK_SIZE):
+        ptr, family = gen_family(partnership, relations)
+        yield family
 
+
+def gen_subtree_records(subtree: Subtree):
+    """
+    Generates the records of a GEDCOM file of a subtree, in the same order as gen_records.
+    :return: generator of level 0 elements
+    """
+    head_element, submitter_element = gen_head_and_submitter(subtree.root.tree)
+    yield head_element
+    if submitter_element is not None:
+        yield submitter_element
+
+    for batch in batches(subtree.person_ids):
+        persons = Person.objects.filter(pk__in=batch).select_related('legal_name', 'birth_location', 'death_location')
+        for person in persons.order_by('pk'):
+            ptr, individual = gen_individual(person, subtree)
+            yield individual
+
+    for batch in batches(subtree.partnership_ids):
+        for partnership in Partnership.objects.filter(pk__in=batch).order_by('pk'):
+            ptr, family = gen_family(partnership, subtree)
+            yield family
+
+
+def stream_file(tree: Tree, subtree: Subtree = None):
+    """
+    Generates the text of a tree's GEDCOM file one record at a time, so neither the element tree nor the text of the
+    whole file is held in memory.
+    :param subtree: part of the tree to export instead of the whole tree
+    :return: generator of str
+    """
+    records = gen_records(tree) if subtree is None else gen_subtree_records(subtree)
+    for record in records:
+        yield record.to_gedcom_string(recursive=True)
+
+
+def generate_file(tree: Tree):
+    parser = Parser()
+    parser.parse([])
+    root = parser.get_root_element()
+    for record in gen_records(tree):
+        root.add_child_element(record)
     return root
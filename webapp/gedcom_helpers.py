@@ -8,26 +8,68 @@ from gedcom.element.family import FamilyElement
 from gedcom.element.individual import IndividualElement
 
 import webapp.tags_ext as tags
-from webapp.name_parser_ext import GedcomName
+from webapp.gedcom_dates import format_date
+from webapp.name_parser_ext import parse_name, parse_names
 
 
-def get_next_child_element(self: Element, tag=None, pointer=None, value=None):
-    def condition(value_to_match, value_to_check):
-        if value_to_match is None:
-            return True
-        elif isinstance(value_to_match, bool):
-            return bool(value_to_check) == value_to_match
-        elif isinstance(value_to_match, str):
-            return value_to_check == value_to_match
-        elif isinstance(value_to_match, (list, tuple, set)):
-            return value_to_check in value_to_match
-        else:
-            return False
+def get_child_index(self: Element):
+    """
+    Groups the children of an element by tag. The index is built on the first lookup and kept on the element; it is
+    rebuilt when children have been added since.
+    :param self: Element whose children will be indexed
+    :return: dict of tag to the list of children with that tag, in document order
+    """
+    children = self.get_child_elements()
+    cached = getattr(self, 'child_index', None)
+    if cached is None or cached[0] != len(children):
+        index = dict()
+        for child in children:
+            index.setdefault(child.get_tag(), []).append(child)
+        cached = (len(children), index)
+        self.child_index = cached
+    return cached[1]
+
+
+def matches(value_to_match, value_to_check):
+    if value_to_match is None:
+        return True
+    elif isinstance(value_to_match, bool):
+        return bool(value_to_check) == value_to_match
+    elif isinstance(value_to_match, str):
+        return value_to_check == value_to_match
+    elif isinstance(value_to_match, (list, tuple, set)):
+        return value_to_check in value_to_match
+    else:
+        return False
+
 
-    return next((child for child in self.get_child_elements()
-                 if condition(tag, child.get_tag())
-                 and condition(pointer, child.get_pointer())
-                 and condition(value, child.get_value())), None)
+def get_tag_candidates(self: Element, tag):
+    """
+    Narrows the children of an element down to those that can match a tag filter, using the child index when the
+    filter names tags.
+    """
+    if isinstance(tag, str):
+        return get_child_index(self).get(tag, ())
+    if isinstance(tag, (list, tuple, set)):
+        index = get_child_index(self)
+        buckets = [index[t] for t in tag if t in index]
+        if len(buckets) <= 1:
+            return buckets[0] if buckets else ()
+        # Children with different tags have to be returned in document order
+        return [child for child in self.get_child_elements() if child.get_tag() in tag]
+    return [child for child in self.get_child_elements() if matches(tag, child.get_tag())]
+
+
+def get_next_child_element(self: Element, tag=None, pointer=None, value=None):
+    """
+    Gets the first child element of the given element that meets the given conditions.
+    The conditions are the same as for filter_child_elements.
+    :return: the first matching child element, else None
+    """
+    if pointer is None and value is None:
+        return next(iter(get_tag_candidates(self, tag)), None)
+    return next((child for child in get_tag_candidates(self, tag)
+                 if matches(pointer, child.get_pointer()) and matches(value, child.get_value())), None)
 
 
 def filter_child_elements(self: Element, tag=None, pointer=None, value=None):
@@ -44,29 +86,14 @@ def filter_child_elements(self: Element, tag=None, pointer=None, value=None):
     :param value: value filter
     :return: a list of all child elements matching the filters
     """
-
-    def condition(value_to_match, value_to_check):
-        if value_to_match is None:
-            return True
-        elif isinstance(value_to_match, bool):
-            return bool(value_to_check) == value_to_match
-        elif isinstance(value_to_match, str):
-            return value_to_check == value_to_match
-        elif isinstance(value_to_match, (list, tuple, set)):
-            return value_to_check in value_to_match
-        else:
-            return False
-
-    return [child for child in self.get_child_elements()
-            if condition(tag, child.get_tag())
-            and condition(pointer, child.get_pointer())
-            and condition(value, child.get_value())]
+    return [child for child in get_tag_candidates(self, tag)
+            if matches(pointer, child.get_pointer()) and matches(value, child.get_value())]
 
 
 def get_name(self: IndividualElement):
     name = get_next_child_element(self, tag=tags.GEDCOM_TAG_NAME)
     if name is not None:
-        return GedcomName(name.get_value()).as_dict()
+        return parse_name(name.get_value())
     return get_name_dict_from_name_tags(self)
 
 
@@ -96,11 +123,11 @@ def get_names(self: IndividualElement):
     """
     Gets names from element.
     :param self:
-    :return: tuple of dicts of name parts for each name
+    :return: iterator of dicts of name parts for each name
     """
     names = filter_child_elements(self, tag=tags.GEDCOM_TAG_NAME)
     if names:
-        return (GedcomName(name.get_value()).as_dict() for name in names)
+        return iter(parse_names(name.get_value() for name in names))
     return get_name_dict_from_name_tags(self),
 
 
@@ -111,9 +138,9 @@ def get_value(self: Element, tag: str):
     :param tag: tag to look for
     :return: the value of child with the given tag, else empty string
     """
-    for child in self.get_child_elements():
-        if child.get_tag() == tag:
-            return child.get_value()
+    children = get_child_index(self).get(tag)
+    if children:
+        return children[0].get_value()
 
     return ""
 
@@ -213,8 +240,28 @@ def element_values_equals(element1: Element, element2: Element):
 
 
 def gen_ptr(model: Model):
-    return f"@{type(model).__name__.upper()}_{model.pk}@"
+    return format_ptr(type(model), model.pk)
+
+
+def format_ptr(model_class, pk):
+    """
+    Like gen_ptr, for when only the primary key of a row has been loaded.
+    """
+    return f"@{model_class.__name__.upper()}_{pk}@"
+
+
+def parse_ptr(ptr: str, model_class):
+    """
+    Gets the primary key back from a pointer made by gen_ptr.
+    :param ptr: pointer of a GEDCOM record, e.g. @PERSON_12@
+    :param model_class: model the pointer is expected to be for
+    :return: the primary key, or None if the pointer wasn't made by gen_ptr for the given model
+    """
+    prefix = f"@{model_class.__name__.upper()}_"
+    if ptr and ptr.startswith(prefix) and ptr.endswith('@') and ptr[len(prefix):-1].isdigit():
+        return int(ptr[len(prefix):-1])
+    return None
 
 
 def gedcom_date(date: datetime):
-    return date.strftime("%d %b %Y").upper()
+    return format_date(date)
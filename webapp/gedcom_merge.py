@@ -0,0 +1,279 @@
+import time
+from collections import defaultdict
+
+from django.db import transaction
+
+from webapp.gedcom_helpers import parse_ptr
+from webapp.gedcom_parsing import DEFAULT_BATCH_SIZE, BulkImporter, ImportStats, read_records
+from webapp.models import Tree, GraphLayout, Person, LegalName, AlternateName, Partnership, PersonPartnership
+from webapp.signals import bump_tree_version, deferred_version_bumps
+
+# Fields held by a GEDCOM file; other fields, like notes, keep the values they have in the tree
+LEGAL_NAME_FIELDS = ('prefix', 'first_name', 'middle_name', 'last_name', 'suffix')
+PERSON_FIELDS = ('gender', 'living', 'birth_date', 'birth_date_gedcom', 'birth_location_id', 'death_date',
+                 'death_date_gedcom', 'death_location_id')
+PARTNERSHIP_FIELDS = ('marital_status', 'marriage_date', 'marriage_date_gedcom', 'divorce_date', 'divorce_date_gedcom')
+
+
+def merge_file(f, tree, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Updates an existing tree to match a GEDCOM file, typically a newer export of the same tree. Only the rows that
+    differ from the file are written.
+    :param f: binary stream or list of lines of the GEDCOM file
+    :param tree: tree to update
+    :param batch_size: number of rows per INSERT or UPDATE statement
+    :param progress: optional callable that is passed the number of records read so far after each record
+    :return: the MergeStats of the merge
+    """
+    start = time.perf_counter()
+    importer = MergeImporter(tree, batch_size=batch_size)
+    read_records(f, importer, progress)
+    with transaction.atomic():
+        # Merges of the same tree have to run one after the other
+        Tree.objects.select_for_update().filter(pk=tree.pk).exists()
+        with deferred_version_bumps():
+            importer.save()
+            # Bulk writes don't send the signals that bump the version
+            changed = importer.stats.total_rows or importer.stats.total_updated or importer.stats.total_deleted
+            if changed:
+                bump_tree_version(tree.pk)
+        if changed:
+            # Any stored graph layout of the tree may be reached by the merged rows
+            GraphLayout.objects.filter(tree=tree).delete()
+    importer.stats.seconds = time.perf_counter() - start
+    return importer.stats
+
+
+def format_counts(counts):
+    return ', '.join(f'{name}: {count}' for name, count in counts.items())
+
+
+class MergeStats(ImportStats):
+    """
+    ImportStats of a merge. rows only counts inserted rows; updated and deleted rows are counted separately.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.updated = dict()
+        self.deleted = dict()
+
+    def update(self, model, count=1):
+        name = model.__name__
+        self.updated[name] = self.updated.get(name, 0) + count
+
+    def delete(self, name, count=1):
+        self.deleted[name] = self.deleted.get(name, 0) + count
+
+    @property
+    def total_updated(self):
+        return sum(self.updated.values())
+
+    @property
+    def total_deleted(self):
+        return sum(self.deleted.values())
+
+    def __str__(self):
+        return f'{self.total_rows} inserted, {self.total_updated} updated and {self.total_deleted} deleted rows in ' \
+               f'{self.seconds:.2f}s [inserted: {format_counts(self.rows)}] [updated: {format_counts(self.updated)}] ' \
+               f'[deleted: {format_counts(self.deleted)}]'
+
+
+def copy_fields(source, target, fields):
+    """
+    Copies the fields that differ from source to target.
+    :return: True if any field differed
+    """
+    changed = False
+    for field in fields:
+        value = getattr(source, field)
+        if getattr(target, field) != value:
+            setattr(target, field, value)
+            changed = True
+    return changed
+
+
+def match_records(ptrs, fingerprints, existing, model_class, existing_fingerprint):
+    """
+    Matches the records of a file to existing rows. Pointers made by gen_ptr, which exports use, are matched first;
+    records without such a pointer are matched to a remaining row with the same fingerprint.
+    :param ptrs: pointer of each record
+    :param fingerprints: fingerprint of each record
+    :param existing: dict of primary key to existing row
+    :param model_class: model of the rows
+    :param existing_fingerprint: callable that gets the fingerprint of an existing row
+    :return: tuple of the matched row (or None) for each record, and the list of rows that weren't matched
+    """
+    matches = [None] * len(ptrs)
+    unmatched = dict(existing)
+    for i, ptr in enumerate(ptrs):
+        pk = parse_ptr(ptr, model_class)
+        if pk in unmatched:
+            matches[i] = unmatched.pop(pk)
+
+    by_fingerprint = defaultdict(list)
+    for row in unmatched.values():
+        by_fingerprint[existing_fingerprint(row)].append(row)
+    for i, fingerprint in enumerate(fingerprints):
+        candidates = by_fingerprint.get(fingerprint)
+        if matches[i] is None and candidates:
+            matches[i] = candidates.pop(0)
+            del unmatched[matches[i].pk]
+
+    return matches, list(unmatched.values())
+
+
+def person_fingerprint(person, legal_name):
+    return tuple(legal_name), person.gender, person.birth_date, person.death_date
+
+
+def load_relations(model, tree):
+    """
+    :return: dict of partnership id to a dict of person id to relation id, for every relation of the tree's
+        partnerships
+    """
+    relations = defaultdict(dict)
+    for pk, partnership_id, person_id in model.objects.filter(partnership__tree=tree) \
+            .values_list('pk', 'partnership_id', 'person_id'):
+        relations[partnership_id][person_id] = pk
+    return relations
+
+
+class MergeImporter(BulkImporter):
+    """
+    Reads records like BulkImporter, but save() updates the rows of an existing tree instead of creating new ones.
+
+    Records are matched to existing people and partnerships by match_records. Matched rows are only updated when one
+    of their GEDCOM fields changed, records without a match are inserted and rows without a record are deleted, so the
+    number of writes follows the size of the change rather than the size of the tree.
+    """
+
+    def __init__(self, tree, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(tree, batch_size)
+        self.stats = MergeStats()
+        self.family_ptrs = list()
+
+    def add_family(self, element):
+        super().add_family(element)
+        self.family_ptrs.append(element.get_pointer())
+
+    def save(self):
+        self.save_locations()
+        person_ids = self.merge_persons()
+        self.merge_families(person_ids)
+
+    def merge_persons(self):
+        """
+        :return: dict of the pointer of each individual in the file to the primary key of its person
+        """
+        existing = {person.pk: person for person in Person.objects.filter(tree=self.tree).select_related('legal_name')}
+        matches, removed = match_records(
+            self.person_ptrs,
+            [person_fingerprint(person, legal_name) for person, legal_name in zip(self.persons, self.legal_names)],
+            existing, Person, lambda person: person_fingerprint(person, person.legal_name))
+        existing_alternate_names = defaultdict(list)
+        for alternate_name in AlternateName.objects.filter(person__tree=self.tree).order_by('pk'):
+            existing_alternate_names[alternate_name.person_id].append(alternate_name)
+
+        changed_legal_names, changed_persons, stale_alternate_names = list(), list(), list()
+        new_persons, new_alternate_names = list(), list()
+        records = zip(self.persons, self.legal_names, self.alternate_names, matches)
+        for person, legal_name, alternate_names, current in records:
+            if current is None:
+                new_persons.append((person, legal_name, alternate_names))
+                continue
+
+            if person.living == Person.UNKNOWN and current.living == Person.ALIVE:
+                # GEDCOM only records that a person died
+                person.living = current.living
+            if copy_fields(legal_name, current.legal_name, LEGAL_NAME_FIELDS):
+                changed_legal_names.append(current.legal_name)
+            if copy_fields(person, current, PERSON_FIELDS):
+                changed_persons.append(current)
+
+            current_alternate_names = existing_alternate_names[current.pk]
+            if [tuple(name) for name in alternate_names] != [tuple(name) for name in current_alternate_names]:
+                stale_alternate_names.extend(current_alternate_names)
+                for alternate_name in alternate_names:
+                    alternate_name.person = current
+                    new_alternate_names.append(alternate_name)
+
+        for person in removed:
+            stale_alternate_names.extend(existing_alternate_names[person.pk])
+        self.delete(AlternateName, [alternate_name.pk for alternate_name in stale_alternate_names])
+        # Deleting a legal name deletes its person, along with the person's partner and child relations
+        self.delete(LegalName, [person.legal_name_id for person in removed])
+
+        self.bulk_update(LegalName, changed_legal_names, LEGAL_NAME_FIELDS)
+        self.bulk_update(Person, changed_persons, PERSON_FIELDS)
+
+        self.bulk_create(LegalName, [legal_name for person, legal_name, alternate_names in new_persons])
+        for person, legal_name, alternate_names in new_persons:
+            person.legal_name = legal_name
+        self.bulk_create(Person, [person for person, legal_name, alternate_names in new_persons])
+        for person, legal_name, alternate_names in new_persons:
+            for alternate_name in alternate_names:
+                alternate_name.person = person
+                new_alternate_names.append(alternate_name)
+        self.bulk_create(AlternateName, new_alternate_names)
+
+        return {ptr: (current or person).pk for ptr, person, current in zip(self.person_ptrs, self.persons, matches)}
+
+    def merge_families(self, person_ids):
+        partnership_children = Partnership.children.through
+        existing = {partnership.pk: partnership for partnership in Partnership.objects.filter(tree=self.tree)}
+        existing_partners = load_relations(PersonPartnership, self.tree)
+        existing_children = load_relations(partnership_children, self.tree)
+
+        families = [(partnership, [person_ids[ptr] for ptr in partner_ptrs], [person_ids[ptr] for ptr in child_ptrs])
+                    for partnership, partner_ptrs, child_ptrs in self.families]
+        matches, removed = match_records(
+            self.family_ptrs,
+            [(frozenset(partner_ids), partnership.marriage_date) for partnership, partner_ids, child_ids in families],
+            existing, Partnership,
+            lambda partnership: (frozenset(existing_partners[partnership.pk]), partnership.marriage_date))
+
+        changed_partnerships, new_partnerships, stale_relations = list(), list(), defaultdict(list)
+        new_relations = defaultdict(list)
+        for (partnership, partner_ids, child_ids), current in zip(families, matches):
+            if current is None:
+                new_partnerships.append((partnership, partner_ids, child_ids))
+                continue
+
+            if copy_fields(partnership, current, PARTNERSHIP_FIELDS):
+                changed_partnerships.append(current)
+            for model, relations, person_ids in ((PersonPartnership, existing_partners[current.pk], partner_ids),
+                                                 (partnership_children, existing_children[current.pk], child_ids)):
+                stale_relations[model].extend(pk for person_id, pk in relations.items() if person_id not in person_ids)
+                new_relations[model].extend(model(partnership_id=current.pk, person_id=person_id)
+                                            for person_id in dict.fromkeys(person_ids) if person_id not in relations)
+
+        # Deleting a partnership deletes its relations
+        self.delete(Partnership, [partnership.pk for partnership in removed])
+        for model, pks in stale_relations.items():
+            self.delete(model, pks)
+
+        self.bulk_update(Partnership, changed_partnerships, PARTNERSHIP_FIELDS)
+
+        self.bulk_create(Partnership, [partnership for partnership, partner_ids, child_ids in new_partnerships])
+        for partnership, partner_ids, child_ids in new_partnerships:
+            for model, person_ids in ((PersonPartnership, partner_ids), (partnership_children, child_ids)):
+                new_relations[model].extend(model(partnership_id=partnership.pk, person_id=person_id)
+                                            for person_id in person_ids)
+        self.bulk_create(PersonPartnership, new_relations[PersonPartnership])
+        self.bulk_create(partnership_children, new_relations[partnership_children])
+
+    def bulk_create(self, model, objs):
+        if objs:
+            super().bulk_create(model, objs)
+
+    def bulk_update(self, model, objs, fields):
+        if objs:
+            model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+            self.stats.update(model, len(objs))
+
+    def delete(self, model, pks):
+        for i in range(0, len(pks), self.batch_size):
+            count, counts = model.objects.filter(pk__in=pks[i:i + self.batch_size]).delete()
+            for label, count in counts.items():
+                self.stats.delete(label.rpartition('.')[2], count)
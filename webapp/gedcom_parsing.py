@@ -1,19 +1,73 @@
-import datetime
+import time
+import uuid
 from typing import Dict
 
+from django.db import transaction
 from gedcom.element.family import FamilyElement
 from gedcom.element.individual import IndividualElement
 from gedcom.parser import Parser
 
 import webapp.tags_ext as tags
+from webapp.gedcom_dates import parse_date
 from webapp.gedcom_helpers import get_value, get_names, get_next_child_element, filter_child_elements
+from webapp.gedcom_stream import iter_records
+from webapp.location_resolver import LocationResolver
 from webapp.models import Tree, Person, LegalName, AlternateName, Name, Partnership, PersonPartnership
+from webapp.signals import deferred_version_bumps
 from webapp.submodels.location_model import Location
 
+# Number of rows sent to the database per INSERT statement by the bulk importer
+DEFAULT_BATCH_SIZE = 1000
 
-def parse_file(f, user, title):
-    root = get_root_element(f)
 
+def parse_file(f, user, title, batch_size=DEFAULT_BATCH_SIZE):
+    tree, stats = import_file(f, user, title, batch_size=batch_size)
+    return tree
+
+
+def import_file(f, user, title, batch_size=DEFAULT_BATCH_SIZE, bulk=True, progress=None):
+    """
+    Imports a GEDCOM file into a new tree.
+    :param f: binary stream or list of lines of the GEDCOM file
+    :param user: creator of the new tree
+    :param title: title of the new tree
+    :param batch_size: number of rows per INSERT when bulk is True
+    :param bulk: use the BulkImporter; when False, rows are saved one at a time with RowImporter
+    :param progress: optional callable that is passed the number of records read so far after each record
+    :return: tuple of the created tree and the ImportStats of the import
+    """
+    start = time.perf_counter()
+    if bulk:
+        # Nothing is written while reading, so reading happens outside the transaction and progress reported from it
+        # can be committed by the caller.
+        importer = BulkImporter(batch_size=batch_size)
+        read_records(f, importer, progress)
+        with transaction.atomic():
+            importer.tree = create_tree(user, title)
+            importer.save()
+    else:
+        # Every saved row would bump the new tree's version otherwise
+        with transaction.atomic(), deferred_version_bumps():
+            importer = RowImporter(create_tree(user, title))
+            read_records(f, importer, progress)
+            importer.save()
+
+    importer.stats.seconds = time.perf_counter() - start
+    return importer.tree, importer.stats
+
+
+def read_records(f, importer, progress=None):
+    # Records are read one at a time so the whole file never has to be held as an element tree
+    for count, record in enumerate(iter_records(f), 1):
+        if record.get_tag() == tags.GEDCOM_TAG_INDIVIDUAL:
+            importer.add_individual(record)
+        elif record.get_tag() == tags.GEDCOM_TAG_FAMILY:
+            importer.add_family(record)
+        if progress is not None:
+            progress(count)
+
+
+def create_tree(user, title):
     tree = Tree()
     tree.title = title
     tree.save()
@@ -21,22 +75,162 @@ def parse_file(f, user, title):
     tree.creator = user
     tree.authorized_users.add(user)
     tree.save()
+    return tree
 
-    persons = dict()
-    family_elements = list()
-    for child_element in root.get_child_elements():
-        if type(child_element) is IndividualElement:
-            # noinspection PyTypeChecker
-            ptr, person = parse_individual(child_element, tree)
-            persons[ptr] = person
-        elif type(child_element) is FamilyElement:
-            family_elements.append(child_element)
-
-    for family_element in family_elements:
-        # noinspection PyTypeChecker
-        parse_family(family_element, persons, tree)
 
-    return tree
+class ImportStats:
+    """
+    Row counts and timing of a single import, used to compare import strategies.
+    """
+
+    def __init__(self):
+        self.rows = dict()
+        self.seconds = 0.0
+
+    def add(self, model, count=1):
+        name = model.__name__
+        self.rows[name] = self.rows.get(name, 0) + count
+
+    @property
+    def total_rows(self):
+        return sum(self.rows.values())
+
+    @property
+    def rows_per_second(self):
+        return self.total_rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        counts = ', '.join(f'{name}: {count}' for name, count in self.rows.items())
+        return f'{self.total_rows} rows in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s) [{counts}]'
+
+
+class RowImporter:
+    """
+    Saves every row as soon as it is parsed. Families are kept until save() since they may reference individuals
+    that appear later in the file.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.stats = ImportStats()
+        self.locations = LocationResolver(preload=True)
+        self.persons = dict()
+        self.family_elements = list()
+
+    def add_individual(self, element: IndividualElement):
+        ptr, legal_name, alternate_names, person = build_individual(element, self.tree, self.locations)
+        self.locations.save()
+        save_individual(legal_name, alternate_names, person)
+        self.persons[ptr] = person
+        self.stats.add(LegalName)
+        self.stats.add(AlternateName, len(alternate_names))
+        self.stats.add(Person)
+
+    def add_family(self, element: FamilyElement):
+        self.family_elements.append(element)
+
+    def save(self):
+        for family_element in self.family_elements:
+            parse_family(family_element, self.persons, self.tree)
+            self.stats.add(Partnership)
+            self.stats.add(PersonPartnership, len(get_partner_ptrs(family_element)))
+            self.stats.add(Partnership.children.through, len(get_child_ptrs(family_element)))
+
+
+class BulkImporter:
+    """
+    Builds every row of an import in memory, then writes each model with batched bulk_create calls.
+
+    Rows are written in dependency order (names, people, alternate names, partnerships, then the through tables) so
+    that GEDCOM pointers like @I1@ can be resolved to primary keys between phases. Rows are marked with the importer's
+    import_token, so their keys can be read back even while other rows are added to the tree.
+
+    The tree may be left out until save() is called; every row is assigned to it then.
+    """
+
+    def __init__(self, tree=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.tree = tree
+        self.batch_size = batch_size
+        self.stats = ImportStats()
+        self.import_token = uuid.uuid4()
+        self.locations = LocationResolver(preload=True, batch_size=batch_size)
+        self.person_ptrs = list()
+        self.legal_names = list()
+        self.persons = list()
+        self.alternate_names = list()
+        self.families = list()
+
+    def add_individual(self, element: IndividualElement):
+        ptr, legal_name, alternate_names, person = build_individual(element, self.tree, self.locations)
+        self.person_ptrs.append(ptr)
+        self.legal_names.append(legal_name)
+        self.persons.append(person)
+        self.alternate_names.append(alternate_names)
+
+    def add_family(self, element: FamilyElement):
+        self.families.append((build_family(element, self.tree), get_partner_ptrs(element), get_child_ptrs(element)))
+
+    def save_locations(self):
+        """
+        Saves the new locations, and sets their primary keys on the people they are the birth or death location of.
+        """
+        self.locations.save()
+        for person in self.persons:
+            # The locations didn't have primary keys yet when they were assigned
+            if person.birth_location is not None:
+                person.birth_location_id = person.birth_location.pk
+            if person.death_location is not None:
+                person.death_location_id = person.death_location.pk
+
+    def save(self):
+        self.save_locations()
+        for legal_name in self.legal_names:
+            legal_name.tree = self.tree
+        self.bulk_create(LegalName, self.legal_names)
+        for person, legal_name in zip(self.persons, self.legal_names):
+            person.tree = self.tree
+            person.legal_name = legal_name
+        self.bulk_create(Person, self.persons)
+        person_ids = {ptr: person.pk for ptr, person in zip(self.person_ptrs, self.persons)}
+
+        alternate_names = list()
+        for person, person_alternate_names in zip(self.persons, self.alternate_names):
+            for alternate_name in person_alternate_names:
+                alternate_name.person = person
+                alternate_name.tree = self.tree
+                alternate_names.append(alternate_name)
+        self.bulk_create(AlternateName, alternate_names)
+
+        partnerships = [partnership for partnership, partner_ptrs, child_ptrs in self.families]
+        for partnership in partnerships:
+            partnership.tree = self.tree
+        self.bulk_create(Partnership, partnerships)
+
+        partnership_children = Partnership.children.through
+        person_partnerships = list()
+        children = list()
+        for partnership, partner_ptrs, child_ptrs in self.families:
+            person_partnerships.extend(PersonPartnership(partnership_id=partnership.pk, person_id=person_ids[ptr])
+                                       for ptr in partner_ptrs)
+            children.extend(partnership_children(partnership_id=partnership.pk, person_id=person_ids[ptr])
+                            for ptr in child_ptrs)
+        self.bulk_create(PersonPartnership, person_partnerships)
+        self.bulk_create(partnership_children, children)
+
+    def bulk_create(self, model, objs):
+        has_token = any(field.name == 'import_token' for field in model._meta.concrete_fields)
+        if has_token:
+            for obj in objs:
+                obj.import_token = self.import_token
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.stats.add(model, len(objs))
+        if objs and objs[0].pk is None and has_token:
+            # Not every backend (e.g. MySQL) returns primary keys from bulk inserts, so read back the newest rows of
+            # this import. Keys may have gaps where other inserts were interleaved, but increase in insertion order.
+            pks = model.objects.filter(import_token=self.import_token).order_by('-pk') \
+                .values_list('pk', flat=True)[:len(objs)]
+            for obj, pk in zip(objs, reversed(pks)):
+                obj.pk = pk
 
 
 def get_root_element(f):
@@ -47,17 +241,39 @@ def get_root_element(f):
 
 
 def parse_event_date(event_element):
-    date = get_value(event_element, tags.GEDCOM_TAG_DATE)
-    # TODO: Support other date formats. Some require alternate date storage formats, like a custom string, or a range,
-    #  or just a year.
-    try:
-        return datetime.datetime.strptime(date, "%d %b %Y").date()
-    except ValueError:
-        return None
-
-
-def parse_event_location(event_element):
-    place = get_value(event_element, tags.GEDCOM_TAG_PLACE)
+    """
+    :return: the earliest day of the event's date, or None if it has no date that can be parsed
+    """
+    gedcom_date = parse_date(get_value(event_element, tags.GEDCOM_TAG_DATE))
+    return gedcom_date.date if gedcom_date else None
+
+
+def parse_event_date_fields(event_element):
+    """
+    Gets the values to store for an event's date.
+    :return: tuple of the date for the DateField, and the GEDCOM date value if the date isn't an exact day
+    """
+    gedcom_date = parse_date(get_value(event_element, tags.GEDCOM_TAG_DATE))
+    if gedcom_date is None:
+        return None, ''
+    return gedcom_date.date, '' if gedcom_date.is_exact else gedcom_date.to_gedcom()
+
+
+def parse_event_location(event_element, locations: LocationResolver = None):
+    """
+    Gets the Location of an event's place.
+    :param event_element: element with a PLAC child
+    :param locations: resolver shared by an import; the Location it returns may not be saved yet. When omitted, the
+        Location is looked up or created immediately.
+    :return: the Location of the place
+    """
+    city, state, country = parse_place(get_value(event_element, tags.GEDCOM_TAG_PLACE))
+    if locations is None:
+        return LocationResolver().get_or_create(city, state, country)
+    return locations.resolve(city, state, country)
+
+
+def parse_place(place):
     parts = place.split(' ')
 
     city, state, country = '', '', ''
@@ -70,9 +286,7 @@ def parse_event_location(event_element):
     if len_parts >= 3:
         country = parse_country(parts[2])
 
-    location, created = Location.objects.get_or_create(city=city, state=state, country=country)
-
-    return location
+    return city, state, country
 
 
 def parse_country(country):
@@ -86,48 +300,63 @@ def parse_country(country):
 
 
 def parse_individual(element: IndividualElement, tree):
+    ptr, legal_name, alternate_names, person = build_individual(element, tree)
+    save_individual(legal_name, alternate_names, person)
+    return ptr, person
+
+
+def save_individual(legal_name, alternate_names, person):
+    legal_name.save()
+    person.legal_name = legal_name
+    person.save()
+
+    for alternate_name in alternate_names:
+        alternate_name.person = person
+        alternate_name.save()
+
+
+def build_individual(element: IndividualElement, tree, locations: LocationResolver = None):
+    """
+    Builds the unsaved rows for an individual. The caller is responsible for saving them and linking the person to
+    its names once they have primary keys.
+    :param locations: resolver for birth and death places; if given, it has to be saved before the person
+    :return: tuple of the pointer, legal name, list of alternate names and person
+    """
     child = Person()
 
     # get names from element
     names = list(get_names(element))
 
-    # save legal name
     # assumes first name in list is primary name
     legal_name = LegalName()
     parse_name_dict(names[0], legal_name)
     legal_name.tree = tree
-    legal_name.save()
-    child.legal_name = legal_name
 
-    # save alternate names
+    alternate_names = list()
     for name_dict in names[1:]:
         alternate_name = AlternateName()
         parse_name_dict(name_dict, alternate_name)
-        alternate_name.person = child
         alternate_name.tree = tree
-        alternate_name.save()
+        alternate_names.append(alternate_name)
 
     child.gender = parse_gender(get_value(element, tags.GEDCOM_TAG_SEX))
 
-    # Is saving related models necessary, or will it cascade?
     birth_event_element = get_next_child_element(element, tags.GEDCOM_TAG_BIRTH)
     if birth_event_element:
-        child.birth_date = parse_event_date(birth_event_element)
-        child.birth_location = parse_event_location(birth_event_element)
+        child.birth_date, child.birth_date_gedcom = parse_event_date_fields(birth_event_element)
+        child.birth_location = parse_event_location(birth_event_element, locations)
 
     death_event_element = get_next_child_element(element, tags.GEDCOM_TAG_DEATH)
     if death_event_element:
-        child.death_date = parse_event_date(death_event_element)
-        child.death_location = parse_event_location(death_event_element)
+        child.death_date, child.death_date_gedcom = parse_event_date_fields(death_event_element)
+        child.death_location = parse_event_location(death_event_element, locations)
         child.living = 'Dead'
 
     # living defaults to Unknown; change to living = has birth year and not has death year?
 
     child.tree = tree
 
-    child.save()
-
-    return element.get_pointer(), child
+    return element.get_pointer(), legal_name, alternate_names, child
 
 
 def parse_name_dict(name_dict, obj: Name):
@@ -144,6 +373,25 @@ def parse_name_dict(name_dict, obj: Name):
 
 
 def parse_family(element: FamilyElement, persons: Dict[str, Person], tree):
+    partnership = build_family(element, tree)
+    partnership.save()
+
+    # Create partner relations
+    for ptr in get_partner_ptrs(element):
+        person_partnership = PersonPartnership(partnership=partnership, person=persons[ptr])
+        person_partnership.save()
+
+    # Create children relations
+    partnership_children = Partnership.children.through
+    for ptr in get_child_ptrs(element):
+        relation = partnership_children(partnership=partnership)
+        relation.person = persons[ptr]
+        relation.save()
+
+    return partnership
+
+
+def build_family(element: FamilyElement, tree):
     partnership = Partnership()
 
     partnership.marital_status = Partnership.MaritalStatus.PARTNERED
@@ -151,31 +399,26 @@ def parse_family(element: FamilyElement, persons: Dict[str, Person], tree):
     marriage_event_element = get_next_child_element(element, tag=tags.GEDCOM_TAG_MARRIAGE)
     if marriage_event_element:
         partnership.marital_status = Partnership.MaritalStatus.MARRIED
-        partnership.marriage_date = parse_event_date(marriage_event_element)
+        partnership.marriage_date, partnership.marriage_date_gedcom = parse_event_date_fields(marriage_event_element)
         # TODO: add support for storing marriage location
 
     divorce_event_element = get_next_child_element(element, tag=tags.GEDCOM_TAG_DIVORCE)
     if divorce_event_element:
         partnership.marital_status = Partnership.MaritalStatus.DIVORCED
-        partnership.divorce_date = parse_event_date(divorce_event_element)
+        partnership.divorce_date, partnership.divorce_date_gedcom = parse_event_date_fields(divorce_event_element)
 
     partnership.tree = tree
 
-    partnership.save()
+    return partnership
 
-    # Create partner relations
-    for partner_element in filter_child_elements(element, tag=(tags.GEDCOM_TAG_HUSBAND, tags.GEDCOM_TAG_WIFE)):
-        person_partnership = PersonPartnership(partnership=partnership, person=persons[partner_element.get_value()])
-        person_partnership.save()
 
-    # Create children relations
-    partnership_children = Partnership.children.through
-    for child_element in filter_child_elements(element, tag=tags.GEDCOM_TAG_CHILD):
-        relation = partnership_children(partnership=partnership)
-        relation.person = persons[child_element.get_value()]
-        relation.save()
+def get_partner_ptrs(element: FamilyElement):
+    return [partner_element.get_value()
+            for partner_element in filter_child_elements(element, tag=(tags.GEDCOM_TAG_HUSBAND, tags.GEDCOM_TAG_WIFE))]
 
-    return partnership
+
+def get_child_ptrs(element: FamilyElement):
+    return [child_element.get_value() for child_element in filter_child_elements(element, tag=tags.GEDCOM_TAG_CHILD)]
 
 
 def parse_gender(gender: str):
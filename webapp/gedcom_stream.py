@@ -0,0 +1,107 @@
+import webapp.tags_ext as tags
+
+
+class Record:
+    """
+    Lightweight stand-in for gedcom.element.element.Element, produced by iter_records.
+
+    Only the getters used by gedcom_helpers and gedcom_parsing are implemented, so records can be passed anywhere an
+    Element is read from.
+    """
+    __slots__ = ('level', 'pointer', 'tag', 'value', 'children', 'child_index')
+
+    def __init__(self, level, pointer, tag, value):
+        self.level = level
+        self.pointer = pointer
+        self.tag = tag
+        self.value = value
+        self.children = []
+        self.child_index = None
+
+    def get_level(self):
+        return self.level
+
+    def get_pointer(self):
+        return self.pointer
+
+    def get_tag(self):
+        return self.tag
+
+    def get_value(self):
+        return self.value
+
+    def get_child_elements(self):
+        return self.children
+
+    def __repr__(self):
+        return f'{self.level} {self.pointer + " " if self.pointer else ""}{self.tag} {self.value}'.rstrip()
+
+
+def parse_line(line: str):
+    """
+    Splits a GEDCOM line into its parts.
+    :param line: level + ' ' + [pointer + ' ' +] tag + [' ' + value]
+    :return: tuple of level, pointer, tag and value, or None if the line is not a valid GEDCOM line
+    """
+    parts = line.split(' ', 2)
+    if len(parts) < 2 or not parts[0].isdigit():
+        return None
+
+    level = int(parts[0])
+    if parts[1][:1] == '@' and len(parts) == 3:
+        pointer = parts[1]
+        tag, _, value = parts[2].partition(' ')
+    else:
+        pointer = ''
+        tag = parts[1]
+        value = parts[2] if len(parts) == 3 else ''
+    return level, pointer, tag, value
+
+
+def iter_records(gedcom_stream):
+    """
+    Reads a GEDCOM stream one level 0 record (HEAD, SUBM, INDI, FAM, ...) at a time.
+
+    Unlike gedcom.parser.Parser, which builds the whole element tree before returning, only the record currently
+    being read is held in memory. Like the parser in non-strict mode, lines that can't be parsed are treated as a
+    CONC of the line before them.
+    :param gedcom_stream: a binary file stream, or a list of lines
+    :return: generator of Records
+    """
+    record = None
+    # open_elements[i] is the most recent element at level i of the current record
+    open_elements = []
+
+    for line in gedcom_stream:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig')
+        line = line.lstrip('\ufeff').rstrip('\r\n')
+        if not line:
+            continue
+
+        parts = parse_line(line)
+        if parts is None:
+            if not open_elements:
+                continue
+            parent = open_elements[-1]
+            element = Record(parent.level + 1, '', tags.GEDCOM_TAG_CONCATENATION, line)
+            parent.children.append(element)
+            continue
+
+        level, pointer, tag, value = parts
+        element = Record(level, pointer, tag, value)
+
+        if level == 0:
+            if record is not None:
+                yield record
+            record = element
+            open_elements = [element]
+        elif open_elements:
+            # Lines that skip levels are attached to the deepest open element
+            del open_elements[level:]
+            open_elements[-1].children.append(element)
+            element.level = len(open_elements)
+            open_elements.append(element)
+
+    if record is not None:
+        yield record
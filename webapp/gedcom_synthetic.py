@@ -0,0 +1,175 @@
+import random
+from collections import deque
+
+from gedcom.element.element import Element
+
+import webapp.tags_ext as tags
+from webapp.gedcom_dates import MONTHS
+from webapp.gedcom_helpers import create_family, create_individual
+
+# Given names alternate between male and female
+GIVEN_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+               'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen')
+SURNAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+            'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin')
+MONTH_NAMES = tuple(MONTHS)
+STATES = ('CA', 'TX', 'FL', 'NY', 'PA', 'IL', 'OH', 'GA', 'NC', 'MI')
+
+# Years after which people have no death date, so the newest generations are still alive
+LAST_DEATH_YEAR = 2020
+
+
+class SyntheticPerson:
+    def __init__(self, ptr, given_name, surname, sex, birth_year, generation):
+        self.ptr = ptr
+        self.given_name = given_name
+        self.surname = surname
+        self.sex = sex
+        self.birth_year = birth_year
+        self.birth_date = None
+        self.birth_place = None
+        self.death_date = None
+        self.death_place = None
+        self.generation = generation
+        self.family_spouse_ptrs = list()
+        self.family_child_ptr = None
+
+
+class SyntheticFamily:
+    def __init__(self, ptr, husband, wife, children):
+        self.ptr = ptr
+        self.husband = husband
+        self.wife = wife
+        self.children = children
+        self.marriage_date = None
+        self.marriage_place = None
+
+
+class SyntheticTree:
+    """
+    Generates a family tree of a given number of individuals, for benchmarks.
+
+    People born into the tree marry a spouse from outside of it and have children until max_generations is reached;
+    a new founding couple is started whenever every line has ended. The same arguments always generate the same tree.
+    """
+
+    def __init__(self, individuals, max_generations=8, children_per_family=3, remarriage_rate=0.1, names=20,
+                 places=50, seed=0):
+        """
+        :param individuals: number of individuals to generate
+        :param max_generations: depth of each founding couple's descendants
+        :param children_per_family: average number of children of a family
+        :param remarriage_rate: probability that a person has a second family with another spouse
+        :param names: number of distinct given names and surnames to draw from, to control repetition
+        :param places: number of distinct birth and death places to draw from
+        :param seed: seed of the random number generator
+        """
+        self.max_generations = max_generations
+        self.children_per_family = children_per_family
+        self.remarriage_rate = remarriage_rate
+        self.random = random.Random(seed)
+        self.given_names = [f'{GIVEN_NAMES[i % len(GIVEN_NAMES)]}{"" if i < len(GIVEN_NAMES) else i}'
+                            for i in range(names)]
+        self.surnames = [f'{SURNAMES[i % len(SURNAMES)]}{"" if i < len(SURNAMES) else i}' for i in range(names)]
+        self.places = [f'Town{i}, {STATES[i % len(STATES)]}, US' for i in range(places)]
+        self.persons = list()
+        self.families = list()
+        self.generate(individuals)
+
+    def generate(self, individuals):
+        unmarried = deque()
+        while len(self.persons) < individuals:
+            if not unmarried:
+                founder = self.add_person(None, 'M', self.random.randint(1700, 1750), 0)
+                unmarried.append(founder)
+                continue
+
+            person = unmarried.popleft()
+            if person.generation + 1 >= self.max_generations:
+                continue
+            marriages = 2 if self.random.random() < self.remarriage_rate else 1
+            for _ in range(marriages):
+                if len(self.persons) >= individuals:
+                    break
+                spouse = self.add_person(None, 'F' if person.sex == 'M' else 'M',
+                                         person.birth_year + self.random.randint(-5, 5), person.generation)
+                husband, wife = (person, spouse) if person.sex == 'M' else (spouse, person)
+                children = list()
+                for _ in range(self.random.randint(0, 2 * self.children_per_family)):
+                    if len(self.persons) >= individuals:
+                        break
+                    child = self.add_person(husband.surname, self.random.choice('MF'),
+                                            wife.birth_year + self.random.randint(18, 40), person.generation + 1)
+                    children.append(child)
+                    unmarried.append(child)
+                self.add_family(husband, wife, children)
+
+    def add_person(self, surname, sex, birth_year, generation):
+        given_names = self.given_names[sex == 'F'::2] or self.given_names
+        person = SyntheticPerson(f'@I{len(self.persons) + 1}@', self.random.choice(given_names),
+                                 surname or self.random.choice(self.surnames), sex, birth_year, generation)
+        person.birth_date = self.date(birth_year)
+        person.birth_place = self.random.choice(self.places)
+        death_year = birth_year + self.random.randint(1, 95)
+        if death_year <= LAST_DEATH_YEAR:
+            person.death_date = self.date(death_year)
+            person.death_place = self.random.choice(self.places)
+        self.persons.append(person)
+        return person
+
+    def add_family(self, husband, wife, children):
+        family = SyntheticFamily(f'@F{len(self.families) + 1}@', husband, wife, children)
+        husband.family_spouse_ptrs.append(family.ptr)
+        wife.family_spouse_ptrs.append(family.ptr)
+        for child in children:
+            child.family_child_ptr = family.ptr
+        family.marriage_date = self.date(max(husband.birth_year, wife.birth_year) + 18)
+        family.marriage_place = self.random.choice(self.places)
+        self.families.append(family)
+
+    def date(self, year):
+        return f'{self.random.randint(1, 28)} {self.random.choice(MONTH_NAMES)} {year}'
+
+    @staticmethod
+    def individual_element(person):
+        individual = create_individual(person.ptr, name=f'{person.given_name} /{person.surname}/', sex=person.sex,
+                                       birth_place=person.birth_place, birth_date=person.birth_date,
+                                       death_place=person.death_place, death_date=person.death_date,
+                                       family_child_ptr=person.family_child_ptr)
+        for family_ptr in person.family_spouse_ptrs:
+            individual.add_child_element(Element(1, '', tags.GEDCOM_TAG_FAMILY_SPOUSE, family_ptr))
+        return individual
+
+    @staticmethod
+    def family_element(family):
+        return create_family(family.ptr, husb_ptrs=(family.husband.ptr,), wife_ptrs=(family.wife.ptr,),
+                             child_ptrs=tuple(child.ptr for child in family.children),
+                             marriage_place=family.marriage_place, marriage_date=family.marriage_date)
+
+    def records(self):
+        """
+        :return: generator of the HEAD, INDI, FAM and TRLR records of the tree
+        """
+        head = Element(0, '', tags.GEDCOM_TAG_HEAD, '')
+        head.add_child_element(Element(1, '', tags.GEDCOM_TAG_CHARSET, tags.GEDCOM_CHARSET_UTF8))
+        gedcom = Element(1, '', tags.GEDCOM_TAG_GEDCOM, '')
+        gedcom.add_child_element(Element(2, '', tags.GEDCOM_TAG_VERSION, '5.5'))
+        gedcom.add_child_element(Element(2, '', tags.GEDCOM_TAG_FORM, 'Lineage-Linked'))
+        head.add_child_element(gedcom)
+        yield head
+        for person in self.persons:
+            yield self.individual_element(person)
+        for family in self.families:
+            yield self.family_element(family)
+        yield Element(0, '', tags.GEDCOM_TAG_TRAILER, '')
+
+    def lines(self):
+        """
+        :return: generator of the lines of the GEDCOM file, which can be passed to import_file
+        """
+        for record in self.records():
+            yield from record.to_gedcom_string(recursive=True).splitlines()
+
+    @property
+    def generations(self):
+        return max((person.generation for person in self.persons), default=-1) + 1
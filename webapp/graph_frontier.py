@@ -0,0 +1,107 @@
+import itertools
+import math
+from collections import defaultdict
+
+from webapp.graph_layout import TreeLayout
+from webapp.graphs import Graph
+from webapp.kinship import KinshipIndex
+from webapp.models import Person
+
+# Generations a single expansion may reach, so that each request stays small
+MAX_DEPTH = 3
+
+
+def resolve_node_ids(kinship: KinshipIndex, node_ids):
+    """
+    :return: the people and partnerships of the tree with these node ids; ids of other trees or that aren't node ids
+        are left out
+    """
+    model_objects = list()
+    for node_id in node_ids:
+        try:
+            model_name, pk = Graph.parse_id(node_id)
+        except ValueError:
+            continue
+        model_object = {'Person': kinship.persons, 'Partnership': kinship.partnerships}.get(model_name, {}).get(pk)
+        if model_object is not None:
+            model_objects.append(model_object)
+    return model_objects
+
+
+def parse_known(kinship: KinshipIndex, items):
+    """
+    :param items: node ids of the nodes the client shows, each optionally followed by its position relative to the
+        expanded node, like 'Person_1:50:-50'
+    :return: the people and partnerships of the tree among them, as resolve_node_ids, and the positions that were
+        given, of any node
+    :raises ValueError: if a position isn't a pair of numbers
+    """
+    node_ids, positions = list(), list()
+    for item in items:
+        node_id, *position = item.split(':')
+        node_ids.append(node_id)
+        if position:
+            x, y = (float(value) for value in position)
+            if not (math.isfinite(x) and math.isfinite(y)):
+                raise ValueError(f'Invalid position of {node_id}')
+            positions.append((x, y))
+    return resolve_node_ids(kinship, node_ids), positions
+
+
+def clear_shift(positions, occupied):
+    """
+    :param positions: (column, row) of the new nodes
+    :param occupied: (column, row) of the shown nodes
+    :return: the number of columns, a multiple of a half, with the least magnitude that the new nodes can be moved by
+        so that each of them is at least a column away from the shown nodes of its row
+    """
+    occupied_rows = defaultdict(list)
+    for column, row in occupied:
+        occupied_rows[round(row)].append(column)
+    # Once the new nodes are moved past every shown one they are clear of all of them
+    limit = max((abs(column) for column, row in itertools.chain(positions, occupied)), default=0) * 2 + 1
+    for step in range(0, math.ceil(limit * 2) + 1):
+        shift = (step + 1) // 2 / 2 if step % 2 else -(step // 2) / 2
+        if all(abs(column + shift - other) > 1 - 1e-6 for column, row in positions
+               for other in occupied_rows.get(round(row), ())):
+            return shift
+    return shift
+
+
+def get_frontier(kinship: KinshipIndex, model_object, known=(), depth=1, occupied=()):
+    """
+    Lays out the relatives of a node that the client doesn't show yet: for a person, the partnerships they are a
+    partner in with the other partners, and depth generations of ancestors; for a partnership, depth generations of
+    descendants with their partnerships and partners.
+    :param known: people and partnerships the client already shows; they aren't laid out again, and relatives are only
+        reached through them if they are the expanded node
+    :param occupied: (x, y) positions of the nodes the client shows, relative to the expanded node; the new nodes are
+        moved sideways together until none of them is on top of one of these
+    :return: dict like Graph.to_dict, of the new nodes, positioned relative to the expanded node, and the edges from or
+        to them
+    """
+    layout = TreeLayout(kinship)
+    for known_object in known:
+        layout.claim(known_object)
+    if isinstance(model_object, Person):
+        layout.add_family(model_object, ancestor_depth=depth, descendant_depth=0)
+    else:
+        layout.add_descendants(model_object, depth)
+
+    new_positions = {new_object: position for new_object, position in layout.positions.items()
+                     if new_object != model_object}
+    shift = clear_shift(new_positions.values(), [(x / Graph.padding, y / Graph.padding) for x, y in occupied])
+    for new_object, (column, row) in new_positions.items():
+        layout.positions[new_object] = (column + shift, row)
+
+    # The shown nodes are added first, so add_layout only adds the new ones but keeps the edges to the shown ones
+    graph = Graph(kinship)
+    shown_ids = {Graph.gen_id(shown_object) for shown_object in (model_object, *known)}
+    for node_id in shown_ids:
+        graph.add_node(Graph.Node(node_id))
+    graph.add_layout(layout)
+    return {
+        'nodes': [node.to_dict() for node in graph.nodes if node.id not in shown_ids],
+        'edges': [edge.to_dict() for edge in graph.edges
+                  if edge.source not in shown_ids or edge.target not in shown_ids],
+    }
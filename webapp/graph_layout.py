@@ -0,0 +1,229 @@
+import math
+
+from webapp.kinship import KinshipIndex, birth_order
+from webapp.models import Person
+
+
+class DescendantUnit:
+    """
+    A person with the partnerships they are a partner in, the other partners of these partnerships, and the
+    descendants of their children. Laid out as a row of the person, then each partnership followed by its other
+    partners, above the units of all the children side by side.
+    """
+
+    def __init__(self, person):
+        self.person = person
+        # tuples of the partnership, its other partners and the units of its children
+        self.families = list()
+        self.row_width = 1
+        self.children_width = 0
+
+    @property
+    def width(self):
+        return max(self.row_width, self.children_width)
+
+
+class AncestorFamily:
+    """
+    A partnership that a person is a child of, with the units of its partners. The partners are drawn centered on
+    their own ancestors when these are wider than the row of the partners, and next to each other otherwise.
+    """
+
+    def __init__(self, partnership, parents):
+        self.partnership = partnership
+        self.parents = parents
+        self.row_width = len(parents) + 1
+        self.parents_width = sum(parent.width for parent in parents)
+
+    @property
+    def width(self):
+        return max(self.row_width, self.parents_width)
+
+    @property
+    def compact(self):
+        return self.parents_width < self.row_width
+
+
+class AncestorUnit:
+    def __init__(self, person):
+        self.person = person
+        self.families = list()
+
+    @property
+    def width(self):
+        return max(1, sum(family.width for family in self.families))
+
+
+class TreeLayout:
+    """
+    Lays out the ancestors and descendants of people, in the spirit of the Reingold-Tilford tidy tree: the width of
+    every subtree is computed once, bottom up, and every subtree is then given its own range of columns, so subtrees
+    never overlap. Each person and partnership is visited once, so a layout takes time linear in its size.
+
+    Positions are in columns and rows: people and partnerships are one column apart, generations one row apart, and
+    descendants have higher rows than their ancestors. A person or partnership reached a second time, e.g. when
+    cousins married, is only placed the first time, but still gets the edges of every relation.
+    """
+
+    def __init__(self, kinship: KinshipIndex):
+        self.kinship = kinship
+        # people and partnerships that were reached, including the ones that were already placed by the caller
+        self.claimed = set()
+        # person or partnership -> (column, row)
+        self.positions = dict()
+
+    def claim(self, model_object):
+        """
+        :return: whether the person or partnership wasn't reached before
+        """
+        if model_object in self.claimed:
+            return False
+        self.claimed.add(model_object)
+        return True
+
+    def build_descendants(self, person, depth):
+        unit = DescendantUnit(person)
+        for partnership in self.kinship.partnerships_of(person):
+            if not self.claim(partnership):
+                continue
+            spouses = [partner for partner in self.kinship.partners_of(partnership)
+                       if partner != person and self.claim(partner)]
+            children = list()
+            if depth > 0:
+                children = [self.build_descendants(child, depth - 1)
+                            for child in self.kinship.children_of(partnership) if self.claim(child)]
+            unit.families.append((partnership, spouses, children))
+            unit.row_width += 1 + len(spouses)
+            unit.children_width += sum(child.width for child in children)
+        return unit
+
+    def build_ancestors(self, person, depth):
+        unit = AncestorUnit(person)
+        if depth > 0:
+            for partnership in self.kinship.parents_of(person):
+                if not self.claim(partnership):
+                    continue
+                parents = [self.build_ancestors(parent, depth - 1)
+                           for parent in self.kinship.partners_of(partnership) if self.claim(parent)]
+                unit.families.append(AncestorFamily(partnership, parents))
+        return unit
+
+    def place_descendants(self, unit: DescendantUnit, left, row):
+        column = left + (unit.width - unit.row_width) / 2 + 0.5
+        self.positions[unit.person] = (column, row)
+        for partnership, spouses, children in unit.families:
+            for model_object in (partnership, *spouses):
+                column += 1
+                self.positions[model_object] = (column, row)
+
+        child_left = left + (unit.width - unit.children_width) / 2
+        for partnership, spouses, children in unit.families:
+            for child in children:
+                self.place_descendants(child, child_left, row + 1)
+                child_left += child.width
+
+    def place_ancestors(self, unit: AncestorUnit, left, row):
+        """
+        Places the ancestors of a unit whose person is already placed, in the columns from left on.
+        """
+        for family in unit.families:
+            parents_left = left + (family.width - family.parents_width) / 2
+            middle = len(family.parents) // 2
+            if family.compact:
+                row_left = left + (family.width - family.row_width) / 2
+                columns = [row_left + i + (0.5 if i < middle else 1.5) for i in range(len(family.parents))]
+                partnership_column = row_left + middle + 0.5
+            else:
+                columns = list()
+                for i, parent in enumerate(family.parents):
+                    columns.append(parents_left + sum(p.width for p in family.parents[:i]) + parent.width / 2)
+                if len(family.parents) > 1:
+                    partnership_column = (columns[middle - 1] + columns[middle]) / 2
+                else:
+                    partnership_column = columns[0] + 0.5
+
+            self.positions[family.partnership] = (partnership_column, row - 1)
+            for parent, column in zip(family.parents, columns):
+                self.positions[parent.person] = (column, row - 1)
+                self.place_ancestors(parent, parents_left, row - 1)
+                parents_left += parent.width
+            left += family.width
+
+    def add_family(self, person, ancestor_depth=2, descendant_depth=2):
+        """
+        Places a person with their partners and descendant_depth generations of descendants, and ancestor_depth
+        generations of ancestors, with the person in column 0 of row 0.
+        """
+        self.claim(person)
+        descendants = self.build_descendants(person, descendant_depth)
+        ancestors = self.build_ancestors(person, ancestor_depth)
+        self.place_descendants(descendants, -descendants.width / 2, 0)
+        shift, row = self.positions[person]
+        for model_object, (column, model_row) in self.positions.items():
+            self.positions[model_object] = (column - shift, model_row)
+        self.place_ancestors(ancestors, -ancestors.width / 2, 0)
+        return self
+
+    def add_tree(self):
+        """
+        Places every person and partnership of the index, as the descendants of each person without parents side by
+        side, in order of birth, all of them in row 0. People who married into the tree are placed next to their
+        partners.
+        """
+        persons = sorted(self.kinship.persons.values(), key=lambda person: birth_order(person.birth_date, person.pk))
+        # People who married into a family are placed as partners by the family, so that they get its generation
+        married_in = {person for person in persons if not self.kinship.parents_of(person) and any(
+            self.kinship.parents_of(partner) for partnership in self.kinship.partnerships_of(person)
+            for partner in self.kinship.partners_of(partnership))}
+        # People whose parents aren't anyone's partners are only reached by the second pass
+        roots = [person for person in persons if not self.kinship.parents_of(person) and person not in married_in]
+        roots += persons
+        left = 0
+        for person in roots:
+            if self.claim(person):
+                unit = self.build_descendants(person, math.inf)
+                self.place_descendants(unit, left, 0)
+                left += unit.width
+        for partnership in self.kinship.partnerships.values():
+            # Partnerships without partners, or whose partners are in other trees
+            if self.claim(partnership):
+                self.positions[partnership] = (left + 0.5, 0)
+                left += 1
+        return self
+
+    def add_descendants(self, partnership, depth):
+        """
+        Places depth generations of descendants of a partnership that is at column 0 of row 0, centered under it.
+        """
+        self.claim(partnership)
+        children = [self.build_descendants(child, depth - 1)
+                    for child in self.kinship.children_of(partnership) if self.claim(child)]
+        left = -sum(child.width for child in children) / 2
+        for child in children:
+            self.place_descendants(child, left, 1)
+            left += child.width
+        return self
+
+    def add_ancestors(self, person, depth):
+        """
+        Places depth generations of ancestors of a person that is at column 0 of row 0, centered above them.
+        """
+        self.claim(person)
+        ancestors = self.build_ancestors(person, depth)
+        self.place_ancestors(ancestors, -ancestors.width / 2, 0)
+        return self
+
+    def edges(self):
+        """
+        :return: (source, target) pairs of the relations between the people and partnerships that were reached: from
+            each partner to its partnership, and from each partnership to its children
+        """
+        for model_object in self.claimed:
+            if isinstance(model_object, Person):
+                continue
+            for partner in self.kinship.partners_of(model_object):
+                if partner in self.claimed:
+                    yield partner, model_object
+            for child in self.kinship.children_of(model_object):
+                if child in self.claimed:
+                    yield model_object, child
@@ -0,0 +1,130 @@
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+from webapp.graph_layout import TreeLayout
+from webapp.graphs import Graph
+from webapp.kinship import MAX_CACHED_TREES, KinshipIndex
+from webapp.models import Person
+
+# Maximum number of nodes of an overview, by default and at most
+DEFAULT_BUDGET = 500
+MAX_BUDGET = 5000
+# Highest level of detail; its cells are wider than any tree, so it shows a whole tree as one cluster
+MAX_LEVEL = 40
+
+_layouts = OrderedDict()
+_layouts_lock = threading.Lock()
+
+
+def get_tree_layout(kinship: KinshipIndex):
+    """
+    Lays out the whole tree of a kinship index with TreeLayout.add_tree. The layouts of the MAX_CACHED_TREES most
+    recently used trees are kept in memory, for the version of the tree they were computed for.
+    :return: TreeLayout
+    """
+    key = (kinship.tree_id, kinship.version)
+    with _layouts_lock:
+        layout = _layouts.get(key)
+        if layout is not None:
+            _layouts.move_to_end(key)
+            return layout
+
+    layout = TreeLayout(kinship).add_tree()
+    with _layouts_lock:
+        for cached_key in [cached_key for cached_key in _layouts if cached_key[0] == kinship.tree_id]:
+            del _layouts[cached_key]
+        _layouts[key] = layout
+        while len(_layouts) > MAX_CACHED_TREES:
+            _layouts.popitem(last=False)
+    return layout
+
+
+def clear_layout_cache():
+    with _layouts_lock:
+        _layouts.clear()
+
+
+def cell_size(level):
+    """
+    :return: the number of columns and rows a cluster covers at a level of detail; level 0 shows every node, and each
+        level doubles the columns, and every other level the rows, so that subtrees are merged before generations
+    """
+    return 2 ** level, 2 ** (level // 2)
+
+
+def build_overview(kinship: KinshipIndex, budget=DEFAULT_BUDGET, viewport=None, level=0):
+    """
+    Gets the graph of a whole tree, or of the part of it in a viewport, with the people and partnerships that are close
+    to each other merged into cluster nodes so that there are at most budget nodes.
+    The tree is laid out by TreeLayout.add_tree and cut into cells of cell_size(level), from the requested level up to
+    the first one with at most budget non empty cells. A cell with a single person or partnership shows it like Graph
+    does, and a cell with more becomes a cluster node with their count. Edges between cells are merged as well.
+    :param viewport: (left, top, right, bottom) in the coordinates of the nodes; by default the whole tree
+    :param level: the lowest level of detail to use, at most MAX_LEVEL
+    :return: the Graph, and a dict of the level that was used and the size of the whole tree
+    """
+    layout = get_tree_layout(kinship)
+    padding = Graph.padding
+    positions = {model_object: (column * padding, row * padding)
+                 for model_object, (column, row) in layout.positions.items()}
+    if viewport is not None:
+        left, top, right, bottom = viewport
+        positions = {model_object: (x, y) for model_object, (x, y) in positions.items()
+                     if left <= x <= right and top <= y <= bottom}
+
+    level = min(level, MAX_LEVEL)
+    while True:
+        columns, rows = cell_size(level)
+        cells = defaultdict(list)
+        for model_object, (x, y) in positions.items():
+            cells[(math.floor(x / padding / columns), math.floor(y / padding / rows))].append(model_object)
+        if len(cells) <= budget or len(cells) == 1 or level == MAX_LEVEL:
+            break
+        level += 1
+
+    graph = Graph(kinship)
+    # person or partnership -> id of the node it is shown in
+    node_ids = dict()
+    for (cell_column, cell_row), members in cells.items():
+        if len(members) == 1:
+            model_object = members[0]
+            node_id = Graph.gen_id(model_object)
+            x, y = positions[model_object]
+            if isinstance(model_object, Person):
+                graph.add_node(Graph.Node(node_id, x, y, str(model_object)))
+            else:
+                graph.add_node(Graph.Node(node_id, x, y, size=1))
+        else:
+            node_id = f'Cluster_{level}_{cell_column}_{cell_row}'
+            people = sum(1 for model_object in members if isinstance(model_object, Person))
+            graph.add_node(Graph.Node(
+                node_id, sum(positions[member][0] for member in members) / len(members),
+                sum(positions[member][1] for member in members) / len(members), f'{people} people',
+                size=round(20 + 10 * math.log2(len(members))), count=people,
+                bounds=[cell_column * columns * padding, cell_row * rows * padding,
+                        (cell_column + 1) * columns * padding, (cell_row + 1) * rows * padding]))
+        for member in members:
+            node_ids[member] = node_id
+
+    for source, target in layout.edges():
+        source_id, target_id = node_ids.get(source), node_ids.get(target)
+        if source_id is not None and target_id is not None and source_id != target_id:
+            graph.add_edge(source_id, target_id)
+
+    columns = max((column for column, row in layout.positions.values()), default=0)
+    rows = max((row for column, row in layout.positions.values()), default=0)
+    return graph, {
+        'level': level,
+        'width': (columns + 1) * padding,
+        'height': (rows + 1) * padding,
+    }
+
+
+def get_overview(kinship: KinshipIndex, budget=DEFAULT_BUDGET, viewport=None, level=0):
+    """
+    Gets the overview of build_overview.
+    :return: dict like Graph.to_dict, with the level that was used and the size of the whole tree
+    """
+    graph, fields = build_overview(kinship, budget, viewport, level)
+    return {**graph.to_dict(), **fields}
@@ -1,30 +1,70 @@
+import json
+from collections import defaultdict
+from json.encoder import encode_basestring_ascii
+
 from django.db.models import Model
 
+from webapp.graph_layout import TreeLayout
+from webapp.kinship import KinshipIndex, get_kinship_index
 from webapp.models import Person
 
 
+def json_value(value):
+    """
+    Encodes a value like json.dumps, with fast paths for the types of node and edge attributes.
+    """
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if type(value) in (int, float):
+        return repr(value)
+    return json.dumps(value, separators=(',', ':'))
+
+
 class Graph:
     """
     For use with antv/G6; see https://g6.antv.vision/en
 
-    This class currently uses a lot of inefficient calls; they could probably be replaced with a caching system for
-    performance improvements
+    nodes and edges are sets, indexed by node id and by (source id, target id) so that looking one up doesn't scan
+    the whole graph. They must only be changed through the add and remove methods, which keep the indexes in sync.
+
+    Relatives are looked up in the KinshipIndex of the tree, so adding them doesn't query the database. The graph
+    shows the tree as it was when the index was loaded. They are positioned by a TreeLayout, one padding apart.
     """
     padding = 50
 
-    def __init__(self):
+    def __init__(self, kinship: KinshipIndex = None):
+        """
+        :param kinship: index of the tree to draw; by default, the cached index of the tree of the first person or
+            partnership that is added
+        """
+        self.kinship = kinship
         self.added_people = set()
         self.nodes = set()
         self.edges = set()
+        # node id -> node
+        self.node_index = dict()
+        # (source id, target id) -> edge
+        self.edge_index = dict()
+        # node id -> keys in edge_index of the edges from or to the node, which may be added before the node itself;
+        # lists, which take less memory than sets for the few edges of a node
+        self.adjacency = defaultdict(list)
 
     class Node:
-        def __init__(self, id_, x=None, y=None, label=None, **kwargs):
+        """
+        Slotted, since big graphs have many nodes: the attributes G6 takes that are seldom used are kept together in
+        extra, which is None for most nodes.
+        """
+        __slots__ = ('id', 'x', 'y', 'label', 'size', 'extra')
+
+        def __init__(self, id_, x=None, y=None, label=None, size=None, **kwargs):
             self.id = id_
             self.x = x
             self.y = y
             self.label = label
-            for kwarg in kwargs:
-                setattr(self, kwarg, kwargs[kwarg])
+            self.size = size
+            self.extra = kwargs or None
 
         def __eq__(self, other):
             return self.id == other.id
@@ -33,18 +73,36 @@ class Graph:
             return hash(self.id)
 
         def __str__(self):
-            return str(vars(self))
+            return str(self.to_dict())
 
         def __repr__(self):
-            return str(vars(self))
+            return str(self.to_dict())
+
+        def to_dict(self):
+            node = {'id': self.id, 'x': self.x, 'y': self.y, 'label': self.label}
+            if self.size is not None:
+                node['size'] = self.size
+            if self.extra:
+                node.update(self.extra)
+            return node
+
+        def to_json(self):
+            node = f'{{"id":{json_value(self.id)},"x":{json_value(self.x)},"y":{json_value(self.y)},' \
+                   f'"label":{json_value(self.label)}'
+            if self.size is not None:
+                node += f',"size":{json_value(self.size)}'
+            if self.extra:
+                node += ''.join(f',{json_value(key)}:{json_value(value)}' for key, value in self.extra.items())
+            return node + '}'
 
     class Edge:
+        __slots__ = ('source', 'target', 'label', 'extra')
+
         def __init__(self, source_id, target_id, label=None, **kwargs):
             self.source = source_id
             self.target = target_id
             self.label = label
-            for kwarg in kwargs:
-                setattr(self, kwarg, kwargs[kwarg])
+            self.extra = kwargs or None
 
         def __eq__(self, other):
             return self.source == other.source and self.target == other.target
@@ -53,30 +111,62 @@ class Graph:
             return hash((self.source, self.target))
 
         def __str__(self):
-            return str(vars(self))
+            return str(self.to_dict())
 
         def __repr__(self):
-            return str(vars(self))
+            return str(self.to_dict())
+
+        def to_dict(self):
+            edge = {'source': self.source, 'target': self.target, 'label': self.label}
+            if self.extra:
+                edge.update(self.extra)
+            return edge
+
+        def to_json(self):
+            edge = f'{{"source":{json_value(self.source)},"target":{json_value(self.target)},' \
+                   f'"label":{json_value(self.label)}'
+            if self.extra:
+                edge += ''.join(f',{json_value(key)}:{json_value(value)}' for key, value in self.extra.items())
+            return edge + '}'
 
     @staticmethod
     def gen_id(model_object):
         return f'{type(model_object).__name__}_{model_object.pk}'
 
+    @staticmethod
+    def parse_id(node_id):
+        """
+        :return: the model name and primary key of a node id made by gen_id
+        :raises ValueError: if node_id isn't one
+        """
+        model_name, pk = node_id.rsplit('_', 1)
+        return model_name, int(pk)
+
+    def get_kinship(self, model_object):
+        if self.kinship is None:
+            self.kinship = get_kinship_index(model_object.tree_id)
+        return self.kinship
+
     def get_node(self, arg):
-        if isinstance(arg, Model):
-            return next(node for node in self.nodes if node.id == self.gen_id(arg))
-        else:
-            return next(node for node in self.nodes if node.id == arg)
+        """
+        :param arg: id of the node, or the model object it was added for
+        :raises KeyError: if there is no such node
+        """
+        return self.node_index[self.gen_id(arg) if isinstance(arg, Model) else arg]
 
     def add_node(self, node):
-        if node not in self.nodes:
+        if node.id not in self.node_index:
             self.nodes.add(node)
+            self.node_index[node.id] = node
         else:
             raise ValueError("Tried to add duplicate node")
 
     def remove_node(self, node):
         self.nodes.remove(node)
-        self.edges = [edge for edge in self.edges if edge.source != node.id and edge.target != node.id]
+        del self.node_index[node.id]
+        # An edge from the node to itself is listed twice
+        for source_id, target_id in dict.fromkeys(self.adjacency.get(node.id, ())):
+            self.remove_edge(source_id, target_id)
 
     def add_person(self, person, x=0, y=0):
         self.add_node(self.Node(self.gen_id(person), x, y, str(person)))
@@ -87,96 +177,90 @@ class Graph:
         self.added_people.remove(person)
 
     def add_edge(self, source_id, target_id):
-        self.edges.add(self.Edge(source_id, target_id))
+        key = (source_id, target_id)
+        if key not in self.edge_index:
+            edge = self.Edge(source_id, target_id)
+            self.edges.add(edge)
+            self.edge_index[key] = edge
+            self.adjacency[source_id].append(key)
+            self.adjacency[target_id].append(key)
 
     def get_edge(self, source_id, target_id):
-        return next(edge for edge in self.edges if edge.source == source_id and edge.target == target_id)
+        """
+        :raises KeyError: if there is no such edge
+        """
+        return self.edge_index[(source_id, target_id)]
 
     def remove_edge(self, source_id, target_id):
-        self.edges.remove(self.Edge(source_id, target_id))
+        key = (source_id, target_id)
+        self.edges.remove(self.edge_index.pop(key))
+        for node_id in key:
+            edge_keys = self.adjacency[node_id]
+            edge_keys.remove(key)
+            if not edge_keys:
+                del self.adjacency[node_id]
 
     def add_partnership(self, partnership, x=0, y=0, padding_mult=1):
+        """
+        Adds a partnership with its partners in a row, the first half of the partners left of it and the others right
+        of it. Partners that are already in the graph keep their node.
+        """
         self.add_node(self.Node(self.gen_id(partnership), x, y, size=1))
-        partners = partnership.partners()
-        if len(partners) == 2:
-            self.add_person(partners[0], x - self.padding * padding_mult, y)
-            self.add_person(partners[1], x + self.padding * padding_mult, y)
-            self.add_edge(self.gen_id(partners[0]), self.gen_id(partnership))
-            self.add_edge(self.gen_id(partners[1]), self.gen_id(partnership))
-        # TODO: add logic for other numbers of partners
+        partners = self.get_kinship(partnership).partners_of(partnership)
+        middle = len(partners) // 2
+        for i, partner in enumerate(partners):
+            column = i - middle if i < middle else i - middle + 1
+            if self.gen_id(partner) not in self.node_index:
+                self.add_person(partner, x + column * self.padding * padding_mult, y)
+            self.add_edge(self.gen_id(partner), self.gen_id(partnership))
+
+    def add_layout(self, layout: TreeLayout, x=0, y=0):
+        """
+        Adds the people and partnerships placed by a layout, with its column 0 of row 0 at (x, y), and the edges between
+        them and the nodes that are already in the graph. People and partnerships that are already in the graph keep
+        their node.
+        """
+        for model_object, (column, row) in layout.positions.items():
+            node_id = self.gen_id(model_object)
+            if node_id in self.node_index:
+                continue
+            if isinstance(model_object, Person):
+                self.add_person(model_object, x + column * self.padding, y + row * self.padding)
+            else:
+                self.add_node(self.Node(node_id, x + column * self.padding, y + row * self.padding, size=1))
+        for source, target in layout.edges():
+            source_id, target_id = self.gen_id(source), self.gen_id(target)
+            if source_id in self.node_index and target_id in self.node_index:
+                self.add_edge(source_id, target_id)
+
+    def add_family(self, person, ancestor_depth=2, descendant_depth=2, x=0, y=0):
+        """
+        Adds a person at (x, y) with all their partnerships and partners, descendant_depth generations of descendants
+        below them and ancestor_depth generations of ancestors above them.
+        """
+        self.add_layout(TreeLayout(self.get_kinship(person)).add_family(person, ancestor_depth, descendant_depth), x, y)
 
     def add_parents(self, person, x=None, y=None, depth=1):
+        """
+        Adds depth generations of ancestors above a person, through all the partnerships they are a child of.
+        :param x, y: position of the person; defaults to the one of their node
+        """
         if depth > 0:
-            # default x and y to coordinates of the node matching person
             person_node = self.get_node(person)
             x = x or person_node.x or 0
             y = y or person_node.y or 0
+            self.add_layout(TreeLayout(self.get_kinship(person)).add_ancestors(person, depth), x, y)
 
-            # TODO: add support for multiple partnerships
-            parents = person.parents()[0]
-            self.add_partnership(parents, x, y - self.padding, padding_mult=depth)
-            self.add_edge(self.gen_id(parents), self.gen_id(person))
-
-            # TODO: add support for >2 partners
-            for parent in parents.partners()[:2]:
-                if parent.parents():
-                    self.add_parents(parent, depth=depth - 1)
-
-    def get_gen_size(self, partnership, max_depth=1):
+    def add_children(self, partnership, x=None, y=None, depth=1):
         """
-        Calculates the maximum number of children per family in the max_depth generation for padding the rows above it
-        properly
-        :param partnership: Partnership to obtain the children from
-        :param max_depth: number of generations to descend. 1 only obtains the first generation children of partnership
-        :return: the maximum number of children per family in the max_depth generation
+        Adds depth generations of descendants below a partnership, with the partnerships and partners of each of them.
+        :param x, y: position of the partnership; defaults to the one of its node
         """
-        if max_depth == 0:
-            return 1
-
-        next_gen_size = 0
-        children = partnership.children.all()
-        for child in children:
-            if child.partnerships.exists():
-                next_gen_size = max(next_gen_size,
-                                    self.get_gen_size(next(iter(child.partnerships.all())), max_depth - 1))
-        return len(children) * (next_gen_size or 1)
-
-    def get_family_size(self, partnership, depth):
-        return max(3, sum(
-            self.get_family_size(child.partnerships.all()[0], depth - 1) if child.partnerships.exists() else 1 for child
-            in partnership.children.all()))
-
-    def add_children(self, partnership, x=None, y=None, depth=1):
         if depth > 0:
-            # default x and y to coordinates of the node matching partnership
-            x = x or self.get_node(partnership).x or 0
-            y = y or self.get_node(partnership).y or 0
-
-            children = list(partnership.children.all())
-            n = len(children)
-
-            fam_sizes = {
-                i: self.get_family_size(children[i].partnerships.all()[0], depth - 1)
-                if children[i].partnerships.exists() else 1 for i in range(n)}
-
-            for i in range(n):
-                child: Person = children[i]
-                """
-                pos = start of gen + distance between nodes
-                x is x of parents, so -n/2 to center all children
-                +1/2 since the child nodes are centered in the space allotted for them
-                scale by padding to spread them out
-                scale by gen_size to ensure all families have equal space
-                """
-                xi = ((fam_sizes[i]) / 2 + sum(list(fam_sizes.values())[:i])
-                      - (sum(fam_sizes.values())) / 2) * self.padding + x
-                if child.partnerships.exists():
-                    child_partnership = next(iter(child.partnerships.all()))
-                    self.add_partnership(child_partnership, xi, y + self.padding)
-                    self.add_children(child_partnership, depth=depth - 1)
-                else:
-                    self.add_person(child, xi, y + self.padding)
-                self.add_edge(self.gen_id(partnership), self.gen_id(child))
+            partnership_node = self.get_node(partnership)
+            x = x or partnership_node.x or 0
+            y = y or partnership_node.y or 0
+            self.add_layout(TreeLayout(self.get_kinship(partnership)).add_descendants(partnership, depth), x, y)
 
     def normalize(self, extra_padding=0):
         min_x = min(node.x for node in self.nodes)
@@ -188,6 +272,17 @@ class Graph:
 
     def to_dict(self):
         return {
-            'nodes': [vars(node) for node in self.nodes],
-            'edges': [vars(edge) for edge in self.edges]
+            'nodes': [node.to_dict() for node in self.nodes],
+            'edges': [edge.to_dict() for edge in self.edges]
         }
+
+    def to_json(self, **fields):
+        """
+        Serializes the graph to the same JSON as json.dumps(to_dict()), without separators' whitespace, writing each
+        node and edge straight from its attributes instead of building a dict for it first.
+        :param fields: other values to add to the top level object
+        """
+        return ''.join((
+            '{"nodes":[', ','.join([node.to_json() for node in self.nodes]),
+            '],"edges":[', ','.join([edge.to_json() for edge in self.edges]), ']',
+            *(f',{json_value(key)}:{json_value(value)}' for key, value in fields.items()), '}'))
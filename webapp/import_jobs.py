@@ -0,0 +1,82 @@
+import datetime
+import time
+import traceback
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from webapp.gedcom_merge import merge_file
+from webapp.gedcom_parsing import import_file
+from webapp.models import ImportJob
+
+# Minimum number of seconds between progress updates written to a job's row
+PROGRESS_INTERVAL = 1.0
+# Seconds without progress after which a running job's worker is considered dead. Progress isn't reported while the
+# rows are written, so this has to be longer than writing the biggest import takes.
+STALE_JOB_TIMEOUT = 30 * 60
+# Number of times a job is claimed before it is failed instead of being queued again
+MAX_ATTEMPTS = 3
+
+
+def recover_stale_jobs(timeout=STALE_JOB_TIMEOUT):
+    """
+    Queues the running jobs whose worker stopped reporting progress for timeout seconds again, e.g. because it was
+    killed. Imports and merges are written in a single transaction, so a dead worker left nothing behind. Jobs that were
+    already claimed MAX_ATTEMPTS times are failed instead.
+    :return: the number of recovered jobs
+    """
+    now = timezone.now()
+    limit = now - datetime.timedelta(seconds=timeout)
+    stale = ImportJob.objects.filter(Q(updated__lt=limit) | Q(updated__isnull=True, started__lt=limit),
+                                     status=ImportJob.Status.RUNNING)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=ImportJob.Status.FAILED, finished=now,
+        error=f'The import was interrupted {MAX_ATTEMPTS} times; upload the file again to retry it')
+    requeued = stale.update(status=ImportJob.Status.QUEUED, processed_records=0, started=None, updated=None)
+    return failed + requeued
+
+
+def claim_next_job(stale_timeout=STALE_JOB_TIMEOUT):
+    """
+    Marks the oldest queued job as running, after queueing the jobs of dead workers again with recover_stale_jobs.
+    :return: the claimed job, or None if there are no queued jobs
+    """
+    recover_stale_jobs(stale_timeout)
+    for job in ImportJob.objects.filter(status=ImportJob.Status.QUEUED).order_by('created')[:10]:
+        # Only one worker's update can match while the job is still queued
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job.pk, status=ImportJob.Status.QUEUED) \
+            .update(status=ImportJob.Status.RUNNING, started=now, updated=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: ImportJob):
+    last_update = time.monotonic()
+
+    def progress(records):
+        nonlocal last_update
+        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+            ImportJob.objects.filter(pk=job.pk).update(processed_records=records, updated=timezone.now())
+            last_update = time.monotonic()
+        job.processed_records = records
+
+    try:
+        with job.file.open('rb') as f:
+            if job.merge:
+                if job.tree is None:
+                    raise ValueError('The tree to merge into no longer exists')
+                merge_file(f, job.tree, progress=progress)
+            else:
+                job.tree, stats = import_file(f, job.creator, job.title, progress=progress)
+    except Exception:
+        job.status = ImportJob.Status.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = ImportJob.Status.DONE
+        job.file.delete(save=False)
+    job.finished = timezone.now()
+    job.save()
+    return job
@@ -0,0 +1,102 @@
+import datetime
+import threading
+from collections import OrderedDict, defaultdict
+
+from webapp.models import Tree, Person, Partnership, PersonPartnership
+
+# Number of trees whose index is kept in memory by get_kinship_index
+MAX_CACHED_TREES = 8
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def birth_order(birth_date, pk):
+    """
+    :return: sort key of a person in the order of Person.Meta.ordering, with unknown birth dates first like in SQLite
+    """
+    return birth_date is not None, birth_date or datetime.date.min, pk
+
+
+class KinshipIndex:
+    """
+    The people and partnerships of a tree and how they are related, loaded with four queries so that relatives can be
+    looked up without querying the database. Relatives are listed in the order the related managers of the models
+    return them in: people by birth date, partnerships by primary key.
+
+    An index is a snapshot of the tree at the version it was loaded at; get_kinship_index keeps one per tree up to
+    date.
+    """
+
+    def __init__(self, tree_id, version=None):
+        self.tree_id = tree_id
+        self.version = version
+        self.persons = {person.pk: person for person in
+                        Person.objects.filter(tree=tree_id).select_related('legal_name').order_by('pk')}
+        self.partnerships = {partnership.pk: partnership for partnership in
+                             Partnership.objects.filter(tree=tree_id).order_by('pk')}
+
+        # person id -> ids of the partnerships the person is a partner in, or a child of
+        self.person_partnerships = defaultdict(list)
+        self.person_parents = defaultdict(list)
+        # partnership id -> ids of the partners, or of the children
+        self.partnership_partners = defaultdict(list)
+        self.partnership_children = defaultdict(list)
+
+        for relations, by_person, by_partnership in (
+                (PersonPartnership.objects, self.person_partnerships, self.partnership_partners),
+                (Partnership.children.through.objects, self.person_parents, self.partnership_children)):
+            rows = relations.filter(partnership__tree=tree_id).order_by('partnership_id')
+            for partnership_id, person_id in rows.values_list('partnership_id', 'person_id'):
+                # People of other trees are left out
+                if person_id in self.persons:
+                    by_person[person_id].append(partnership_id)
+                    by_partnership[partnership_id].append(person_id)
+        for person_ids in (*self.partnership_partners.values(), *self.partnership_children.values()):
+            person_ids.sort(key=lambda person_id: birth_order(self.persons[person_id].birth_date, person_id))
+
+    def partnerships_of(self, person):
+        """
+        :return: the partnerships the person is a partner in
+        """
+        return [self.partnerships[pk] for pk in self.person_partnerships.get(person.pk, ())]
+
+    def parents_of(self, person):
+        """
+        :return: the partnerships the person is a child of
+        """
+        return [self.partnerships[pk] for pk in self.person_parents.get(person.pk, ())]
+
+    def partners_of(self, partnership):
+        return [self.persons[pk] for pk in self.partnership_partners.get(partnership.pk, ())]
+
+    def children_of(self, partnership):
+        return [self.persons[pk] for pk in self.partnership_children.get(partnership.pk, ())]
+
+
+def get_kinship_index(tree_id):
+    """
+    Gets the index of a tree's current version, loading it if the tree changed since it was last loaded. The indexes
+    of the MAX_CACHED_TREES most recently used trees are kept in memory.
+    :return: KinshipIndex
+    """
+    version = Tree.objects.filter(pk=tree_id).values_list('version', flat=True).first()
+    with _cache_lock:
+        index = _cache.get(tree_id)
+        if index is not None and index.version == version:
+            _cache.move_to_end(tree_id)
+            return index
+
+    # The version is read before the rows, so a change made while they are loaded gets a newer version than the index
+    index = KinshipIndex(tree_id, version)
+    with _cache_lock:
+        _cache[tree_id] = index
+        _cache.move_to_end(tree_id)
+        while len(_cache) > MAX_CACHED_TREES:
+            _cache.popitem(last=False)
+    return index
+
+
+def clear_kinship_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,49 @@
+from django.db import transaction
+
+from webapp.graph_layout import TreeLayout
+from webapp.graphs import Graph
+from webapp.kinship import get_kinship_index
+from webapp.models import GraphLayout, GraphLayoutNode, Person, Tree
+
+
+# Generations of ancestors and descendants in the graph of a person
+ANCESTOR_DEPTH = 2
+DESCENDANT_DEPTH = 2
+
+
+def etag(person: Person, version, ancestor_depth=ANCESTOR_DEPTH, descendant_depth=DESCENDANT_DEPTH):
+    return f'"{person.tree_id}-{version}-{person.pk}-{ancestor_depth}-{descendant_depth}"'
+
+
+def get_person_graph(person: Person, ancestor_depth=ANCESTOR_DEPTH, descendant_depth=DESCENDANT_DEPTH,
+                     extra_padding=50):
+    """
+    Gets the graph of a person as drawn by Graph.add_family, normalized with extra_padding.
+    The layout is stored with the people and partnerships that were reached while laying it out, and returned until
+    webapp.signals.invalidate_graph_layouts removes it because one of them or their relations changed; changes to
+    the rest of the tree don't lay it out again.
+    :return: dict like Graph.to_dict
+    """
+    stored = GraphLayout.objects.filter(person=person, ancestor_depth=ancestor_depth,
+                                        descendant_depth=descendant_depth).values_list('data', flat=True).first()
+    if stored is not None:
+        return stored
+
+    kinship = get_kinship_index(person.tree_id)
+    layout = TreeLayout(kinship).add_family(kinship.persons[person.pk], ancestor_depth, descendant_depth)
+    graph = Graph(kinship)
+    graph.add_layout(layout)
+    data = graph.normalize(extra_padding).to_dict()
+    with transaction.atomic():
+        # A change made since the index was loaded may have already invalidated the layouts it reaches, so a layout of
+        # an older version isn't stored. Locking the tree makes a concurrent bump, and the invalidation that follows
+        # it, wait until the layout is stored.
+        if Tree.objects.select_for_update().filter(pk=person.tree_id, version=kinship.version).exists():
+            stored, created = GraphLayout.objects.update_or_create(
+                person=person, ancestor_depth=ancestor_depth, descendant_depth=descendant_depth,
+                defaults={'tree_id': person.tree_id, 'data': data})
+            if not created:
+                stored.nodes.all().delete()
+            GraphLayoutNode.objects.bulk_create([GraphLayoutNode(layout=stored, node_id=Graph.gen_id(model_object))
+                                                 for model_object in layout.claimed])
+    return data
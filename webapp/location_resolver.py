@@ -0,0 +1,87 @@
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from webapp.submodels.location_model import Location
+
+
+class LocationResolver:
+    """
+    Interns Locations by their (city, state, country) triple so that repeated places cost a dict lookup instead of a
+    get_or_create query each.
+
+    resolve() always returns the same Location instance for the same triple. Locations that aren't in the database yet
+    are returned unsaved and are created together by save(), which fills in their primary keys; rows that point to
+    them must be saved after save() has been called.
+    """
+
+    # Each looked up triple adds three query parameters
+    lookup_batch_size = 250
+
+    def __init__(self, preload=False, batch_size=1000):
+        """
+        :param preload: load every existing Location up front; worth it for imports, which resolve many places
+        :param batch_size: maximum number of rows per INSERT
+        """
+        self.batch_size = batch_size
+        self.preloaded = preload
+        self.locations = dict()
+        self.pending = dict()
+        if preload:
+            for location in Location.objects.all():
+                self.locations[self.key(*location)] = location
+
+    @staticmethod
+    def key(city, state, country):
+        return city or '', state or '', country or ''
+
+    def resolve(self, city='', state='', country=''):
+        key = self.key(city, state, country)
+        location = self.locations.get(key)
+        if location is None:
+            location = Location(city=key[0], state=key[1], country=key[2])
+            self.locations[key] = location
+            self.pending[key] = location
+        return location
+
+    def get_or_create(self, city='', state='', country=''):
+        """
+        Like resolve(), but the returned Location is always saved.
+        """
+        location = self.resolve(city, state, country)
+        if location.pk is None:
+            self.save()
+        return location
+
+    def save(self):
+        """
+        Saves every Location returned by resolve() that isn't in the database yet, then fills in their primary keys.
+        """
+        if not self.pending:
+            return
+
+        if not self.preloaded:
+            self.fetch_pending()
+        # ignore_conflicts covers locations created by another request since they were loaded
+        Location.objects.bulk_create([location for location in self.pending.values() if location.pk is None],
+                                     batch_size=self.batch_size, ignore_conflicts=True)
+        self.fetch_pending()
+
+        # The database may consider triples equal that differ in python (e.g. case-insensitive collations)
+        for location in self.pending.values():
+            if location.pk is None:
+                location.pk = Location.objects.get(city=location.city, state=location.state,
+                                                   country=location.country).pk
+        self.pending.clear()
+
+    def fetch_pending(self):
+        missing = [key for key, location in self.pending.items() if location.pk is None]
+        for i in range(0, len(missing), self.lookup_batch_size):
+            query = reduce(or_, (Q(city=city, state=state, country=country)
+                                 for city, state, country in missing[i:i + self.lookup_batch_size]))
+            rows = Location.objects.filter(query).values_list('pk', 'city', 'state', 'country')
+            for pk, city, state, country in rows:
+                location = self.pending.get((city, state, country))
+                if location is not None:
+                    location.pk = pk
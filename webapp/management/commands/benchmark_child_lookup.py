@@ -0,0 +1,79 @@
+import gc
+import time
+
+from django.core.management.base import BaseCommand
+from gedcom.element.element import Element
+
+import webapp.tags_ext as tags
+from webapp.gedcom_helpers import create_event, create_individual, get_next_child_element, get_value
+
+
+def scan_next_child_element(element, tag):
+    return next((child for child in element.get_child_elements() if child.get_tag() == tag), None)
+
+
+def scan_value(element, tag):
+    child = scan_next_child_element(element, tag)
+    return child.get_value() if child is not None else ''
+
+
+def indexed_lookups(record):
+    get_value(record, tags.GEDCOM_TAG_SEX)
+    for tag in (tags.GEDCOM_TAG_BIRTH, tags.GEDCOM_TAG_DEATH):
+        event = get_next_child_element(record, tag)
+        get_value(event, tags.GEDCOM_TAG_DATE)
+        get_value(event, tags.GEDCOM_TAG_PLACE)
+    get_value(record, tags.GEDCOM_TAG_FAMILY_SPOUSE)
+    get_value(record, tags.GEDCOM_TAG_FAMILY_CHILD)
+
+
+def scanning_lookups(record):
+    scan_value(record, tags.GEDCOM_TAG_SEX)
+    for tag in (tags.GEDCOM_TAG_BIRTH, tags.GEDCOM_TAG_DEATH):
+        event = scan_next_child_element(record, tag)
+        scan_value(event, tags.GEDCOM_TAG_DATE)
+        scan_value(event, tags.GEDCOM_TAG_PLACE)
+    scan_value(record, tags.GEDCOM_TAG_FAMILY_SPOUSE)
+    scan_value(record, tags.GEDCOM_TAG_FAMILY_CHILD)
+
+
+def create_record(i, events):
+    """
+    Creates an individual whose looked up tags come after many residence events, like a well researched person.
+    """
+    record = Element(0, f'@I{i}@', tags.GEDCOM_TAG_INDIVIDUAL, '')
+    for j in range(events):
+        record.add_child_element(create_event(tags.GEDCOM_TAG_RESIDENCE, f'City {j}', str(1900 + j % 100)))
+    for child in create_individual(f'@I{i}@', name=f'Person /{i}/', sex='F',
+                                   birth_place='Somewhere', birth_date='1 JAN 1900',
+                                   death_place='Elsewhere', death_date='1 JAN 1990',
+                                   family_spouse_ptr='@F1@', family_child_ptr='@F2@').get_child_elements():
+        record.add_child_element(child)
+    return record
+
+
+def time_per_record(lookups, records):
+    gc.collect()
+    start = time.perf_counter()
+    for record in records:
+        lookups(record)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+
+class Command(BaseCommand):
+    help = 'Measures the cost of the child element lookups done while importing one individual'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=2000, help='number of individuals per run')
+        parser.add_argument('--events', type=int, nargs='+', default=[0, 10, 100, 500],
+                            help='numbers of extra events per individual to measure')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"events":>8} {"scan (us)":>12} {"first (us)":>12} {"repeat (us)":>12}')
+        for events in options['events']:
+            records = [create_record(i, events) for i in range(options['records'])]
+            scan = time_per_record(scanning_lookups, records)
+            # The first lookup on a record pays for building its index
+            first = time_per_record(indexed_lookups, records)
+            repeat = time_per_record(indexed_lookups, records)
+            self.stdout.write(f'{events:>8} {scan:>12.2f} {first:>12.2f} {repeat:>12.2f}')
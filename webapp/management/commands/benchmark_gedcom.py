@@ -0,0 +1,103 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from webapp.gedcom_generator import stream_file
+from webapp.gedcom_parsing import import_file
+from webapp.gedcom_synthetic import SyntheticTree
+from webapp.tree_dump import dump_tree, restore_tree
+
+
+class Measurement:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.peak_bytes = None
+
+
+@contextmanager
+def measure(trace_memory=True):
+    """
+    Measures the wall time, number of database queries and, if trace_memory is set, the peak memory allocated by
+    python code in the block. Tracing memory slows the block down.
+    :return: the Measurement, which is filled in when the block exits
+    """
+    measurement = Measurement()
+
+    def count_query(execute, sql, params, many, context):
+        measurement.queries += 1
+        return execute(sql, params, many, context)
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(count_query):
+            yield measurement
+    finally:
+        measurement.seconds = time.perf_counter() - start
+        if trace_memory:
+            measurement.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+class Command(BaseCommand):
+    help = 'Imports, exports, dumps and restores generated trees of increasing size and reports the time, queries ' \
+           'and memory used'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='numbers of individuals of the generated trees')
+        parser.add_argument('--generations', type=int, default=8, help='depth of each founding couple\'s descendants')
+        parser.add_argument('--children', type=int, default=3, help='average number of children per family')
+        parser.add_argument('--remarriage-rate', type=float, default=0.1,
+                            help='probability that a person has a second family')
+        parser.add_argument('--names', type=int, default=20, help='number of distinct given names and surnames')
+        parser.add_argument('--places', type=int, default=50, help='number of distinct places')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='keep the imported trees instead of rolling back')
+        parser.add_argument('--no-memory', action='store_true',
+                            help='don\'t trace memory, which makes the timings more accurate')
+
+    def handle(self, *args, **options):
+        trace_memory = not options['no_memory']
+        self.stdout.write(f'{"individuals":>12} {"phase":>8} {"seconds":>10} {"queries":>8} {"peak MiB":>9}  details')
+        for size in options['sizes']:
+            with measure(trace_memory) as generated:
+                synthetic = SyntheticTree(size, max_generations=options['generations'],
+                                          children_per_family=options['children'],
+                                          remarriage_rate=options['remarriage_rate'], names=options['names'],
+                                          places=options['places'], seed=options['seed'])
+                lines = list(synthetic.lines())
+            self.report(size, 'generate', generated,
+                        f'{len(synthetic.families)} families, {synthetic.generations} generations, {len(lines)} lines')
+
+            with transaction.atomic():
+                user, created = User.objects.get_or_create(username='benchmark')
+                with measure(trace_memory) as imported:
+                    tree, stats = import_file(lines, user, f'Benchmark {size}')
+                self.report(size, 'import', imported, f'{stats.total_rows} rows')
+
+                with measure(trace_memory) as exported:
+                    characters = sum(len(chunk) for chunk in stream_file(tree))
+                self.report(size, 'export', exported, f'{characters} characters')
+
+                with measure(trace_memory) as dumped:
+                    dump = list(dump_tree(tree))
+                self.report(size, 'dump', dumped, f'{sum(len(line) for line in dump)} characters')
+
+                with measure(trace_memory) as restored:
+                    restored_tree, stats = restore_tree(dump, user, f'Benchmark {size} restored')
+                self.report(size, 'restore', restored, f'{stats.total_rows} rows')
+
+                if not options['keep']:
+                    transaction.set_rollback(True)
+
+    def report(self, size, phase, measurement: Measurement, details):
+        peak = f'{measurement.peak_bytes / 2 ** 20:.1f}' if measurement.peak_bytes is not None else '-'
+        self.stdout.write(f'{size:>12} {phase:>8} {measurement.seconds:>10.2f} {measurement.queries:>8} {peak:>9}  '
+                          f'{details}')
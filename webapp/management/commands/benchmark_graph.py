@@ -0,0 +1,87 @@
+import gc
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from webapp.graphs import Graph
+
+
+def build_graph(families):
+    """
+    Builds a graph shaped like the ones of add_children, without the database: each family has two partners and a
+    partnership node, and is a child of the previous family. Every node is looked up after it is added, as
+    add_parents and add_children do.
+    """
+    graph = Graph()
+    for i in range(families):
+        partnership_id = f'Partnership_{i}'
+        graph.add_node(Graph.Node(partnership_id, i, 0, size=1))
+        for person_id in (f'Person_{2 * i}', f'Person_{2 * i + 1}'):
+            graph.add_node(Graph.Node(person_id, i, 0))
+            graph.add_edge(person_id, partnership_id)
+            graph.get_node(person_id)
+        if i > 0:
+            graph.add_edge(f'Partnership_{i - 1}', f'Person_{2 * i}')
+            graph.get_edge(f'Partnership_{i - 1}', f'Person_{2 * i}')
+        graph.get_node(partnership_id)
+    return graph
+
+
+def remove_people(graph, families):
+    for i in range(families):
+        graph.remove_node(graph.get_node(f'Person_{2 * i + 1}'))
+
+
+def graph_memory(families):
+    """
+    :return: bytes allocated by build_graph, with the indexes of the graph
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        graph = build_graph(families)
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del graph
+    return memory
+
+
+class Command(BaseCommand):
+    help = 'Measures the time to build a graph, remove nodes from it and serialize it, and its memory, per node, for ' \
+           'graphs of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='numbers of families of the built graphs; each family has three nodes')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"nodes":>10} {"build (s)":>10} {"build/node (us)":>16} {"remove/node (us)":>17} '
+                          f'{"memory/node (B)":>16} {"dumps (s)":>10} {"to_json (s)":>12}')
+        for families in options['sizes']:
+            gc.collect()
+            start = time.perf_counter()
+            graph = build_graph(families)
+            built = time.perf_counter() - start
+
+            # to_dict and json.dumps, which is how graphs were serialized before to_json
+            start = time.perf_counter()
+            json.dumps(graph.to_dict())
+            dumped = time.perf_counter() - start
+
+            start = time.perf_counter()
+            graph.to_json()
+            serialized = time.perf_counter() - start
+
+            gc.collect()
+            start = time.perf_counter()
+            remove_people(graph, families)
+            removed = time.perf_counter() - start
+
+            nodes = 3 * families
+            memory = graph_memory(families)
+            self.stdout.write(f'{nodes:>10} {built:>10.3f} {built / nodes * 1e6:>16.2f} '
+                              f'{removed / families * 1e6:>17.2f} {memory / nodes:>16.0f} {dumped:>10.3f} '
+                              f'{serialized:>12.3f}')
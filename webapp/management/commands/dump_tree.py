@@ -0,0 +1,27 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.models import Tree
+from webapp.tree_dump import dump_tree
+
+
+class Command(BaseCommand):
+    help = 'Writes a tree and everything in it to a dump file, which restore_tree turns back into a tree'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tree_id', type=int)
+        parser.add_argument('path', help='file to write; compressed with gzip if it ends with .gz')
+
+    def handle(self, *args, **options):
+        try:
+            tree = Tree.objects.get(pk=options['tree_id'])
+        except Tree.DoesNotExist:
+            raise CommandError(f'There is no tree with id {options["tree_id"]}')
+
+        start = time.perf_counter()
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        with opener(options['path'], 'wt', encoding='utf-8') as f:
+            f.writelines(dump_tree(tree))
+        self.stdout.write(self.style.SUCCESS(f'Dumped {tree} in {time.perf_counter() - start:.2f}s'))
@@ -0,0 +1,76 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+
+from webapp.export_formats import DEFAULT_FORMAT, FORMATS
+from webapp.models import Tree
+from webapp.tree_exports import ExportResult, export_tree, init_worker
+
+
+class Command(BaseCommand):
+    help = 'Exports trees to GEDCOM files in a directory with a pool of processes, skipping the trees that haven\'t ' \
+           'changed since their last export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='directory the files are written to')
+        trees = parser.add_mutually_exclusive_group(required=True)
+        trees.add_argument('--all', action='store_true', help='export every tree')
+        trees.add_argument('--users', nargs='+', metavar='USERNAME', help='export the trees of these users')
+        trees.add_argument('--ids', nargs='+', type=int, metavar='TREE_ID', help='export these trees')
+        parser.add_argument('--format', choices=FORMATS, default=DEFAULT_FORMAT)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of processes; 1 exports the trees one at a time in this process')
+
+    def handle(self, *args, **options):
+        trees = Tree.objects.all()
+        if options['users']:
+            missing = set(options['users']) - set(User.objects.filter(username__in=options['users'])
+                                                  .values_list('username', flat=True))
+            if missing:
+                raise CommandError(f'Users do not exist: {", ".join(sorted(missing))}')
+            trees = trees.filter(creator__username__in=options['users'])
+        elif options['ids']:
+            trees = trees.filter(pk__in=options['ids'])
+        # The biggest trees are started first, so a big one doesn't keep a worker busy after the others are done
+        tree_ids = list(trees.annotate(persons=Count('person')).order_by('-persons', 'pk').values_list('pk', flat=True))
+        os.makedirs(options['directory'], exist_ok=True)
+
+        start = time.perf_counter()
+        results = list()
+        if options['workers'] == 1:
+            for tree_id in tree_ids:
+                results.append(export_tree(tree_id, options['directory'], options['format']))
+                self.report(results[-1])
+        else:
+            # Forked workers would otherwise share the connections of this process
+            connections.close_all()
+            with ProcessPoolExecutor(options['workers'], initializer=init_worker) as pool:
+                futures = [pool.submit(export_tree, tree_id, options['directory'], options['format'])
+                           for tree_id in tree_ids]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    self.report(results[-1])
+        seconds = time.perf_counter() - start
+
+        counts = {status: sum(1 for result in results if result.status == status)
+                  for status in (ExportResult.EXPORTED, ExportResult.SKIPPED, ExportResult.FAILED)}
+        exported_seconds = sum(result.seconds for result in results if result.status == ExportResult.EXPORTED)
+        exported_bytes = sum(result.size for result in results if result.status == ExportResult.EXPORTED)
+        summary = f'{counts[ExportResult.EXPORTED]} exported ({exported_bytes / 2 ** 20:.1f} MiB, ' \
+                  f'{exported_seconds:.2f}s of work), {counts[ExportResult.SKIPPED]} unchanged, ' \
+                  f'{counts[ExportResult.FAILED]} failed in {seconds:.2f}s'
+        if counts[ExportResult.FAILED]:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def report(self, result: ExportResult):
+        line = f'[{result.tree_id}] {result.title}: {result.status} in {result.seconds:.2f}s ({result.size} bytes)'
+        if result.status == ExportResult.FAILED:
+            self.stderr.write(f'{line}\n{result.error}')
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.gedcom_merge import merge_file
+from webapp.gedcom_parsing import DEFAULT_BATCH_SIZE, import_file
+from webapp.models import Tree
+from webapp.name_parser_ext import name_cache_info
+
+
+class Command(BaseCommand):
+    help = 'Imports a GEDCOM file into a new tree and reports how fast the rows were written'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='GEDCOM file to import')
+        parser.add_argument('--username', required=True, help='user that will own the new tree')
+        parser.add_argument('--title', help='title of the new tree; defaults to the file path')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of rows per INSERT statement')
+        parser.add_argument('--per-row', action='store_true',
+                            help='save rows one at a time instead of in batches, for comparison')
+        parser.add_argument('--merge', type=int, metavar='TREE_ID',
+                            help='update the given tree with the changes in the file instead of creating a new tree')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist')
+
+        if options['merge'] is not None:
+            try:
+                tree = Tree.objects.get(pk=options['merge'], creator=user)
+            except Tree.DoesNotExist:
+                raise CommandError(f'User "{user}" has no tree with id {options["merge"]}')
+            with open(options['path'], 'rb') as f:
+                stats = merge_file(f, tree, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Merged into {tree}: {stats}'))
+            return
+
+        with open(options['path'], 'rb') as f:
+            tree, stats = import_file(f, user, options['title'] or options['path'],
+                                      batch_size=options['batch_size'], bulk=not options['per_row'])
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {tree}: {stats}'))
+        self.stdout.write(f'Name cache: {name_cache_info()}')
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.import_jobs import STALE_JOB_TIMEOUT, claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Imports queued GEDCOM uploads; keeps polling for new ones unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit once there are no queued jobs left')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='seconds to wait between checks for new jobs')
+        parser.add_argument('--stale-after', type=float, default=STALE_JOB_TIMEOUT,
+                            help='seconds without progress after which a running job is queued again')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job(options['stale_after'])
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f'Importing {job}')
+            run_job(job)
+            if job.status == job.Status.DONE:
+                self.stdout.write(self.style.SUCCESS(f'Imported {job} into {job.tree}'))
+            else:
+                self.stderr.write(f'Failed to import {job}:\n{job.error}')
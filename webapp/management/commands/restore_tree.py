@@ -0,0 +1,32 @@
+import gzip
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.gedcom_parsing import DEFAULT_BATCH_SIZE
+from webapp.tree_dump import restore_tree
+
+
+class Command(BaseCommand):
+    help = 'Restores a file written by dump_tree into a new tree'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='dump to restore; read with gzip if it ends with .gz')
+        parser.add_argument('--username', required=True, help='user that will own the new tree')
+        parser.add_argument('--title', help='title of the new tree; defaults to the title of the dumped tree')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of rows per INSERT statement')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist')
+
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        with opener(options['path'], 'rt', encoding='utf-8') as f:
+            try:
+                tree, stats = restore_tree(f, user, options['title'], batch_size=options['batch_size'])
+            except ValueError as e:
+                raise CommandError(f'Could not restore {options["path"]}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Restored {tree}: {stats}'))
@@ -16,6 +16,8 @@ class Tree(models.Model):
     creator = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     authorized_users = models.ManyToManyField(User, related_name='authorized_users', blank=True)
     notes = models.TextField(blank=True)
+    # Incremented whenever the people or partnerships of the tree change; see webapp.signals
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['title']
@@ -23,6 +25,14 @@ class Tree(models.Model):
     def __str__(self):
         return f'[{self.id}] {self.title}'
 
+    def save(self, *args, **kwargs):
+        # version is only changed in the database by bump_tree_version, so an instance loaded before a bump must not
+        # write its old version back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         # Returns the url to access a Tree instance
         return reverse('tree_detail', args=[str(self.id)])
@@ -36,6 +46,8 @@ class Name(models.Model):
     suffix = models.CharField(max_length=6, blank=True, default='')
 
     tree = models.ForeignKey('Tree', on_delete=models.CASCADE, null=True)
+    # Set by the bulk importers on the rows they insert, so that they can read back their primary keys
+    import_token = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
 
     class Meta:
         abstract = True
@@ -92,6 +104,9 @@ class Person(models.Model):
     preferred_name = models.TextField(blank=True, default='')
     birth_date = models.DateField(null=True, blank=True)
     death_date = models.DateField(null=True, blank=True)
+    # GEDCOM date values that aren't an exact day, e.g. "ABT 1900"; the DateFields hold their earliest day
+    birth_date_gedcom = models.CharField(max_length=40, blank=True, default='')
+    death_date_gedcom = models.CharField(max_length=40, blank=True, default='')
     birth_location = models.ForeignKey(Location, related_name="birth_location", on_delete=models.DO_NOTHING, null=True,
                                        blank=True)
     death_location = models.ForeignKey(Location, related_name="death_location", on_delete=models.DO_NOTHING, null=True,
@@ -102,6 +117,8 @@ class Person(models.Model):
     notes = models.TextField(blank=True, default='')
 
     tree = models.ForeignKey('Tree', on_delete=models.CASCADE, null=True)
+    # Set by the bulk importers on the rows they insert, so that they can read back their primary keys
+    import_token = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
 
     class Meta:
         ordering = ['birth_date']
@@ -176,6 +193,9 @@ class Partnership(models.Model):
     children = models.ManyToManyField(Person, related_name='children', blank=True)
     marriage_date = models.DateField(null=True, blank=True)
     divorce_date = models.DateField(null=True, blank=True)
+    # GEDCOM date values that aren't an exact day, e.g. "ABT 1900"; the DateFields hold their earliest day
+    marriage_date_gedcom = models.CharField(max_length=40, blank=True, default='')
+    divorce_date_gedcom = models.CharField(max_length=40, blank=True, default='')
 
     class MaritalStatus(models.TextChoices):
         MARRIED = 'Married', _('Married')
@@ -188,6 +208,8 @@ class Partnership(models.Model):
     notes = models.TextField(blank=True, default='')
 
     tree = models.ForeignKey('Tree', on_delete=models.CASCADE, null=True)
+    # Set by the bulk importers on the rows they insert, so that they can read back their primary keys
+    import_token = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
 
     def partners(self):
         return Person.objects.filter(partnerships=self)
@@ -213,3 +235,86 @@ class PersonPartnership(models.Model):
 
     def __str__(self):
         return ''
+
+
+class GraphLayout(models.Model):
+    """
+    The stored nodes and edges of the graph of a person, so that the graph isn't laid out again on every view; see
+    webapp.layout_cache.
+    """
+    tree = models.ForeignKey('Tree', on_delete=models.CASCADE)
+    person = models.ForeignKey('Person', on_delete=models.CASCADE)
+    ancestor_depth = models.PositiveSmallIntegerField()
+    descendant_depth = models.PositiveSmallIntegerField()
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'ancestor_depth', 'descendant_depth'],
+                                    name='unique_graph_layout'),
+        ]
+
+    def __str__(self):
+        return f'[{self.id}] {self.person_id} ({self.ancestor_depth}, {self.descendant_depth})'
+
+
+class GraphLayoutNode(models.Model):
+    """
+    A person or partnership that was reached while laying out a GraphLayout, which is removed when one of them or their
+    relations change. The node id isn't a foreign key, so that it outlives the deleted person or partnership until the
+    layout is removed.
+    """
+    layout = models.ForeignKey('GraphLayout', on_delete=models.CASCADE, related_name='nodes')
+    # Id of the node as made by webapp.graphs.Graph.gen_id
+    node_id = models.CharField(max_length=32, db_index=True)
+
+    def __str__(self):
+        return f'[{self.id}] {self.layout_id} {self.node_id}'
+
+
+class ImportJob(models.Model):
+    """
+    A GEDCOM upload waiting to be imported, or being imported, by the process_import_jobs command.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'Queued', _('Queued')
+        RUNNING = 'Running', _('Running')
+        DONE = 'Done', _('Done')
+        FAILED = 'Failed', _('Failed')
+
+    creator = models.ForeignKey(User, on_delete=models.CASCADE)
+    title = models.CharField(max_length=50)
+    file = models.FileField(upload_to='imports/')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    processed_records = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    # The created tree, or when merge is set, the existing tree the file is merged into
+    tree = models.ForeignKey('Tree', on_delete=models.SET_NULL, null=True, blank=True)
+    merge = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    # Last time the worker running the job showed it was alive, by claiming it or by reporting progress
+    updated = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Number of times a worker claimed the job
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['created']
+
+    def __str__(self):
+        return f'[{self.id}] {self.title} ({self.status})'
+
+    def get_absolute_url(self):
+        return reverse('import_job', args=[str(self.id)])
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'status': self.status,
+            'processed_records': self.processed_records,
+            'error': self.error,
+            'tree_url': self.tree.get_absolute_url() if self.tree else None,
+        }
@@ -1,17 +1,66 @@
 import re
+from functools import lru_cache
 
 from nameparser.parser import HumanName
+from nameparser.util import lc
 from nameparser.util import log
 from nameparser.util import text_types
 from nameparser.util import u
 
 
+# Maximum number of distinct raw names whose parsed parts are kept by parse_name
+NAME_CACHE_SIZE = 4096
+
+
 def split_with_slash_support(s: str):
     return re.findall(r"(?<=/)\w[\w\s]*(?=/)|(?<=\s)[\w]+|^[\w]+", s)
 
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _parse_name_items(name: str):
+    # Stored as a tuple so callers can't modify the cached result
+    return tuple(GedcomName(name).as_dict().items())
+
+
+def parse_name(name: str):
+    """
+    Parses a raw GEDCOM name, e.g. "John /Doe/", reusing the result for names that were parsed before.
+    :return: dict of name parts, as returned by GedcomName.as_dict()
+    """
+    return dict(_parse_name_items(name))
+
+
+def parse_names(names):
+    """
+    Parses many raw names at once; each distinct name is only parsed once.
+    :param names: iterable of raw name strings
+    :return: list of dicts of name parts, in the same order as names
+    """
+    parsed = dict()
+    result = list()
+    for name in names:
+        if name not in parsed:
+            parsed[name] = _parse_name_items(name)
+        result.append(dict(parsed[name]))
+    return result
+
+
+def name_cache_info():
+    """
+    :return: hits, misses, maxsize and currsize of the parse_name cache
+    """
+    return _parse_name_items.cache_info()
+
+
+def clear_name_cache():
+    _parse_name_items.cache_clear()
+
+
 # noinspection DuplicatedCode,PyAttributeOutsideInit
 class GedcomName(HumanName):
+    # Replaced for every parse by parse_full_name
+    extra_titles = frozenset()
+    extra_suffixes = frozenset()
 
     def parse_full_name(self):
         """
@@ -28,6 +77,9 @@ class GedcomName(HumanName):
         """
 
         self.title_list = []
+        # Titles and suffixes found by parse_pieces for this name only; see parse_pieces
+        self.extra_titles = set()
+        self.extra_suffixes = set()
         self.first_list = []
         self.middle_list = []
         self.last_list = []
@@ -174,12 +226,26 @@ class GedcomName(HumanName):
             self.unparsable = False
         self.post_process()
 
+    def is_title(self, value):
+        return lc(value) in self.extra_titles or super().is_title(value)
+
+    def is_suffix(self, piece):
+        return (lc(piece) in self.extra_suffixes and not self.is_an_initial(piece)) or super().is_suffix(piece)
+
+    def is_rootname(self, piece):
+        return lc(piece) not in self.extra_titles and lc(piece) not in self.extra_suffixes \
+               and super().is_rootname(piece)
+
     def parse_pieces(self, parts, additional_parts_count=0):
         """
         Split parts on spaces and remove commas, join on conjunctions and
         lastname prefixes. If parts have periods in the middle, try splitting
         on periods and check if the parts are titles or suffixes. If they are
-        add to the constant so they will be found.
+        add them to this name's extra titles or suffixes so they will be found.
+
+        Unlike HumanName.parse_pieces, the shared constants in self.C are never
+        modified, so a parse doesn't depend on names parsed before it and the
+        constants don't grow in long-running processes.
 
         :param list parts: name part strings from the comma split
         :param int additional_parts_count:
@@ -202,7 +268,7 @@ class GedcomName(HumanName):
 
         # If part contains periods, check if it's multiple titles or suffixes
         # together without spaces if so, add the new part with periods to the
-        # constants so they get parsed correctly later
+        # extra titles or suffixes so they get parsed correctly later
         for part in output:
             # if this part has a period not at the beginning or end
             if self.C.regexes.period_not_at_end.match(part):
@@ -212,12 +278,12 @@ class GedcomName(HumanName):
                 titles = list(filter(self.is_title, period_chunks))
                 suffixes = list(filter(self.is_suffix, period_chunks))
 
-                # add the part to the constant so it will be found
+                # add the part to this name's overlay so it will be found
                 if len(list(titles)):
-                    self.C.titles.add(part)
+                    self.extra_titles.add(lc(part))
                     continue
                 if len(list(suffixes)):
-                    self.C.suffix_not_acronyms.add(part)
+                    self.extra_suffixes.add(lc(part))
                     continue
 
         return self.join_on_conjunctions(output, additional_parts_count)
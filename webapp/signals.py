@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from webapp import export_cache
+from webapp.models import Tree, Person, LegalName, AlternateName, Partnership, PersonPartnership, GraphLayout, \
+    GraphLayoutNode
+
+_deferred = threading.local()
+
+
+def bump_tree_version(*tree_ids):
+    """
+    Marks the content of trees as changed, which invalidates their cached exports. The stored graph layouts that the
+    change reaches are invalidated separately by invalidate_graph_layouts.
+    Rows written with bulk_create, bulk_update or QuerySet.update don't send signals, so code that writes them has to
+    call this itself.
+    """
+    tree_ids = {tree_id for tree_id in tree_ids if tree_id is not None}
+    if not tree_ids:
+        return
+    pending = getattr(_deferred, 'tree_ids', None)
+    if pending is not None:
+        pending.update(tree_ids)
+    else:
+        Tree.objects.filter(pk__in=tree_ids).update(version=F('version') + 1)
+
+
+def node_ids(model, *pks):
+    """
+    :return: the ids that webapp.graphs.Graph.gen_id gives to the rows of model with these primary keys
+    """
+    return [f'{model.__name__}_{pk}' for pk in pks if pk is not None]
+
+
+def invalidate_graph_layouts(*changed_node_ids):
+    """
+    Removes the stored graph layouts that reached any of these people or partnerships, given by their node ids, so
+    that they are laid out again on their next view. Layouts that none of them is in are kept.
+    Like bump_tree_version, it has to be called by code that writes rows without sending signals, after the bump.
+    """
+    changed_node_ids = set(changed_node_ids)
+    if not changed_node_ids:
+        return
+    pending = getattr(_deferred, 'node_ids', None)
+    if pending is not None:
+        pending.update(changed_node_ids)
+    else:
+        GraphLayout.objects.filter(pk__in=GraphLayoutNode.objects.filter(node_id__in=changed_node_ids)
+                                   .values('layout_id')).delete()
+
+
+@contextmanager
+def deferred_version_bumps():
+    """
+    Bumps the version of each changed tree once, when the block exits, instead of once per saved or deleted row, and
+    then invalidates the graph layouts the changes reached at once.
+    Nothing is bumped if the block raises, since its changes are expected to be rolled back.
+    """
+    if getattr(_deferred, 'tree_ids', None) is not None:
+        # Already deferred by an enclosing block
+        yield
+        return
+
+    _deferred.tree_ids = set()
+    _deferred.node_ids = set()
+    try:
+        yield
+        tree_ids, changed_node_ids = _deferred.tree_ids, _deferred.node_ids
+    finally:
+        _deferred.tree_ids = None
+        _deferred.node_ids = None
+    bump_tree_version(*tree_ids)
+    # After the bump, so that a layout stored meanwhile from the old version is removed as well; see
+    # webapp.layout_cache.get_person_graph
+    invalidate_graph_layouts(*changed_node_ids)
+
+
+def partnership_tree_ids(*partnership_ids):
+    # The partnership may already be deleted when a relation is deleted with it; its own signal covers that case
+    return Partnership.objects.filter(pk__in=partnership_ids).values_list('tree_id', flat=True)
+
+
+@receiver([post_save, post_delete], sender=Person)
+@receiver([post_save, post_delete], sender=Partnership)
+def tree_row_changed(sender, instance, **kwargs):
+    bump_tree_version(instance.tree_id)
+    invalidate_graph_layouts(*node_ids(sender, instance.pk))
+
+
+@receiver([post_save, post_delete], sender=LegalName)
+@receiver([post_save, post_delete], sender=AlternateName)
+def name_changed(sender, instance, **kwargs):
+    if instance.tree_id is not None:
+        bump_tree_version(instance.tree_id)
+    elif sender is LegalName:
+        # Names aren't always given a tree; fall back to the tree of their person
+        bump_tree_version(*Person.objects.filter(legal_name=instance.pk).values_list('tree_id', flat=True))
+    else:
+        bump_tree_version(*Person.objects.filter(pk=instance.person_id).values_list('tree_id', flat=True))
+    if sender is LegalName:
+        # Only the legal name is shown in graphs
+        invalidate_graph_layouts(*node_ids(Person, *Person.objects.filter(legal_name=instance.pk)
+                                           .values_list('pk', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=PersonPartnership)
+@receiver([post_save, post_delete], sender=Partnership.children.through)
+def relation_changed(sender, instance, **kwargs):
+    bump_tree_version(*partnership_tree_ids(instance.partnership_id))
+    invalidate_graph_layouts(*node_ids(Person, instance.person_id), *node_ids(Partnership, instance.partnership_id))
+
+
+@receiver(m2m_changed, sender=PersonPartnership)
+@receiver(m2m_changed, sender=Partnership.children.through)
+def relations_changed(sender, instance, action, model, pk_set, **kwargs):
+    # instance is the Person or Partnership whose relations were changed through its related manager, and pk_set the
+    # primary keys of the model on the other side
+    if action == 'pre_clear':
+        # pk_set isn't given for clear, and the relations are gone once post_clear is sent
+        pk_set = set(sender.objects.filter(**{type(instance).__name__.lower(): instance.pk})
+                     .values_list(f'{model.__name__.lower()}_id', flat=True))
+        instance._cleared_pks = pk_set
+    elif action == 'post_clear':
+        pk_set = vars(instance).pop('_cleared_pks', set())
+    if action.startswith('post_'):
+        bump_tree_version(instance.tree_id)
+        invalidate_graph_layouts(*node_ids(type(instance), instance.pk), *node_ids(model, *pk_set))
+
+
+@receiver(post_delete, sender=Tree)
+def tree_deleted(sender, instance, **kwargs):
+    export_cache.remove_tree(instance.pk)
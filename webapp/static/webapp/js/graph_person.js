@@ -1,20 +1,68 @@
-data = JSON.parse(document.getElementById('data').textContent);
-width = JSON.parse(document.getElementById('width').textContent);
-height = JSON.parse(document.getElementById('height').textContent);
+dataUrl = JSON.parse(document.getElementById('data-url').textContent);
+expandUrl = JSON.parse(document.getElementById('expand-url').textContent);
+padding = JSON.parse(document.getElementById('padding').textContent);
 
-console.log(data);
 
+// Ids of the shown nodes with their positions relative to a node, so that the relatives of the node are laid out
+// clear of them
+function knownNodes(graph, node) {
+    return graph.getNodes().map(item => {
+        const model = item.getModel();
+        return `${model.id}:${Math.round(model.x - node.x)}:${Math.round(model.y - node.y)}`;
+    });
+}
+
+// Adds the relatives of a node that aren't shown yet, positioned around it, and makes room for them
+function expandNode(graph, item) {
+    const node = item.getModel();
+    // Posted, since the known nodes would make the query string grow with the graph
+    const body = new URLSearchParams({
+        csrfmiddlewaretoken: document.querySelector('[name=csrfmiddlewaretoken]').value,
+        known: knownNodes(graph, node).join(','),
+    });
+    fetch(expandUrl.replace('NODE_ID', node.id), {method: 'POST', credentials: 'same-origin', body: body})
+        .then(response => response.json())
+        .then(frontier => {
+            for (const newNode of frontier.nodes) {
+                if (!graph.findById(newNode.id)) {
+                    graph.addItem('node', Object.assign(newNode, {x: node.x + newNode.x, y: node.y + newNode.y}));
+                }
+            }
+            for (const edge of frontier.edges) {
+                graph.addItem('edge', edge);
+            }
+
+            const models = graph.getNodes().map(item => item.getModel());
+            const dx = Math.max(0, padding - Math.min(...models.map(model => model.x)));
+            const dy = Math.max(0, padding - Math.min(...models.map(model => model.y)));
+            if (dx || dy) {
+                for (const item of graph.getNodes()) {
+                    const model = item.getModel();
+                    graph.updateItem(item, {x: model.x + dx, y: model.y + dy});
+                }
+            }
+            graph.changeSize(Math.max(...models.map(model => model.x)) + padding,
+                             Math.max(...models.map(model => model.y)) + padding);
+        });
+}
+
+// Time a click waits for a second one before it expands its node, so that a double click only navigates
+const doubleClickDelay = 300;
 
 G6.registerBehavior('activate-node', {
     getEvents() {
         return {
             'node:click': 'onNodeClick',
+            'node:dblclick': 'onNodeDoubleClick',
         };
     },
     onNodeClick(e) {
-        const item = e.item;
-        console.log(item);
-        let id_pieces = item._cfg.id.split('_');
+        clearTimeout(this.clickTimer);
+        this.clickTimer = setTimeout(() => expandNode(this.graph, e.item), doubleClickDelay);
+    },
+    onNodeDoubleClick(e) {
+        clearTimeout(this.clickTimer);
+        let id_pieces = e.item._cfg.id.split('_');
         if (id_pieces.length === 2 && id_pieces[0] === 'Person') {
             let link = id_pieces[id_pieces.length - 1];
             window.location = '/webapp/person/' + link + '/graph/';
@@ -22,16 +70,19 @@ G6.registerBehavior('activate-node', {
     }
 });
 
-const graph = new G6.Graph({
-    container: "family-graph",
-    width: width,
-    height: height,
-    modes: {
-        default: ['activate-node'],
-    },
-});
-
-console.log(graph);
-
-graph.data(data);
-graph.render();
\ No newline at end of file
+// The browser revalidates its copy of the data with the ETag of the response, so it is only sent again once the tree
+// has changed
+fetch(dataUrl, {credentials: 'same-origin'})
+    .then(response => response.json())
+    .then(data => {
+        const graph = new G6.Graph({
+            container: "family-graph",
+            width: Math.max(...data.nodes.map(node => node.x)) + padding,
+            height: Math.max(...data.nodes.map(node => node.y)) + padding,
+            modes: {
+                default: ['activate-node'],
+            },
+        });
+        graph.data(data);
+        graph.render();
+    });
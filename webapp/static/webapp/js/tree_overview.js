@@ -0,0 +1,65 @@
+dataUrl = JSON.parse(document.getElementById('data-url').textContent);
+padding = JSON.parse(document.getElementById('padding').textContent);
+
+let graph = null;
+
+// Moves the nodes next to the top left corner, since a viewport can be anywhere in the tree
+function normalize(data) {
+    const minX = Math.min(...data.nodes.map(node => node.x));
+    const minY = Math.min(...data.nodes.map(node => node.y));
+    for (const node of data.nodes) {
+        node.x += padding - minX;
+        node.y += padding - minY;
+    }
+    return data;
+}
+
+// Shows the part of the tree in a viewport, or all of it, in as much detail as the node budget allows
+function load(viewport) {
+    const url = viewport ? dataUrl + '?viewport=' + viewport.join(',') : dataUrl;
+    fetch(url, {credentials: 'same-origin'})
+        .then(response => response.json())
+        .then(data => {
+            normalize(data);
+            const width = Math.max(...data.nodes.map(node => node.x)) + padding;
+            const height = Math.max(...data.nodes.map(node => node.y)) + padding;
+            if (graph === null) {
+                graph = new G6.Graph({
+                    container: 'overview-graph',
+                    width: width,
+                    height: height,
+                    modes: {
+                        default: ['drag-canvas', 'zoom-canvas', 'open-node'],
+                    },
+                });
+                graph.data(data);
+                graph.render();
+            } else {
+                graph.changeSize(width, height);
+                graph.changeData(data);
+            }
+        });
+}
+
+G6.registerBehavior('open-node', {
+    getEvents() {
+        return {
+            'node:click': 'onNodeClick',
+            'node:dblclick': 'onNodeDoubleClick',
+        };
+    },
+    onNodeClick(e) {
+        const node = e.item.getModel();
+        if (node.bounds) {
+            load(node.bounds);
+        }
+    },
+    onNodeDoubleClick(e) {
+        let id_pieces = e.item.getModel().id.split('_');
+        if (id_pieces.length === 2 && id_pieces[0] === 'Person') {
+            window.location = '/webapp/person/' + id_pieces[1] + '/graph/';
+        }
+    }
+});
+
+load(null);
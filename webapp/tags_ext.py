@@ -9,6 +9,7 @@ GEDCOM_TAG_VERSION = 'VERS'
 GEDCOM_TAG_FORM = 'FORM'
 GEDCOM_TAG_SUBMITTER = 'SUBM'
 GEDCOM_TAG_CORP = 'CORP'
+GEDCOM_TAG_TRAILER = 'TRLR'
 
 # Charsets
 GEDCOM_CHARSET_ASCII = 'ASCII'
@@ -22,3 +23,4 @@ GEDCOM_TAG_SURNAME_PREFIX = 'SPFX'
 
 # Events
 GEDCOM_TAG_DIVORCE = 'DIV'
+GEDCOM_TAG_RESIDENCE = 'RESI'
@@ -1,14 +1,29 @@
 import datetime
+import gzip
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import FileResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from gedcom.element.element import Element
 from gedcom.parser import Parser
 
 import webapp.tags_ext as tags
-from webapp import gedcom_helpers, name_parser_ext, gedcom_generator
-from webapp import gedcom_parsing
-from webapp.models import Tree, LegalName, Person, AlternateName, Partnership, PersonPartnership
+from webapp import export_cache, export_formats, gedcom_dates, gedcom_helpers, name_parser_ext, gedcom_generator
+from webapp import gedcom_merge, gedcom_parsing, gedcom_stream, gedcom_synthetic, import_jobs, layout_cache
+from webapp.forms import AddPartnershipForm
+from webapp.models import Tree, LegalName, Person, AlternateName, Partnership, PersonPartnership, ImportJob, \
+    GraphLayout
 from webapp.submodels.location_model import Location
 
 
@@ -55,6 +70,37 @@ class GedcomNameTestCase(TestCase):
         self.assertEqual(name_parser_ext.GedcomName("Dr. Martin Luther King, Jr.").as_dict(False),
                          {'title': 'Dr', 'first': 'Martin', 'middle': 'Luther', 'last': 'King', 'suffix': 'Jr.'})
 
+    def test_parse_does_not_modify_constants(self):
+        name = name_parser_ext.GedcomName("John Doe")
+        titles = set(name.C.titles)
+        suffixes = set(name.C.suffix_not_acronyms)
+        name_parser_ext.GedcomName("Dr.Prof. John Doe, Jr.Esq.")
+        self.assertEqual(titles, set(name.C.titles))
+        self.assertEqual(suffixes, set(name.C.suffix_not_acronyms))
+
+    def test_extra_titles_are_per_name(self):
+        name = name_parser_ext.GedcomName("John Doe")
+        name.extra_titles.add('lt.gov')
+        self.assertTrue(name.is_title('Lt.Gov.'))
+        self.assertFalse(name.is_rootname('Lt.Gov.'))
+        self.assertFalse(name_parser_ext.GedcomName("Jane Doe").is_title('Lt.Gov.'))
+
+    def test_parse_name_cached(self):
+        name_parser_ext.clear_name_cache()
+        first = name_parser_ext.parse_name("/Tri Minh/ Doung")
+        self.assertEqual(first, name_parser_ext.GedcomName("/Tri Minh/ Doung").as_dict())
+        first['first'] = 'changed'
+        self.assertEqual(name_parser_ext.parse_name("/Tri Minh/ Doung")['first'], 'Tri Minh')
+        info = name_parser_ext.name_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_parse_names(self):
+        name_parser_ext.clear_name_cache()
+        names = name_parser_ext.parse_names(["Henry Ford", "Robert Louis Stevenson", "Henry Ford"])
+        self.assertEqual([name['first'] for name in names], ['Henry', 'Robert', 'Henry'])
+        self.assertIsNot(names[0], names[2])
+        self.assertEqual(name_parser_ext.name_cache_info().misses, 2)
+
 
 class GedcomTestCase(TestCase):
     def setUp(self):
@@ -210,6 +256,47 @@ class GedcomTestCase(TestCase):
             tree = gedcom_parsing.parse_file(f.buffer, user, 'Tree')
             self.assertIsNotNone(tree)
 
+    def test_import_file_bulk(self):
+        user = User(username="test_user", password="test_password")
+        user.save()
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            tree, stats = gedcom_parsing.import_file(f, user, 'Tree', batch_size=1)
+
+        self.assertEqual(Person.objects.filter(tree=tree).count(), 3)
+        self.assertEqual(stats.rows['Person'], 3)
+        self.assertEqual(stats.rows['LegalName'], 3)
+        self.assertEqual(stats.rows['Partnership'], 1)
+        self.assertEqual(stats.rows['PersonPartnership'], 2)
+        self.assertEqual(stats.rows['Partnership_children'], 1)
+
+        partnership = Partnership.objects.get(tree=tree)
+        self.assertEqual(partnership.marriage_date, datetime.date(1950, 4, 1))
+        partners = sorted(person.legal_name.first_name for person in partnership.partners())
+        self.assertEqual(partners, ['Jane', 'John'])
+        children = [person.legal_name.first_name for person in partnership.children.all()]
+        self.assertEqual(children, ['Jill'])
+        jill = Person.objects.get(tree=tree, legal_name__first_name='Jill')
+        self.assertEqual(jill.birth_date, datetime.date(1950, 7, 31))
+        self.assertEqual(jill.living, 'Dead')
+        self.assertEqual((jill.birth_location.city, jill.birth_location.state), ('birth', 'place'))
+        # every event uses one of two places, which are only created once
+        self.assertEqual(Location.objects.count(), 2)
+
+    def test_import_file_bulk_matches_per_row(self):
+        user = User(username="test_user", password="test_password")
+        user.save()
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            bulk_tree, bulk_stats = gedcom_parsing.import_file(f, user, 'Bulk')
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            row_tree, row_stats = gedcom_parsing.import_file(f, user, 'Row', bulk=False)
+
+        self.assertDictEqual(bulk_stats.rows, row_stats.rows)
+        for tree in (bulk_tree, row_tree):
+            relations = [(sorted(str(partner) for partner in partnership.partners()), str(child))
+                         for partnership in Partnership.objects.filter(tree=tree)
+                         for child in partnership.children.all()]
+            self.assertEqual(relations, [(['Jane Doe', 'John Doe'], 'Jill Doe')])
+
     def test_gen_individual(self):
         birth_date = datetime.datetime(1980, 1, 1)
         death_date = datetime.datetime(2040, 1, 1)
@@ -409,6 +496,76 @@ class GedcomTestCase(TestCase):
         self.assertTrue(gedcom_helpers.element_equals(root, expected))
 
 
+class GedcomDateTest(TestCase):
+    def test_parse_exact_date(self):
+        date = gedcom_dates.parse_date('12 JAN 1998')
+        self.assertEqual(date.date, datetime.date(1998, 1, 12))
+        self.assertEqual(date.precision, gedcom_dates.DAY)
+        self.assertTrue(date.is_exact)
+        self.assertEqual(date.to_gedcom(), '12 JAN 1998')
+        self.assertEqual(gedcom_dates.parse_date('1 jan 1899').to_gedcom(), '01 JAN 1899')
+
+    def test_parse_partial_dates(self):
+        date = gedcom_dates.parse_date('JUL 1950')
+        self.assertEqual((date.date, date.precision), (datetime.date(1950, 7, 1), gedcom_dates.MONTH))
+        date = gedcom_dates.parse_date('1950')
+        self.assertEqual((date.date, date.precision), (datetime.date(1950, 1, 1), gedcom_dates.YEAR))
+        self.assertFalse(date.is_exact)
+
+    def test_parse_qualified_dates(self):
+        for text in ('ABT 1900', 'CAL MAR 1900', 'EST 02 MAR 1900', 'BEF 1900', 'AFT 1900', 'TO 1900', 'FROM 1900'):
+            date = gedcom_dates.parse_date(text)
+            self.assertEqual(date.to_gedcom(), text)
+            self.assertEqual(date.qualifier, text.split()[0])
+            self.assertFalse(date.is_exact)
+
+    def test_parse_ranges(self):
+        date = gedcom_dates.parse_date('BET JAN 1900 AND 12 MAR 1910')
+        self.assertEqual(date.date, datetime.date(1900, 1, 1))
+        self.assertEqual((date.end, date.end_precision), (datetime.date(1910, 3, 12), gedcom_dates.DAY))
+        self.assertEqual(date.to_gedcom(), 'BET JAN 1900 AND 12 MAR 1910')
+        self.assertEqual(gedcom_dates.parse_date('FROM 1900 TO 1910').to_gedcom(), 'FROM 1900 TO 1910')
+
+    def test_parse_invalid_dates(self):
+        for text in ('', 'unknown', '31 FEB 1900', 'BET 1900', 'BET 1900 AND', '1 FOO 1900', '0', 'ABT'):
+            self.assertIsNone(gedcom_dates.parse_date(text), text)
+
+    def test_stored_date(self):
+        self.assertIsNone(gedcom_dates.stored_date(None, 'ABT 1900'))
+        self.assertEqual(gedcom_dates.stored_date(datetime.date(1900, 1, 1), 'ABT 1900').to_gedcom(), 'ABT 1900')
+        # the date was edited after the value was stored
+        self.assertEqual(gedcom_dates.stored_date(datetime.date(1901, 2, 3), 'ABT 1900').to_gedcom(), '03 FEB 1901')
+
+    def test_import_and_export_qualified_date(self):
+        tree = Tree.objects.create(title='test tree')
+        individual = gedcom_helpers.create_individual('@P1@', name='John Cho', sex='M', birth_date='ABT 1900',
+                                                      death_date='BET 1950 AND 1955')
+        ptr, person = gedcom_parsing.parse_individual(individual, tree)
+        person.refresh_from_db()
+        self.assertEqual(person.birth_date, datetime.date(1900, 1, 1))
+        self.assertEqual(person.birth_date_gedcom, 'ABT 1900')
+        self.assertEqual(person.death_date_gedcom, 'BET 1950 AND 1955')
+
+        ptr, element = gedcom_generator.gen_individual(person)
+        birth = gedcom_helpers.get_next_child_element(element, tags.GEDCOM_TAG_BIRTH)
+        self.assertEqual(gedcom_helpers.get_value(birth, tags.GEDCOM_TAG_DATE), 'ABT 1900')
+        death = gedcom_helpers.get_next_child_element(element, tags.GEDCOM_TAG_DEATH)
+        self.assertEqual(gedcom_helpers.get_value(death, tags.GEDCOM_TAG_DATE), 'BET 1950 AND 1955')
+
+    def test_edited_date_clears_gedcom_value(self):
+        self.assertNotIn('marriage_date_gedcom', AddPartnershipForm().fields)
+        self.assertNotIn('divorce_date_gedcom', AddPartnershipForm().fields)
+        tree = Tree.objects.create(title='test tree')
+        partnership = Partnership.objects.create(
+            tree=tree, marriage_date=datetime.date(1900, 1, 1), marriage_date_gedcom='ABT 1900',
+            divorce_date=datetime.date(1910, 1, 1), divorce_date_gedcom='1910')
+        form = AddPartnershipForm({'marriage_date': '1900-01-01', 'divorce_date': '1911-05-06',
+                                   'marital_status': partnership.marital_status}, instance=partnership)
+        self.assertTrue(form.is_valid(), form.errors)
+        partnership = form.save()
+        self.assertEqual((partnership.marriage_date_gedcom, partnership.divorce_date_gedcom), ('ABT 1900', ''))
+
+
 class GedcomHelpersTest(TestCase):
     def test_element_values_equals(self):
         element_1 = Element(1, '', '', '')
@@ -426,6 +583,31 @@ class GedcomHelpersTest(TestCase):
         element_7 = Element(2, 'pointer', 'tag', 'value')
         self.assertFalse(gedcom_helpers.element_values_equals(element_2, element_7))
 
+    def test_child_index(self):
+        family = gedcom_helpers.create_family('@F1@', husb_ptrs=('@P1@',), wife_ptrs=('@P2@',),
+                                              child_ptrs=('@P3@', '@P4@'))
+        family.add_child_element(Element(1, '', tags.GEDCOM_TAG_HUSBAND, '@P5@'))
+        index = gedcom_helpers.get_child_index(family)
+        self.assertEqual([child.get_value() for child in index[tags.GEDCOM_TAG_CHILD]], ['@P3@', '@P4@'])
+        self.assertIs(gedcom_helpers.get_child_index(family), index)
+
+        # Partners with different tags keep their document order
+        partners = gedcom_helpers.filter_child_elements(family, tag=(tags.GEDCOM_TAG_HUSBAND, tags.GEDCOM_TAG_WIFE))
+        self.assertEqual([partner.get_value() for partner in partners], ['@P1@', '@P2@', '@P5@'])
+
+        # Children added after the first lookup are found
+        family.add_child_element(Element(1, '', tags.GEDCOM_TAG_MARRIAGE, ''))
+        self.assertIsNotNone(gedcom_helpers.get_next_child_element(family, tags.GEDCOM_TAG_MARRIAGE))
+        self.assertIsNone(gedcom_helpers.get_next_child_element(family, tags.GEDCOM_TAG_DIVORCE))
+        self.assertEqual(gedcom_helpers.get_value(family, tags.GEDCOM_TAG_CHILD), '@P3@')
+        self.assertEqual(gedcom_helpers.get_value(family, tags.GEDCOM_TAG_DIVORCE), '')
+
+        record = next(gedcom_stream.iter_records(['0 @P1@ INDI', '1 SEX F', '1 FAMS @F1@', '1 FAMS @F2@']))
+        self.assertEqual(gedcom_helpers.get_value(record, tags.GEDCOM_TAG_SEX), 'F')
+        self.assertEqual(len(gedcom_helpers.filter_child_elements(record, tags.GEDCOM_TAG_FAMILY_SPOUSE)), 2)
+        self.assertEqual(gedcom_helpers.get_next_child_element(record, tags.GEDCOM_TAG_FAMILY_SPOUSE,
+                                                               value='@F2@').get_value(), '@F2@')
+
     def test_gen_pointer(self):
         legal_name = LegalName(first_name="Chris")
         legal_name.save()
@@ -441,3 +623,608 @@ class GedcomHelpersTest(TestCase):
         partnership.save()
         partnership_ptr = gedcom_helpers.gen_ptr(partnership)
         self.assertEqual(partnership_ptr, f"@PARTNERSHIP_{partnership.pk}@")
+
+
+class GedcomStreamTest(TestCase):
+    def assertRecordMatchesElement(self, record, element):
+        self.assertEqual(record.get_level(), element.get_level())
+        self.assertEqual(record.get_pointer(), element.get_pointer())
+        self.assertEqual(record.get_tag(), element.get_tag())
+        self.assertEqual(record.get_value(), element.get_value())
+        self.assertEqual(len(record.get_child_elements()), len(element.get_child_elements()))
+        for record_child, element_child in zip(record.get_child_elements(), element.get_child_elements()):
+            self.assertRecordMatchesElement(record_child, element_child)
+
+    def test_iter_records_matches_parser(self):
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            records = list(gedcom_stream.iter_records(f))
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            elements = gedcom_parsing.get_root_element(f).get_child_elements()
+
+        self.assertEqual([record.get_tag() for record in records],
+                         ['HEAD', 'SUBM', 'INDI', 'INDI', 'INDI', 'FAM', 'TRLR'])
+        self.assertEqual(len(records), len(elements))
+        for record, element in zip(records, elements):
+            self.assertRecordMatchesElement(record, element)
+
+    def test_iter_records_is_lazy(self):
+        lines = iter([b'0 @I1@ INDI\n', b'1 NAME /John/ Doe\n', b'0 @I2@ INDI\n', b'1 NAME /Jane/ Doe\n'])
+        records = gedcom_stream.iter_records(lines)
+        first = next(records)
+        self.assertEqual(first.get_pointer(), '@I1@')
+        self.assertEqual(gedcom_helpers.get_value(first, tags.GEDCOM_TAG_NAME), '/John/ Doe')
+        # only the first line of the second record has been consumed
+        self.assertEqual(next(lines), b'1 NAME /Jane/ Doe\n')
+
+    def test_parse_line(self):
+        self.assertEqual(gedcom_stream.parse_line('0 @F1@ FAM'), (0, '@F1@', 'FAM', ''))
+        self.assertEqual(gedcom_stream.parse_line('1 FAMS @F1@'), (1, '', 'FAMS', '@F1@'))
+        self.assertEqual(gedcom_stream.parse_line('2 DATE 1 JAN 1899'), (2, '', 'DATE', '1 JAN 1899'))
+        self.assertEqual(gedcom_stream.parse_line('1 BIRT'), (1, '', 'BIRT', ''))
+        self.assertIsNone(gedcom_stream.parse_line('continued text'))
+
+    def test_unparsable_line_is_concatenated(self):
+        records = list(gedcom_stream.iter_records(['0 @N1@ NOTE first line\n', 'second line\n']))
+        self.assertEqual(len(records), 1)
+        concatenation = records[0].get_child_elements()[0]
+        self.assertEqual(concatenation.get_tag(), tags.GEDCOM_TAG_CONCATENATION)
+        self.assertEqual(concatenation.get_value(), 'second line')
+
+
+class GedcomMergeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            self.tree, stats = gedcom_parsing.import_file(f, self.user, 'simple')
+
+    def export(self):
+        return gedcom_generator.generate_file(self.tree).to_gedcom_string(recursive=True).splitlines()
+
+    def person(self, first_name):
+        return Person.objects.get(tree=self.tree, legal_name__first_name=first_name)
+
+    def test_unchanged_export_writes_nothing(self):
+        version = Tree.objects.get(pk=self.tree.pk).version
+        layout_cache.get_person_graph(self.person('John'))
+        stats = gedcom_merge.merge_file(self.export(), self.tree)
+        self.assertEqual((stats.total_rows, stats.total_updated, stats.total_deleted), (0, 0, 0))
+        self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, version)
+        self.assertTrue(GraphLayout.objects.filter(tree=self.tree).exists())
+
+    def test_unchanged_file_matches_by_fingerprint(self):
+        person_ids = set(Person.objects.filter(tree=self.tree).values_list('pk', flat=True))
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            stats = gedcom_merge.merge_file(f, self.tree)
+        self.assertEqual((stats.total_rows, stats.total_updated, stats.total_deleted), (0, 0, 0))
+        self.assertEqual(set(Person.objects.filter(tree=self.tree).values_list('pk', flat=True)), person_ids)
+
+    def test_merge_changes(self):
+        john = self.person('John')
+        john.notes = 'kept'
+        john.save()
+        jill = self.person('Jill')
+        jill_ptr = gedcom_helpers.gen_ptr(jill)
+
+        family_ptr = gedcom_helpers.gen_ptr(Partnership.objects.get(tree=self.tree))
+        lines = list()
+        skip = False
+        for line in self.export():
+            # Rename John, remove Jill, and add a child with an alternate name
+            if line.startswith('0 '):
+                skip = line == f'0 {jill_ptr} INDI'
+            if skip or line.endswith(f'CHIL {jill_ptr}'):
+                continue
+            lines.append(line.replace('NAME John Doe', 'NAME Johnny Doe'))
+            if line == f'0 {family_ptr} FAM':
+                lines.append('1 CHIL @NEW@')
+        lines += ['0 @NEW@ INDI', '1 NAME Jack Doe', '1 NAME Jackie Doe', '1 SEX M', f'1 FAMC {family_ptr}']
+
+        version = Tree.objects.get(pk=self.tree.pk).version
+        layout_cache.get_person_graph(john)
+        stats = gedcom_merge.merge_file(lines, self.tree)
+        self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, version + 1)
+        # Bulk writes don't send signals, so the merge removes the stored graph layouts itself
+        self.assertFalse(GraphLayout.objects.filter(tree=self.tree).exists())
+
+        john.refresh_from_db()
+        self.assertEqual(john.legal_name.first_name, 'Johnny')
+        self.assertEqual(john.notes, 'kept')
+        self.assertFalse(Person.objects.filter(pk=jill.pk).exists())
+        self.assertFalse(LegalName.objects.filter(pk=jill.legal_name_id).exists())
+        jack = self.person('Jack')
+        self.assertEqual([name.first_name for name in jack.alternate_name.all()], ['Jackie'])
+        partnership = Partnership.objects.get(tree=self.tree)
+        self.assertEqual(list(partnership.children.all()), [jack])
+        self.assertEqual(partnership.partners().count(), 2)
+
+        self.assertEqual(stats.updated, {'LegalName': 1})
+        self.assertEqual(stats.rows, {'LegalName': 1, 'Person': 1, 'AlternateName': 1, 'Partnership_children': 1})
+        self.assertEqual(stats.deleted, {'LegalName': 1, 'Person': 1, 'Partnership_children': 1})
+
+    def test_rows_added_during_merge(self):
+        family_ptr = gedcom_helpers.gen_ptr(Partnership.objects.get(tree=self.tree))
+        lines = list()
+        for line in self.export():
+            lines.append(line)
+            if line == f'0 {family_ptr} FAM':
+                lines.append('1 CHIL @NEW@')
+        lines += ['0 @NEW@ INDI', '1 NAME Jack Doe', '1 NAME Jackie Doe', '1 SEX M', f'1 FAMC {family_ptr}']
+
+        bulk_create = Person.objects.bulk_create
+
+        def bulk_create_during_edit(objs, **kwargs):
+            created = bulk_create(objs, **kwargs)
+            # Someone adds a person to the tree while the merge runs, which gets a newer key than the merged ones
+            legal_name = LegalName.objects.create(first_name='Edited', tree=self.tree)
+            Person.objects.create(tree=self.tree, legal_name=legal_name, gender=Person.MALE)
+            return created
+
+        with mock.patch.object(Person.objects, 'bulk_create', bulk_create_during_edit):
+            gedcom_merge.merge_file(lines, self.tree)
+
+        jack = self.person('Jack')
+        self.assertEqual([name.first_name for name in jack.alternate_name.all()], ['Jackie'])
+        children = Partnership.objects.get(tree=self.tree).children.order_by('pk')
+        self.assertEqual(list(children), [self.person('Jill'), jack])
+        self.assertFalse(self.person('Edited').alternate_name.exists())
+
+
+class SyntheticTreeTest(TestCase):
+    def test_generated_tree(self):
+        synthetic = gedcom_synthetic.SyntheticTree(500, max_generations=4, remarriage_rate=0.5, seed=1)
+        self.assertEqual(len(synthetic.persons), 500)
+        self.assertEqual(synthetic.generations, 4)
+        self.assertTrue(any(len(person.family_spouse_ptrs) > 1 for person in synthetic.persons))
+        lines = list(synthetic.lines())
+        self.assertEqual(lines, list(gedcom_synthetic.SyntheticTree(500, max_generations=4, remarriage_rate=0.5,
+                                                                    seed=1).lines()))
+        self.assertNotEqual(lines, list(gedcom_synthetic.SyntheticTree(500, max_generations=4, remarriage_rate=0.5,
+                                                                       seed=2).lines()))
+        self.assertEqual((lines[0], lines[-1]), ('0 HEAD', '0 TRLR'))
+
+    def test_import_generated_tree(self):
+        synthetic = gedcom_synthetic.SyntheticTree(100, names=3, places=2)
+        tree, stats = gedcom_parsing.import_file(synthetic.lines(), User.objects.create(username='test_user'), 'big')
+        self.assertEqual(Person.objects.filter(tree=tree).count(), 100)
+        self.assertEqual(Partnership.objects.filter(tree=tree).count(), len(synthetic.families))
+        self.assertLessEqual(LegalName.objects.filter(tree=tree).values('first_name', 'last_name').distinct().count(),
+                             9)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_gedcom', sizes=[20], no_memory=True, stdout=out)
+        phases = [line.split()[1] for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(phases, ['generate', 'import', 'export', 'dump', 'restore'])
+        self.assertFalse(Tree.objects.exists())
+
+
+class GedcomExportTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(EXPORT_CACHE_DIR=self.cache_dir.name)
+        self.settings_override.enable()
+        self.user = User.objects.create(username='test_user')
+        synthetic = gedcom_synthetic.SyntheticTree(60, remarriage_rate=0.5, places=3)
+        self.tree, stats = gedcom_parsing.import_file(synthetic.lines(), self.user, 'export')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.cache_dir.cleanup()
+
+    def export(self, **headers):
+        response = self.client.get(reverse('export_tree', args=[self.tree.pk]), **headers)
+        return response, b''.join(response.streaming_content).decode() if response.status_code == 200 else None
+
+    def export_compressed(self, export_format, **headers):
+        response = self.client.get(reverse('export_tree', args=[self.tree.pk]), {'format': export_format}, **headers)
+        return response, b''.join(response.streaming_content) if response.status_code == 200 else None
+
+    def test_stream_file(self):
+        chunks = list(gedcom_generator.stream_file(self.tree))
+        self.assertEqual(''.join(chunks), gedcom_generator.generate_file(self.tree).to_gedcom_string(recursive=True))
+        record_tags = [chunk.split('\n', 1)[0].split()[-1] for chunk in chunks]
+        self.assertEqual(record_tags[:2], [tags.GEDCOM_TAG_HEAD, tags.GEDCOM_TAG_SUBMITTER])
+        self.assertEqual(record_tags[2:], sorted(record_tags[2:], key=lambda tag: tag != tags.GEDCOM_TAG_INDIVIDUAL))
+        self.assertEqual(record_tags.count(tags.GEDCOM_TAG_INDIVIDUAL), 60)
+
+    def test_query_count_is_constant(self):
+        def count_queries(tree):
+            tree = Tree.objects.get(pk=tree.pk)
+            with CaptureQueriesContext(connection) as queries:
+                for record in gedcom_generator.gen_records(tree):
+                    pass
+            return len(queries)
+
+        synthetic = gedcom_synthetic.SyntheticTree(240, remarriage_rate=0.5, places=3, seed=1)
+        big_tree, stats = gedcom_parsing.import_file(synthetic.lines(), self.user, 'big')
+        AlternateName.objects.create(person=Person.objects.filter(tree=big_tree).first(), first_name='Alias',
+                                     tree=big_tree)
+        self.assertEqual(count_queries(big_tree), count_queries(self.tree))
+
+    def test_records_match_per_row_queries(self):
+        person = Person.objects.filter(tree=self.tree, partnerships__isnull=False, children__isnull=False).first()
+        AlternateName.objects.create(person=person, first_name='Alias', tree=self.tree)
+        relations = gedcom_generator.TreeRelations(self.tree)
+        self.assertTrue(gedcom_helpers.element_equals(gedcom_generator.gen_individual(person, relations)[1],
+                                                      gedcom_generator.gen_individual(person)[1]))
+        for partnership in Partnership.objects.filter(tree=self.tree):
+            self.assertTrue(gedcom_helpers.element_equals(gedcom_generator.gen_family(partnership, relations)[1],
+                                                          gedcom_generator.gen_family(partnership)[1]))
+
+    def test_export_view_streams(self):
+        self.client.force_login(self.user)
+        response, content = self.export()
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="export.ged"')
+        self.assertEqual(content, ''.join(gedcom_generator.stream_file(self.tree)))
+
+    def test_export_unknown_gender_partners(self):
+        lines = ['0 @I1@ INDI', '1 NAME Alex /Doe/', '1 FAMS @F1@', '0 @I2@ INDI', '1 NAME Sam /Doe/', '1 FAMS @F1@',
+                 '0 @F1@ FAM', '1 HUSB @I1@', '1 WIFE @I2@']
+        self.tree, stats = gedcom_parsing.import_file(lines, self.user, 'unknown genders')
+        self.assertEqual(set(Person.objects.filter(tree=self.tree).values_list('gender', flat=True)), {Person.UNKNOWN})
+        self.client.force_login(self.user)
+        response, content = self.export()
+        self.assertEqual(response.status_code, 200)
+        family = content[content.index(gedcom_helpers.gen_ptr(Partnership.objects.get(tree=self.tree))):]
+        self.assertEqual((family.count('1 HUSB '), family.count('1 WIFE ')), (1, 1))
+
+    def test_export_cache(self):
+        self.client.force_login(self.user)
+        response, content = self.export()
+        etag = response['ETag']
+        self.assertTrue(os.path.exists(export_cache.cache_path(self.tree)))
+
+        with CaptureQueriesContext(connection) as queries:
+            cached_response, cached_content = self.export()
+        self.assertIsInstance(cached_response, FileResponse)
+        self.assertEqual((cached_response['ETag'], cached_content), (etag, content))
+        self.assertFalse(any('webapp_person' in query['sql'] for query in queries))
+
+        self.assertEqual(self.export(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+
+        person = Person.objects.filter(tree=self.tree).first()
+        person.legal_name.first_name = 'Renamed'
+        person.legal_name.save()
+        changed_response, changed_content = self.export(HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(changed_response['ETag'], etag)
+        self.assertIn('Renamed', changed_content)
+        self.assertEqual(os.listdir(self.cache_dir.name), [os.path.basename(export_cache.cache_path(
+            Tree.objects.get(pk=self.tree.pk)))])
+
+    def test_cache_eviction(self):
+        other_tree, stats = gedcom_parsing.import_file(['0 @I1@ INDI', '1 NAME /Other/'], self.user, 'other')
+        for tree in (self.tree, other_tree):
+            for chunk in export_cache.stream_and_cache(tree):
+                pass
+        old_time = os.path.getmtime(export_cache.cache_path(self.tree)) - 60
+        os.utime(export_cache.cache_path(self.tree), (old_time, old_time))
+        export_cache.open_cached(other_tree).close()
+
+        export_cache.evict(max_bytes=os.path.getsize(export_cache.cache_path(other_tree)))
+        self.assertIsNone(export_cache.open_cached(self.tree))
+        self.assertIsNotNone(export_cache.open_cached(other_tree))
+
+    def test_interrupted_export_is_not_cached(self):
+        chunks = export_cache.stream_and_cache(self.tree)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_slow_export_keeps_newer_versions(self):
+        chunks = export_cache.stream_and_cache(self.tree)
+        next(chunks)
+        # The tree changes and is exported again while the first export is still streamed
+        newer_tree = Tree.objects.get(pk=self.tree.pk)
+        newer_tree.version += 1
+        for chunk in export_cache.stream_and_cache(newer_tree):
+            pass
+        for chunk in chunks:
+            pass
+        self.assertEqual(sorted(os.listdir(self.cache_dir.name)), [
+            os.path.basename(export_cache.cache_path(tree)) for tree in (self.tree, newer_tree)])
+
+        for chunk in export_cache.stream_and_cache(newer_tree):
+            pass
+        self.assertEqual(os.listdir(self.cache_dir.name), [os.path.basename(export_cache.cache_path(newer_tree))])
+
+    def test_deleted_tree_exports_are_removed(self):
+        other_tree, stats = gedcom_parsing.import_file(['0 @I1@ INDI', '1 NAME /Other/'], self.user, 'other')
+        for tree in (self.tree, other_tree):
+            for chunk in export_cache.stream_and_cache(tree):
+                pass
+        self.client.force_login(self.user)
+        self.client.post(reverse('delete_tree', args=[self.tree.pk]))
+        self.assertFalse(Tree.objects.filter(pk=self.tree.pk).exists())
+        self.assertEqual(os.listdir(self.cache_dir.name), [os.path.basename(export_cache.cache_path(other_tree))])
+
+    def test_compressed_formats(self):
+        self.client.force_login(self.user)
+        expected = ''.join(gedcom_generator.stream_file(self.tree)).encode()
+        etags = set()
+        # The first export of each format is generated, the second one is read from the cache
+        for cached in (False, True):
+            gzip_response, gzip_content = self.export_compressed('gzip')
+            self.assertEqual(gzip_response['Content-Type'], 'application/gzip')
+            self.assertEqual(gzip_response['Content-Disposition'], 'attachment; filename="export.ged.gz"')
+            self.assertEqual(gzip.decompress(gzip_content), expected)
+            self.assertLess(len(gzip_content), len(expected))
+            self.assertTrue(os.path.exists(export_cache.cache_path(self.tree)))
+
+            zip_response, zip_content = self.export_compressed('zip')
+            self.assertEqual(zip_response['Content-Disposition'], 'attachment; filename="export.zip"')
+            with zipfile.ZipFile(io.BytesIO(zip_content)) as archive:
+                self.assertEqual(archive.namelist(), [export_formats.ZIP_MEMBER_NAME])
+                self.assertEqual(archive.read(export_formats.ZIP_MEMBER_NAME), expected)
+            etags.update((gzip_response['ETag'], zip_response['ETag']))
+
+        plain_response, plain_content = self.export()
+        etags.add(plain_response['ETag'])
+        self.assertEqual(len(etags), 3)
+        self.assertEqual(self.export_compressed('gzip', HTTP_IF_NONE_MATCH=gzip_response['ETag'])[0].status_code, 304)
+        self.assertEqual(self.export_compressed('zip', HTTP_IF_NONE_MATCH=gzip_response['ETag'])[0].status_code, 200)
+
+    def test_compression_is_incremental(self):
+        chunks = ['0 HEAD\n'] + [f'0 @I{i}@ INDI\n1 NAME Person {i} /Test/\n' for i in range(20000)]
+        compressed = list(export_formats.gzip_chunks(iter(chunks)))
+        self.assertGreater(len(compressed), 2)
+        self.assertEqual(gzip.decompress(b''.join(compressed)).decode(), ''.join(chunks))
+
+    def test_unknown_format(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.export_compressed('rar')[0].status_code, 400)
+
+
+class SubtreeExportTest(TestCase):
+    # Albert and Betty are the parents of Carl and Dennis. Carl and Emma have Frank and Grace, and Emma has Ivan from
+    # another family with Henry. Frank and Julia have Kevin.
+    FAMILIES = (
+        ('Albert', 'Betty', ('Carl', 'Dennis')),
+        ('Carl', 'Emma', ('Frank', 'Grace')),
+        ('Henry', 'Emma', ('Ivan',)),
+        ('Frank', 'Julia', ('Kevin',)),
+    )
+
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        names = [name for family in self.FAMILIES for name in (family[0], family[1]) + family[2]]
+        names = list(dict.fromkeys(names))
+        females = {'Betty', 'Emma', 'Grace', 'Julia'}
+        lines = ['0 HEAD']
+        for name in names:
+            lines += [f'0 @{name}@ INDI', f'1 NAME {name} /Test/', f'1 SEX {"F" if name in females else "M"}']
+        for i, (husband, wife, children) in enumerate(self.FAMILIES):
+            lines += [f'0 @F{i}@ FAM', f'1 HUSB @{husband}@', f'1 WIFE @{wife}@']
+            lines += [f'1 CHIL @{child}@' for child in children]
+        lines.append('0 TRLR')
+        self.tree, stats = gedcom_parsing.import_file(lines, self.user, 'subtree')
+
+    def person(self, first_name):
+        return Person.objects.get(tree=self.tree, legal_name__first_name=first_name)
+
+    def export(self, first_name, direction, depth=None):
+        """
+        :return: first name -> (first names of the partners of its FAMS families, of the children of its FAMS
+            families, of the partners of its FAMC families) of each exported person
+        """
+        subtree = gedcom_generator.Subtree(self.person(first_name), direction, depth)
+        records = list(gedcom_generator.gen_subtree_records(subtree))
+        individuals = {record.get_pointer(): record for record in records
+                       if record.get_tag() == tags.GEDCOM_TAG_INDIVIDUAL}
+        families = {record.get_pointer(): record for record in records if record.get_tag() == tags.GEDCOM_TAG_FAMILY}
+
+        def first_name_of(ptr):
+            return gedcom_helpers.get_value(individuals[ptr], tags.GEDCOM_TAG_GIVEN_NAME)
+
+        def members(family_ptr, member_tags):
+            return sorted(first_name_of(element.get_value()) for element in families[family_ptr].get_child_elements()
+                          if element.get_tag() in member_tags)
+
+        exported = dict()
+        for ptr, individual in individuals.items():
+            spouse_ptrs = [element.get_value() for element in
+                           gedcom_helpers.filter_child_elements(individual, tags.GEDCOM_TAG_FAMILY_SPOUSE)]
+            child_ptrs = [element.get_value() for element in
+                          gedcom_helpers.filter_child_elements(individual, tags.GEDCOM_TAG_FAMILY_CHILD)]
+            partners = (tags.GEDCOM_TAG_HUSBAND, tags.GEDCOM_TAG_WIFE)
+            exported[first_name_of(ptr)] = (
+                [members(family_ptr, partners) for family_ptr in spouse_ptrs],
+                [members(family_ptr, (tags.GEDCOM_TAG_CHILD,)) for family_ptr in spouse_ptrs],
+                [members(family_ptr, partners) for family_ptr in child_ptrs],
+            )
+        return exported
+
+    def test_descendants(self):
+        exported = self.export('Carl', gedcom_generator.DESCENDANTS)
+        self.assertEqual(set(exported), {'Carl', 'Emma', 'Frank', 'Grace', 'Julia', 'Kevin'})
+        # Emma's family with Henry and Carl's parents are left out
+        self.assertEqual(exported['Emma'], ([['Carl', 'Emma']], [['Frank', 'Grace']], []))
+        self.assertEqual(exported['Carl'], ([['Carl', 'Emma']], [['Frank', 'Grace']], []))
+        self.assertEqual(exported['Frank'], ([['Frank', 'Julia']], [['Kevin']], [['Carl', 'Emma']]))
+
+        exported = self.export('Carl', gedcom_generator.DESCENDANTS, depth=1)
+        self.assertEqual(set(exported), {'Carl', 'Emma', 'Frank', 'Grace'})
+        self.assertEqual(exported['Frank'], ([], [], [['Carl', 'Emma']]))
+        self.assertEqual(set(self.export('Carl', gedcom_generator.DESCENDANTS, depth=0)), {'Carl'})
+
+    def test_ancestors(self):
+        exported = self.export('Frank', gedcom_generator.ANCESTORS)
+        self.assertEqual(set(exported), {'Frank', 'Carl', 'Emma', 'Albert', 'Betty'})
+        # Siblings and other families aren't ancestors
+        self.assertEqual(exported['Carl'], ([['Carl', 'Emma']], [['Frank']], [['Albert', 'Betty']]))
+        self.assertEqual(exported['Emma'], ([['Carl', 'Emma']], [['Frank']], []))
+        self.assertEqual(exported['Albert'], ([['Albert', 'Betty']], [['Carl']], []))
+
+        self.assertEqual(set(self.export('Kevin', gedcom_generator.ANCESTORS, depth=2)),
+                         {'Kevin', 'Frank', 'Julia', 'Carl', 'Emma'})
+
+    def test_one_query_per_generation(self):
+        for first_name, direction, generations in (('Albert', gedcom_generator.DESCENDANTS, 4),
+                                                   ('Kevin', gedcom_generator.ANCESTORS, 4)):
+            person = self.person(first_name)
+            with CaptureQueriesContext(connection) as queries:
+                gedcom_generator.Subtree(person, direction)
+            # One query per generation, the last of which finds nobody, and one for alternate names
+            self.assertEqual(len(queries), generations + 1)
+
+    def test_export_view(self):
+        self.client.force_login(self.user)
+        son = self.person('Frank')
+        url = reverse('export_subtree', args=[son.pk])
+        response = self.client.get(url, {'direction': 'ancestors', 'depth': 1})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Frank Test ancestors.ged"')
+        content = b''.join(response.streaming_content).decode()
+        tree, stats = gedcom_parsing.import_file(content.splitlines(), self.user, 'reimported')
+        self.assertEqual(set(Person.objects.filter(tree=tree).values_list('legal_name__first_name', flat=True)),
+                         {'Frank', 'Carl', 'Emma'})
+
+        self.assertEqual(self.client.get(url, {'direction': 'ancestors'}, HTTP_IF_NONE_MATCH=response['ETag'])
+                         .status_code, 200)
+        self.assertEqual(self.client.get(url, {'direction': 'ancestors', 'depth': 1},
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, {'direction': 'sideways'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'depth': 'all'}).status_code, 400)
+
+        self.client.force_login(User.objects.create(username='other_user'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ExportTreesCommandTest(TransactionTestCase):
+    # The workers of the pool use their own database connections, so the trees have to be committed for them to see
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        self.other_user = User.objects.create(username='other_user')
+        synthetic = gedcom_synthetic.SyntheticTree(20, places=3)
+        self.tree, stats = gedcom_parsing.import_file(synthetic.lines(), self.user, 'first')
+        other_synthetic = gedcom_synthetic.SyntheticTree(10, places=3)
+        self.other_tree, stats = gedcom_parsing.import_file(other_synthetic.lines(), self.other_user, 'second')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, *args, workers=1):
+        stdout = io.StringIO()
+        call_command('export_trees', self.directory.name, *args, workers=workers, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_export_trees(self):
+        output = self.export('--all')
+        self.assertIn('2 exported', output)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         sorted([f'tree-{self.tree.pk}-0.ged', f'tree-{self.other_tree.pk}-0.ged']))
+        path = os.path.join(self.directory.name, f'tree-{self.tree.pk}-0.ged')
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), ''.join(gedcom_generator.stream_file(self.tree)))
+
+        self.assertIn('0 exported', self.export('--all'))
+
+        person = Person.objects.filter(tree=self.tree).first()
+        person.notes = 'changed'
+        person.save()
+        output = self.export('--users', 'test_user', 'other_user')
+        self.assertIn(f'[{self.tree.pk}] first: exported', output)
+        self.assertIn(f'[{self.other_tree.pk}] second: skipped', output)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, f'tree-{self.tree.pk}-1.ged')))
+
+    def test_export_trees_in_workers(self):
+        output = self.export('--all', workers=2)
+        self.assertIn('2 exported', output)
+        for tree in (self.tree, self.other_tree):
+            with open(os.path.join(self.directory.name, f'tree-{tree.pk}-0.ged'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), ''.join(gedcom_generator.stream_file(tree)))
+        self.assertIn('0 exported', self.export('--all', workers=2))
+
+    def test_select_trees(self):
+        self.export('--ids', str(self.other_tree.pk), '--format', 'gzip')
+        self.assertEqual(os.listdir(self.directory.name), [f'tree-{self.other_tree.pk}-0.ged.gz'])
+        with self.assertRaises(CommandError):
+            self.export('--users', 'nobody')
+
+
+class ImportJobTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.user = User.objects.create(username='test_user')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def upload(self, path="gedcom_examples/simple.ged"):
+        with open(path, 'rb') as f:
+            return self.client.post(reverse('import_tree'), {'title': 'Imported', 'file': f})
+
+    def test_upload_queues_job(self):
+        response = self.upload()
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('import_job', args=[job.pk]))
+        self.assertEqual(job.status, ImportJob.Status.QUEUED)
+        self.assertFalse(Tree.objects.filter(creator=self.user).exists())
+
+    def test_run_job(self):
+        self.upload()
+        job = import_jobs.claim_next_job()
+        self.assertEqual(job.status, ImportJob.Status.RUNNING)
+        self.assertIsNone(import_jobs.claim_next_job())
+
+        import_jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual(job.processed_records, 7)
+        self.assertEqual(Person.objects.filter(tree=job.tree).count(), 3)
+
+        status = self.client.get(reverse('import_job_status', args=[job.pk])).json()
+        self.assertEqual(status['status'], 'Done')
+        self.assertEqual(status['tree_url'], job.tree.get_absolute_url())
+
+    def test_stale_job_is_recovered(self):
+        self.upload()
+        job = import_jobs.claim_next_job()
+        # A worker that is still running keeps its job
+        self.assertIsNone(import_jobs.claim_next_job())
+
+        for attempt in range(2, import_jobs.MAX_ATTEMPTS + 1):
+            # The worker died, and the job didn't get any progress since
+            ImportJob.objects.filter(pk=job.pk).update(
+                updated=timezone.now() - datetime.timedelta(seconds=import_jobs.STALE_JOB_TIMEOUT + 1))
+            job = import_jobs.claim_next_job()
+            self.assertEqual((job.status, job.attempts), (ImportJob.Status.RUNNING, attempt))
+
+        ImportJob.objects.filter(pk=job.pk).update(updated=timezone.now() - datetime.timedelta(hours=1))
+        self.assertIsNone(import_jobs.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.FAILED)
+        self.assertIn('interrupted', job.error)
+
+    def test_failed_job(self):
+        with tempfile.NamedTemporaryFile(suffix='.ged') as f:
+            f.write(b'0 @I1@ INDI\n1 NAME /John/ Doe\n0 @F1@ FAM\n1 HUSB @MISSING@\n')
+            f.flush()
+            self.upload(f.name)
+        job = import_jobs.run_job(import_jobs.claim_next_job())
+        self.assertEqual(job.status, ImportJob.Status.FAILED)
+        self.assertIn('KeyError', job.error)
+        self.assertIsNone(job.tree)
+        self.assertFalse(Tree.objects.filter(creator=self.user).exists())
+
+    def test_merge_job(self):
+        with open("gedcom_examples/simple.ged", 'rb') as f:
+            tree, stats = gedcom_parsing.import_file(f, self.user, 'simple')
+            f.seek(0)
+            self.client.post(reverse('import_tree'), {'file': f, 'merge_into': tree.pk})
+        job = import_jobs.run_job(import_jobs.claim_next_job())
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.tree, job.title), (tree, 'simple'))
+        self.assertEqual(Tree.objects.filter(creator=self.user).count(), 1)
+        self.assertEqual(Person.objects.filter(tree=tree).count(), 3)
+
+    def test_status_is_private(self):
+        self.upload()
+        job = ImportJob.objects.get()
+        self.client.force_login(User.objects.create(username='other_user'))
+        self.assertEqual(self.client.get(reverse('import_job_status', args=[job.pk])).status_code, 404)
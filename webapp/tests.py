@@ -1,15 +1,40 @@
 import datetime
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
 from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
-
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from webapp import graph_frontier, graph_overview
+from webapp.gedcom_parsing import import_file
+from webapp.gedcom_synthetic import SyntheticTree
+from webapp.graph_layout import TreeLayout
+from webapp.graph_overview import clear_layout_cache, get_overview
 from webapp.graphs import Graph
-from webapp.models import LegalName, Partnership, Person, PersonPartnership, Tree
+from webapp.kinship import KinshipIndex, clear_kinship_cache, get_kinship_index
+from webapp.layout_cache import get_person_graph
+from webapp.location_resolver import LocationResolver
+from webapp.models import AlternateName, GraphLayout, GraphLayoutNode, LegalName, Location, Partnership, Person, \
+    PersonPartnership, Tree
+from webapp.signals import bump_tree_version, deferred_version_bumps
+from webapp.tree_dump import dump_tree, restore_tree
 
 
 class ModelTestCase(TestCase):
     def setUp(self):
+        # Tree ids are reused once a test's transaction is rolled back, along with their versions
+        clear_kinship_cache()
+        clear_layout_cache()
         self.tree = Tree.objects.create(title='test tree')
 
     def create_person(self, first_name, gender, partnership_ids=None, **kwargs):
@@ -191,6 +216,47 @@ class TestGraph(ModelTestCase):
         self.graph.add_node(node1)
         self.graph.add_node(node2)
         self.graph.add_edge(node1.id, node2.id)
+        self.assertEqual(Graph.Edge('id1', 'id2'), self.graph.get_edge('id1', 'id2'))
+        with self.assertRaises(KeyError):
+            self.graph.get_edge('id2', 'id1')
+
+    def test_remove_node_removes_its_edges(self):
+        for node_id in ('id1', 'id2', 'id3'):
+            self.graph.add_node(Graph.Node(node_id))
+        self.graph.add_edge('id1', 'id2')
+        self.graph.add_edge('id2', 'id3')
+        self.graph.add_edge('id1', 'id3')
+        self.graph.remove_node(self.graph.get_node('id2'))
+        self.assertIsInstance(self.graph.edges, set)
+        self.assertSetEqual({Graph.Edge('id1', 'id3')}, self.graph.edges)
+        self.assertEqual({('id1', 'id3')}, set(self.graph.edge_index))
+        with self.assertRaises(KeyError):
+            self.graph.get_node('id2')
+
+        self.graph.remove_edge('id1', 'id3')
+        self.assertSetEqual(set(), self.graph.edges)
+        self.assertEqual({}, dict(self.graph.adjacency))
+
+    def test_add_duplicate_node(self):
+        self.graph.add_node(Graph.Node('id1'))
+        with self.assertRaises(ValueError):
+            self.graph.add_node(Graph.Node('id1', 10, 10))
+
+    def test_to_json(self):
+        self.graph.add_node(Graph.Node('id1', 1, 2.5, 'Zoë "Zo" O\'Neil'))
+        self.graph.add_node(Graph.Node('id2', -3, 0, size=1))
+        self.graph.add_node(Graph.Node('id3', count=2, bounds=[0, 0, 100, 50]))
+        self.graph.add_edge('id1', 'id2')
+        self.graph.add_edge('id2', 'id3')
+        self.assertFalse(hasattr(self.graph.get_node('id1'), '__dict__'))
+        self.assertEqual({**self.graph.to_dict(), 'level': 1}, json.loads(self.graph.to_json(level=1)))
+        self.assertEqual({'id': 'id3', 'x': None, 'y': None, 'label': None, 'count': 2, 'bounds': [0, 0, 100, 50]},
+                         self.graph.get_node('id3').to_dict())
+
+    def test_benchmark_command(self):
+        stdout = io.StringIO()
+        call_command('benchmark_graph', sizes=[10, 20], stdout=stdout)
+        self.assertEqual([line.split()[0] for line in stdout.getvalue().splitlines()[1:]], ['30', '60'])
 
     def test_add_partnership(self):
         self.graph.add_partnership(self.get_partnership(1), 200, 200)
@@ -227,23 +293,467 @@ class TestGraph(ModelTestCase):
         expected_added_people = {self.opal, self.margaret, self.chris}
         self.assertSetEqual(expected_added_people, self.graph.added_people)
 
-    def test_get_gen_size(self):
-        self.assertEqual(3, self.graph.get_gen_size(self.get_partnership(2), 2))
-        self.assertEqual(1, self.graph.get_gen_size(self.get_partnership(2), 1))
-        self.assertEqual(3, self.graph.get_gen_size(self.get_partnership(1), 1))
+    def positions(self):
+        return {node.id: (node.x, node.y) for node in self.graph.nodes}
 
-    def test_get_family_size(self):
-        self.assertEqual(3, self.graph.get_family_size(self.get_partnership(2), 2))
-        self.assertEqual(3, self.graph.get_family_size(self.get_partnership(2), 1))
-        self.assertEqual(3, self.graph.get_family_size(self.get_partnership(1), 1))
+    def test_add_partnership_with_three_partners(self):
+        partnership = self.get_partnership(1)
+        lena = self.create_person('Lena', 'F')
+        PersonPartnership.objects.create(person=lena, partnership=partnership)
+        self.graph = Graph()
+        self.graph.add_partnership(partnership, 100, 0)
+        xs = sorted(x for x, y in self.positions().values())
+        self.assertListEqual([50, 100, 150, 200], xs)
+        self.assertEqual(3, len(self.graph.edges))
+
+    def test_add_family(self):
+        # Opal has a second partnership, with Nick and their son Oscar, and Talia has a daughter with Paul
+        nick = self.create_person('Nick', 'M', [3])
+        PersonPartnership.objects.create(person=self.opal, partnership=self.get_partnership(3))
+        self.get_partnership(3).children.add(self.create_person('Oscar', 'M'))
+        self.create_person('Paul', 'M', [4])
+        PersonPartnership.objects.create(person=self.talia, partnership=self.get_partnership(4))
+        rita = self.create_person('Rita', 'F')
+        self.get_partnership(4).children.add(rita)
 
-        self.create_person('Peter', 'M', [3])
-        sasha = self.create_person('Sasha', 'F', [3])
-        self.get_partnership(2).children.add(sasha)
+        self.graph = Graph()
+        self.graph.add_family(self.opal)
+        positions = self.positions()
+        self.assertEqual(len(self.graph.nodes), len(set(positions.values())))
+        self.assertEqual(Person.objects.filter(tree=self.tree).count() + 4, len(self.graph.nodes))
+        self.assertEqual((0, 0), positions[self.graph.gen_id(self.opal)])
+        self.assertEqual(0, positions[self.graph.gen_id(nick)][1])
+        # Her parents are a row above her, her granddaughter two rows below her
+        self.assertEqual(-Graph.padding, positions[self.graph.gen_id(self.margaret)][1])
+        self.assertEqual(2 * Graph.padding, positions[self.graph.gen_id(rita)][1])
 
-        brian = self.create_person('Brian', 'M')
-        self.get_partnership(2).children.add(brian)
+        expected_edges = {
+            (self.graph.gen_id(self.opal), self.graph.gen_id(self.get_partnership(3))),
+            (self.graph.gen_id(self.get_partnership(2)), self.graph.gen_id(self.opal)),
+            (self.graph.gen_id(self.get_partnership(4)), self.graph.gen_id(rita)),
+        }
+        self.assertLessEqual(expected_edges, set(self.graph.edge_index))
+
+    def test_add_family_with_cousin_marriage(self):
+        # Jacob's son marries Darrel's daughter, so Jacob and Darrel are drawn once with all their relations
+        self.create_person('Lucy', 'F', [3])
+        self.create_person('Sam', 'M', [4])
+        PersonPartnership.objects.create(person=self.jacob, partnership=self.get_partnership(3))
+        PersonPartnership.objects.create(person=self.darrel, partnership=self.get_partnership(4))
+        ivan, ruth = self.create_person('Ivan', 'M', [5]), self.create_person('Ruth', 'F', [5])
+        self.get_partnership(3).children.add(ivan)
+        self.get_partnership(4).children.add(ruth)
 
-        self.assertEqual(7, self.graph.get_family_size(self.get_partnership(2), 1))
-        self.assertEqual(7, self.graph.get_family_size(self.get_partnership(2), 2))
-        self.assertEqual(3, self.graph.get_family_size(self.get_partnership(1), 1))
+        self.graph = Graph()
+        self.graph.add_family(self.opal, ancestor_depth=2, descendant_depth=3)
+        positions = self.positions()
+        self.assertEqual(len(self.graph.nodes), len(set(positions.values())))
+        self.assertEqual(Person.objects.filter(tree=self.tree).count() + 5, len(self.graph.nodes))
+        for partnership in (self.get_partnership(3), self.get_partnership(4)):
+            self.assertIn((self.graph.gen_id(partnership), self.graph.gen_id(partnership.children.first())),
+                          self.graph.edge_index)
+
+    def test_stored_layout(self):
+        data = get_person_graph(self.opal)
+        self.assertEqual(9, len(data['nodes']))
+        self.assertSetEqual({node['id'] for node in data['nodes']},
+                            set(GraphLayoutNode.objects.values_list('node_id', flat=True)))
+        with self.assertNumQueries(1):
+            self.assertEqual(data, get_person_graph(self.opal))
+
+        # Changes out of the graph's reach don't remove the stored layout, which is served without loading the tree
+        stored = GraphLayout.objects.get(person=self.opal)
+        stored.data['stored'] = True
+        stored.save()
+        zoe = self.create_person('Zoe', 'F')
+        zoe.legal_name.last_name = 'Renamed'
+        zoe.legal_name.save()
+        Partnership.objects.create(tree=self.tree).children.add(zoe)
+        with self.assertNumQueries(1):
+            self.assertTrue(get_person_graph(self.opal).get('stored'))
+
+        # A child of Opal is added, so the graph is laid out again
+        self.get_partnership(1).children.add(self.create_person('Nina', 'F'))
+        data = get_person_graph(self.opal)
+        self.assertNotIn('stored', data)
+        self.assertEqual(10, len(data['nodes']))
+        self.assertEqual(1, GraphLayout.objects.count())
+
+    def test_stored_layout_invalidation(self):
+        def is_stored():
+            return GraphLayout.objects.filter(person=self.opal).exists()
+
+        def rename():
+            self.margaret.legal_name.first_name = 'Maggie'
+            self.margaret.legal_name.save()
+
+        changes = (
+            # A relative is renamed
+            rename,
+            # Someone in the graph gets another partner, with a person and a partnership out of it
+            lambda: self.create_person('Ursula', 'F', [1]),
+            # Relations are removed through either side
+            lambda: self.talia.children.clear(),
+            lambda: self.get_partnership(1).children.remove(self.jacob),
+            # Someone in the graph is deleted
+            lambda: self.darrel.delete(),
+        )
+        for change in changes:
+            get_person_graph(self.opal)
+            self.assertTrue(is_stored())
+            change()
+            self.assertFalse(is_stored(), change)
+
+        get_person_graph(self.opal)
+        with deferred_version_bumps():
+            self.bruno.delete()
+            # Removed once the block exits, after the version is bumped
+            self.assertTrue(is_stored())
+        self.assertFalse(is_stored())
+
+        # A layout of a version the tree has changed from isn't stored
+        kinship = get_kinship_index(self.tree.pk)
+        bump_tree_version(self.tree.pk)
+        with mock.patch('webapp.layout_cache.get_kinship_index', return_value=kinship):
+            get_person_graph(self.opal)
+        self.assertFalse(is_stored())
+
+    def test_kinship_index(self):
+        with self.assertNumQueries(4):
+            kinship = KinshipIndex(self.tree.pk)
+        partnership1, partnership2 = self.get_partnership(1), self.get_partnership(2)
+        self.assertListEqual(list(partnership1.partners()), kinship.partners_of(partnership1))
+        self.assertListEqual(list(partnership1.children.all()), kinship.children_of(partnership1))
+        self.assertListEqual([partnership1], kinship.partnerships_of(self.opal))
+        self.assertListEqual([partnership2], kinship.parents_of(self.opal))
+        self.assertListEqual([], kinship.partnerships_of(self.talia))
+        self.assertEqual(str(self.opal), str(kinship.partners_of(partnership1)[0]))
+
+    def test_graph_runs_without_queries(self):
+        partnership1 = self.get_partnership(1)
+        self.graph.get_kinship(self.opal)
+        with self.assertNumQueries(0):
+            self.graph.add_partnership(partnership1)
+            self.graph.add_children(partnership1, depth=2)
+            self.graph.add_parents(self.opal, depth=2)
+            Graph(self.graph.kinship).add_family(self.opal)
+        self.assertEqual(9, len(self.graph.nodes))
+
+    def test_kinship_cache(self):
+        kinship = get_kinship_index(self.tree.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(kinship, get_kinship_index(self.tree.pk))
+
+        self.get_partnership(1).children.add(self.create_person('Nina', 'F'))
+        changed = get_kinship_index(self.tree.pk)
+        self.assertIsNot(kinship, changed)
+        self.assertEqual(4, len(changed.children_of(self.get_partnership(1))))
+
+    def test_graph_data_endpoint(self):
+        user = User.objects.create(username='test_user')
+        self.tree.creator = user
+        self.tree.save()
+        self.client.force_login(user)
+        url = reverse('person_graph_data', args=[self.opal.pk])
+        self.assertContains(self.client.get(reverse('person_graph', args=[self.opal.pk])), url)
+
+        response = self.client.get(url)
+        self.assertEqual(9, len(response.json()['nodes']))
+        self.assertFalse(response['ETag'].startswith('W/'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+
+        self.get_partnership(1).children.add(self.create_person('Nina', 'F'))
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(200, changed.status_code)
+        self.assertNotEqual(response['ETag'], changed['ETag'])
+        self.assertEqual(10, len(changed.json()['nodes']))
+
+        self.client.force_login(User.objects.create(username='other_user'))
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_expand_graph_node(self):
+        user = User.objects.create(username='test_user')
+        self.tree.creator = user
+        self.tree.save()
+        self.client.force_login(user)
+        partnership1, partnership2 = self.get_partnership(1), self.get_partnership(2)
+        gen_id = self.graph.gen_id
+
+        def expand(model_object, *known, **params):
+            url = reverse('expand_graph_node', args=[gen_id(model_object)])
+            return self.client.post(url, {'known': ','.join(gen_id(known_object) for known_object in known), **params})
+
+        frontier = expand(self.opal, self.opal).json()
+        self.assertSetEqual({gen_id(model_object) for model_object in
+                             (partnership1, self.bruno, partnership2, self.margaret, self.chris)},
+                            {node['id'] for node in frontier['nodes']})
+        self.assertIn({'source': gen_id(partnership2), 'target': gen_id(self.opal), 'label': None}, frontier['edges'])
+        chris = next(node for node in frontier['nodes'] if node['id'] == gen_id(self.chris))
+        self.assertEqual(-Graph.padding, chris['y'])
+
+        # Only the children that aren't shown yet are sent, below the partnership. Besides the session and the user,
+        # the node and the tree's version are queried, as the kinship index is cached
+        with self.assertNumQueries(4):
+            frontier = expand(partnership1, self.opal, self.bruno, partnership1, self.talia).json()
+        self.assertSetEqual({gen_id(self.darrel), gen_id(self.jacob)}, {node['id'] for node in frontier['nodes']})
+        self.assertSetEqual({Graph.padding}, {node['y'] for node in frontier['nodes']})
+        self.assertEqual(2, len(frontier['edges']))
+
+        def expand_shown(person, model_object):
+            # Expands a node of the stored graph of a person, with all its nodes known at their positions
+            data = get_person_graph(person)
+            origin = next(node for node in data['nodes'] if node['id'] == gen_id(model_object))
+            shown = [(node['x'] - origin['x'], node['y'] - origin['y']) for node in data['nodes']]
+            known = [f'{node["id"]}:{x}:{y}' for node, (x, y) in zip(data['nodes'], shown)]
+            frontier = self.client.post(reverse('expand_graph_node', args=[gen_id(model_object)]),
+                                        {'known': ','.join(known)}).json()
+            for node in frontier['nodes']:
+                self.assertFalse(any(y == node['y'] and abs(x - node['x']) < Graph.padding for x, y in shown), node)
+            return {node['id'] for node in frontier['nodes']}
+
+        # Margaret's second marriage is put clear of her first one, which is shown right next to her in Opal's graph
+        victor = self.create_person('Victor', 'M', [6])
+        PersonPartnership.objects.create(person=self.margaret, partnership=self.get_partnership(6))
+        self.assertSetEqual({gen_id(self.get_partnership(6)), gen_id(victor)}, expand_shown(self.opal, self.margaret))
+        # Talia's siblings are put beside her rather than centered under her parents
+        self.assertSetEqual({gen_id(self.darrel), gen_id(self.jacob)}, expand_shown(self.talia, partnership1))
+
+        self.assertEqual(400, expand(self.opal, depth=graph_frontier.MAX_DEPTH + 1).status_code)
+        self.assertEqual(400, self.client.post(reverse('expand_graph_node', args=[gen_id(self.opal)]),
+                                               {'known': f'{gen_id(self.bruno)}:1:inf'}).status_code)
+        self.assertEqual(400, self.client.post(reverse('expand_graph_node', args=['Tree_1'])).status_code)
+        self.assertEqual(405, self.client.get(reverse('expand_graph_node', args=[gen_id(self.opal)])).status_code)
+        self.client.force_login(User.objects.create(username='other_user'))
+        self.assertEqual(404, expand(self.opal).status_code)
+
+    def test_add_tree(self):
+        # A partnership without partners, whose child is only reached as a root
+        self.get_partnership(3).children.add(self.create_person('Lena', 'F'))
+        kinship = KinshipIndex(self.tree.pk)
+        layout = TreeLayout(kinship).add_tree()
+        self.assertEqual(len(kinship.persons) + len(kinship.partnerships), len(layout.positions))
+        self.assertEqual(len(layout.positions), len(set(layout.positions.values())))
+        self.assertEqual(0, layout.positions[self.margaret][1])
+        self.assertEqual(2, layout.positions[self.jacob][1])
+
+    def test_overview(self):
+        kinship = KinshipIndex(self.tree.pk)
+        overview = get_overview(kinship)
+        self.assertEqual(0, overview['level'])
+        self.assertEqual(9, len(overview['nodes']))
+        self.assertEqual(len(list(TreeLayout(kinship).add_tree().edges())), len(overview['edges']))
+
+        overview = get_overview(kinship, budget=3)
+        self.assertLessEqual(len(overview['nodes']), 3)
+        self.assertGreater(overview['level'], 0)
+        self.assertEqual(7, sum(node['count'] if node['id'].startswith('Cluster') else node['id'].startswith('Person')
+                                for node in overview['nodes']))
+        node_ids = {node['id'] for node in overview['nodes']}
+        self.assertTrue(all(edge['source'] in node_ids and edge['target'] in node_ids for edge in overview['edges']))
+
+        # Only Opal's generation is in the viewport
+        overview = get_overview(kinship, viewport=(-1000, Graph.padding, 1000, Graph.padding))
+        self.assertSetEqual({self.graph.gen_id(person) for person in (self.opal, self.bruno)} |
+                            {self.graph.gen_id(self.get_partnership(1))}, {node['id'] for node in overview['nodes']})
+
+    def test_overview_endpoint(self):
+        user = User.objects.create(username='test_user')
+        self.tree.creator = user
+        self.tree.save()
+        self.client.force_login(user)
+        self.assertContains(self.client.get(reverse('tree_overview', args=[self.tree.pk])),
+                            reverse('tree_overview_data', args=[self.tree.pk]))
+
+        url = reverse('tree_overview_data', args=[self.tree.pk])
+        response = self.client.get(url, {'budget': 3, 'viewport': '0,0,500,500'})
+        self.assertLessEqual(len(response.json()['nodes']), 3)
+        self.assertEqual(304, self.client.get(url, {'budget': 3, 'viewport': '0,0,500,500'},
+                                              HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+        self.assertEqual(1, len(self.client.get(url, {'level': graph_overview.MAX_LEVEL}).json()['nodes']))
+        for params in ({'budget': 0}, {'budget': graph_overview.MAX_BUDGET + 1}, {'viewport': '1,2,3'},
+                       {'level': 'x'}, {'level': graph_overview.MAX_LEVEL + 1}, {'level': 1100}):
+            self.assertEqual(400, self.client.get(url, params).status_code)
+
+        self.client.force_login(User.objects.create(username='other_user'))
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_graph_view_query_count(self):
+        user = User.objects.create(username='test_user')
+        self.client.force_login(user)
+
+        def count_queries(individuals):
+            tree, stats = import_file(SyntheticTree(individuals, remarriage_rate=0, places=3).lines(), user,
+                                      str(individuals))
+            # The first child of the first founders has parents, a partner and children
+            person = Person.objects.filter(tree=tree, children__isnull=False, partnerships__isnull=False).first()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('person_graph_data', args=[person.pk]))
+            return len(queries)
+
+        self.assertEqual(count_queries(200), count_queries(50))
+
+
+class LocationResolverTest(TestCase):
+    def setUp(self):
+        self.boston = Location.objects.create(city='Boston', state='MA', country='US')
+
+    def test_resolve_existing(self):
+        locations = LocationResolver(preload=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.boston.pk, locations.resolve('Boston', 'MA', 'US').pk)
+
+    def test_resolve_dedupes(self):
+        locations = LocationResolver(preload=True)
+        first = locations.resolve('Paris', '', 'FR')
+        self.assertIsNone(first.pk)
+        self.assertIs(first, locations.resolve('Paris', '', 'FR'))
+        self.assertIs(first, locations.resolve('Paris', None, 'FR'))
+
+    def test_save_creates_missing_in_one_insert(self):
+        locations = LocationResolver(preload=True)
+        paris = locations.resolve('Paris', '', 'FR')
+        lyon = locations.resolve('Lyon', '', 'FR')
+        boston = locations.resolve('Boston', 'MA', 'US')
+        # one insert, then one lookup for the new primary keys, which no backend returns with ignore_conflicts
+        with self.assertNumQueries(2):
+            locations.save()
+        self.assertEqual(Location.objects.count(), 3)
+        self.assertEqual(paris, Location.objects.get(city='Paris'))
+        self.assertEqual(lyon, Location.objects.get(city='Lyon'))
+        self.assertEqual(self.boston, boston)
+
+    def test_save_without_preload(self):
+        locations = LocationResolver()
+        boston = locations.resolve('Boston', 'MA', 'US')
+        paris = locations.resolve('Paris', '', 'FR')
+        locations.save()
+        self.assertEqual(self.boston.pk, boston.pk)
+        self.assertEqual(Location.objects.get(city='Paris').pk, paris.pk)
+
+    def test_save_handles_concurrently_created_location(self):
+        locations = LocationResolver(preload=True)
+        paris = locations.resolve('Paris', '', 'FR')
+        existing = Location.objects.create(city='Paris', state='', country='FR')
+        locations.save()
+        self.assertEqual(existing.pk, paris.pk)
+        self.assertEqual(Location.objects.filter(city='Paris').count(), 1)
+
+    def test_get_or_create(self):
+        locations = LocationResolver()
+        location = locations.get_or_create('Paris', '', 'FR')
+        self.assertIsNotNone(location.pk)
+        self.assertEqual(location, locations.get_or_create('Paris', '', 'FR'))
+
+
+class TreeVersionTest(ModelTestCase):
+    def assertBumped(self, action):
+        version = Tree.objects.get(pk=self.tree.pk).version
+        action()
+        self.assertGreater(Tree.objects.get(pk=self.tree.pk).version, version)
+
+    def test_changes_bump_version(self):
+        self.assertBumped(lambda: self.create_person('Abe', 'M'))
+        abe = Person.objects.get(legal_name__first_name='Abe')
+        self.assertBumped(lambda: Person.objects.filter(pk=abe.pk).first().save())
+        self.assertBumped(lambda: abe.legal_name.save())
+        self.assertBumped(lambda: AlternateName.objects.create(person=abe, first_name='Abe', tree=self.tree))
+        partnership = self.get_partnership(1)
+        self.assertBumped(lambda: PersonPartnership.objects.create(person=abe, partnership=partnership))
+        child = self.create_person('Cain', 'M')
+        self.assertBumped(lambda: partnership.children.add(child))
+        self.assertBumped(lambda: child.children.clear())
+        self.assertBumped(lambda: partnership.delete())
+
+    def test_deferred_bumps(self):
+        version = Tree.objects.get(pk=self.tree.pk).version
+        with deferred_version_bumps():
+            self.create_person('Abe', 'M')
+            self.create_person('Eve', 'F')
+            self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, version)
+        self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, version + 1)
+
+    def test_save_keeps_version(self):
+        stale = Tree.objects.get(pk=self.tree.pk)
+        bump_tree_version(self.tree.pk)
+        stale.title = 'renamed'
+        stale.save()
+        tree = Tree.objects.get(pk=self.tree.pk)
+        self.assertEqual((tree.title, tree.version), ('renamed', stale.version + 1))
+
+
+class TreeDumpTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        synthetic = SyntheticTree(40, remarriage_rate=0.5, places=3)
+        self.tree, stats = import_file(synthetic.lines(), self.user, 'dumped')
+        self.tree.notes = 'notes of the tree'
+        self.tree.save()
+        person = Person.objects.filter(tree=self.tree).first()
+        person.notes = 'kept'
+        person.birth_date_gedcom = 'ABT 1900'
+        person.save()
+        AlternateName.objects.create(person=person, first_name='Alias', tree=self.tree)
+        # Legal names created outside of imports have no tree
+        LegalName.objects.filter(pk=person.legal_name_id).update(tree=None)
+
+    @staticmethod
+    def content(tree):
+        """
+        :return: the fields of every person of the tree and of their partnerships, without primary keys
+        """
+        def name(person):
+            return tuple(person.legal_name)
+
+        persons = list()
+        related = ('legal_name', 'birth_location', 'death_location')
+        for person in Person.objects.filter(tree=tree).select_related(*related):
+            locations = tuple(tuple(location) if location else None
+                              for location in (person.birth_location, person.death_location))
+            partnerships = sorted((sorted(name(partner) for partner in partnership.partners()),
+                                   sorted(name(child) for child in partnership.children.all()),
+                                   partnership.marriage_date, partnership.marital_status)
+                                  for partnership in person.partnerships.all())
+            persons.append((name(person), sorted(tuple(alternate) for alternate in person.alternate_name.all()),
+                            person.birth_date, person.birth_date_gedcom, person.death_date, locations,
+                            person.living, person.gender, person.notes, partnerships))
+        return sorted(persons, key=repr)
+
+    def test_round_trip(self):
+        dump = list(dump_tree(self.tree))
+        locations = Location.objects.count()
+        restored, stats = restore_tree(dump, self.user)
+        self.assertNotEqual(restored.pk, self.tree.pk)
+        self.assertEqual((restored.title, restored.notes), ('dumped', 'notes of the tree'))
+        self.assertEqual(self.content(restored), self.content(self.tree))
+        self.assertEqual(stats.rows['Person'], 40)
+        # The places of the dump already exist
+        self.assertEqual(Location.objects.count(), locations)
+        self.assertFalse(LegalName.objects.filter(legal_name__tree=restored).exclude(tree=restored).exists())
+
+    def test_restore_query_count(self):
+        def count_queries(individuals):
+            tree, stats = import_file(SyntheticTree(individuals, remarriage_rate=0.5, places=3, seed=1).lines(),
+                                      self.user, str(individuals))
+            lines = list(dump_tree(tree))
+            with CaptureQueriesContext(connection) as queries:
+                restore_tree(lines, self.user)
+            return len(queries)
+
+        # SQLite caps the number of parameters per statement, so a bigger tree takes a few more INSERTs, not one per row
+        self.assertLess(count_queries(160), count_queries(40) + 5)
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tree.jsonl.gz')
+            call_command('dump_tree', self.tree.pk, path, stdout=io.StringIO())
+            call_command('restore_tree', path, username='test_user', title='restored', stdout=io.StringIO())
+            self.assertEqual(self.content(Tree.objects.get(title='restored')), self.content(self.tree))
+
+            path = os.path.join(directory, 'tree.ged')
+            with open(path, 'w') as f:
+                f.write('0 HEAD\n')
+            with self.assertRaises(CommandError):
+                call_command('restore_tree', path, username='test_user', stdout=io.StringIO())
+        self.assertFalse(Tree.objects.filter(title='tree.ged').exists())
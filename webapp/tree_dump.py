@@ -0,0 +1,176 @@
+import datetime
+import json
+import time
+
+from django.db import transaction
+from django.db.models import DateField, Q
+
+from webapp.gedcom_parsing import DEFAULT_BATCH_SIZE, BulkImporter, create_tree
+from webapp.models import Tree, Person, LegalName, AlternateName, Partnership, PersonPartnership
+from webapp.submodels.location_model import Location
+
+FORMAT_NAME = 'familytree-dump'
+FORMAT_VERSION = 1
+
+# Number of rows per line of a dump; a restore holds one line in memory at a time
+DUMP_CHUNK_SIZE = 2000
+
+# Tables in the order they are dumped and restored, so every foreign key points to a row that was restored before it
+MODELS = (Location, LegalName, Person, AlternateName, Partnership, PersonPartnership, Partnership.children.through)
+
+
+def columns(model):
+    """
+    :return: the fields of a model's rows in a dump; tree is left out since a dump holds a single tree, and
+        import_token since it only matters to the import that set it
+    """
+    return [field for field in model._meta.concrete_fields if field.name not in ('tree', 'import_token')]
+
+
+def dump_querysets(tree: Tree):
+    persons = Person.objects.filter(tree=tree)
+    return {
+        Location: Location.objects.filter(Q(pk__in=persons.values('birth_location')) |
+                                          Q(pk__in=persons.values('death_location'))),
+        # Legal names aren't always given a tree, so they are found through their person
+        LegalName: LegalName.objects.filter(pk__in=persons.values('legal_name')),
+        Person: persons,
+        AlternateName: AlternateName.objects.filter(person__tree=tree),
+        Partnership: Partnership.objects.filter(tree=tree),
+        PersonPartnership: PersonPartnership.objects.filter(partnership__tree=tree, person__tree=tree),
+        Partnership.children.through: Partnership.children.through.objects.filter(partnership__tree=tree,
+                                                                                  person__tree=tree),
+    }
+
+
+def encode_value(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} values can\'t be dumped')
+
+
+def dump_line(model, names, rows):
+    return json.dumps({'table': model.__name__, 'columns': names, 'rows': rows}, default=encode_value,
+                      separators=(',', ':')) + '\n'
+
+
+def dump_tree(tree: Tree):
+    """
+    Generates a dump of a tree and everything in it, which restore_tree turns back into a copy of the tree.
+
+    The first line is a JSON object with the format and the tree's own fields. Each following line holds up to
+    DUMP_CHUNK_SIZE rows of one table as {"table": ..., "columns": [...], "rows": [[...], ...]}, with the original
+    primary and foreign keys.
+    :return: generator of lines, each ending with a newline
+    """
+    header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'title': tree.title, 'notes': tree.notes}
+    yield json.dumps(header) + '\n'
+
+    for model, queryset in dump_querysets(tree).items():
+        names = [field.attname for field in columns(model)]
+        rows = list()
+        for row in queryset.order_by('pk').values_list(*names).iterator(chunk_size=DUMP_CHUNK_SIZE):
+            rows.append(row)
+            if len(rows) == DUMP_CHUNK_SIZE:
+                yield dump_line(model, names, rows)
+                rows = list()
+        if rows:
+            yield dump_line(model, names, rows)
+
+
+class DumpRestorer(BulkImporter):
+    """
+    Inserts the rows of a dump with bulk_create, one line at a time. Rows get new primary keys, so the keys of every
+    restored row are mapped from the ones in the dump, and foreign keys are rewritten with these maps.
+
+    Locations are shared between trees, so they are resolved to existing locations when there is one for the place.
+    """
+
+    def __init__(self, tree, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(tree, batch_size)
+        self.models = {model.__name__: model for model in MODELS}
+        # model -> primary key in the dump -> primary key of the restored row
+        self.ids = {model: dict() for model in MODELS}
+
+    def add_rows(self, table, names, rows):
+        model = self.models.get(table)
+        if model is None:
+            raise ValueError(f'Unknown table {table}')
+        fields = {field.attname: field for field in columns(model)}
+        unknown = set(names) - set(fields)
+        if unknown:
+            raise ValueError(f'Unknown columns of {table}: {", ".join(sorted(unknown))}')
+
+        converters = list()
+        for name in names:
+            field = fields[name]
+            if field.is_relation:
+                ids = self.ids[field.related_model]
+                converters.append(lambda value, ids=ids: ids[value] if value is not None else None)
+            elif isinstance(field, DateField):
+                converters.append(lambda value: datetime.date.fromisoformat(value) if value is not None else None)
+            else:
+                converters.append(None)
+
+        dumped_ids = list()
+        objs = list()
+        try:
+            for row in rows:
+                values = dict()
+                for name, converter, value in zip(names, converters, row):
+                    if name == 'id':
+                        dumped_ids.append(value)
+                    else:
+                        values[name] = converter(value) if converter is not None else value
+                objs.append(values)
+        except KeyError as e:
+            raise ValueError(f'A row of {table} references a row that isn\'t in the dump: {e}')
+
+        if model is Location:
+            objs = [self.locations.resolve(**values) for values in objs]
+            self.locations.save()
+            self.stats.add(Location, len(objs))
+        else:
+            if hasattr(model, 'tree'):
+                for values in objs:
+                    values['tree'] = self.tree
+            objs = [model(**values) for values in objs]
+            self.bulk_create(model, objs)
+        self.ids[model].update((dumped_id, obj.pk) for dumped_id, obj in zip(dumped_ids, objs))
+
+
+def restore_tree(f, user, title=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Restores a dump made by dump_tree into a new tree.
+    :param f: text or binary stream, or list of lines, of the dump
+    :param user: creator of the new tree
+    :param title: title of the new tree; defaults to the title of the dumped tree
+    :param batch_size: number of rows per INSERT
+    :return: tuple of the created tree and the ImportStats of the restore
+    """
+    start = time.perf_counter()
+    lines = iter(f)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, json.JSONDecodeError):
+        raise ValueError('Not a tree dump')
+    if not isinstance(header, dict) or header.get('format') != FORMAT_NAME:
+        raise ValueError('Not a tree dump')
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f'Unsupported dump version {header.get("version")}')
+
+    # Rows inserted in bulk don't send signals, and the new tree starts at version 0 either way
+    with transaction.atomic():
+        tree = create_tree(user, title or header['title'])
+        if header.get('notes'):
+            tree.notes = header['notes']
+            tree.save()
+        restorer = DumpRestorer(tree, batch_size)
+        for line in lines:
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            restorer.add_rows(chunk['table'], chunk['columns'], chunk['rows'])
+
+    restorer.stats.seconds = time.perf_counter() - start
+    return tree, restorer.stats
@@ -0,0 +1,80 @@
+import glob
+import os
+import tempfile
+import time
+import traceback
+
+import django
+
+from webapp import export_formats
+from webapp.gedcom_generator import stream_file
+from webapp.models import Tree
+
+
+class ExportResult:
+    EXPORTED = 'exported'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, tree_id, title, status, seconds=0.0, size=0, error=''):
+        self.tree_id = tree_id
+        self.title = title
+        self.status = status
+        self.seconds = seconds
+        self.size = size
+        self.error = error
+
+
+def export_path(directory, tree: Tree, export_format):
+    return os.path.join(directory, f'tree-{tree.pk}-{tree.version}.{export_format.extension}')
+
+
+def export_tree(tree_id, directory, format_name=export_formats.DEFAULT_FORMAT):
+    """
+    Writes a tree's GEDCOM file to directory, named after the tree's id and version, and removes the files of its
+    older versions. Nothing is written if the file of the current version is already there.
+    Takes and returns only plain values, so it can be run by a process pool.
+    :return: ExportResult
+    """
+    start = time.perf_counter()
+    tree = Tree.objects.filter(pk=tree_id).select_related('creator').first()
+    if tree is None:
+        return ExportResult(tree_id, '', ExportResult.FAILED, error='The tree does not exist')
+
+    export_format = export_formats.FORMATS[format_name]
+    path = export_path(directory, tree, export_format)
+    if os.path.exists(path):
+        return ExportResult(tree_id, tree.title, ExportResult.SKIPPED, time.perf_counter() - start,
+                            os.path.getsize(path))
+
+    try:
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with open(fd, 'wb') as f:
+                chunks = export_formats.encode(stream_file(tree))
+                if export_format.compress is not None:
+                    chunks = export_format.compress(chunks)
+                for chunk in chunks:
+                    f.write(chunk)
+            # The file only gets its final name once it is complete, so an interrupted run exports the tree again
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    except Exception:
+        return ExportResult(tree_id, tree.title, ExportResult.FAILED, time.perf_counter() - start,
+                            error=traceback.format_exc())
+
+    # The version is read before the file is generated, so a change made meanwhile gets exported by the next run
+    for old_path in glob.glob(os.path.join(directory, f'tree-{tree.pk}-*.{export_format.extension}')):
+        if old_path != path:
+            os.remove(old_path)
+    return ExportResult(tree_id, tree.title, ExportResult.EXPORTED, time.perf_counter() - start, os.path.getsize(path))
+
+
+def init_worker():
+    """
+    Sets up django in a process of the pool, which is needed when processes are spawned instead of forked. Each worker
+    opens its own database connection the first time it runs a query.
+    """
+    django.setup()
@@ -24,16 +24,23 @@ urlpatterns = [
     path('tree/', views.TreeListView.as_view(), name='tree'),
     path('tree/add_tree/', views.add_tree, name='add_tree'),
     path('tree/import/', views.import_gedcom, name='import_tree'),
+    path('tree/import/<int:pk>/', views.import_job, name='import_job'),
+    path('tree/import/<int:pk>/status/', views.import_job_status, name='import_job_status'),
     path('tree/<int:pk>/', views.TreeDetailView.as_view(), name='tree_detail'),
     path('tree/<int:pk>/edit/', views.edit_tree, name='edit_tree'),
     path('tree/<int:pk>/delete/', views.delete_tree, name="delete_tree"),
     path('tree/<int:pk>/export/', views.export_gedcom, name='export_tree'),
+    path('tree/<int:pk>/overview/', views.tree_overview, name='tree_overview'),
+    path('tree/<int:pk>/overview/data/', views.tree_overview_data, name='tree_overview_data'),
     path('tree/<int:pk>/add_person/', views.add_person, name='add_person'),
     path('tree/<int:pk>/add_partnership/', views.add_partnership, name='add_partnership'),
     path('person/<int:pk>/', views.PersonDetailView.as_view(), name='person_detail'),
     path('person/<int:pk>/edit/', views.edit_person, name='edit_person'),
     path('person/<int:pk>/delete/', views.delete_person, name="delete_person"),
     path('person/<int:pk>/graph/', views.graph_person, name='person_graph'),
+    path('person/<int:pk>/graph/data/', views.graph_person_data, name='person_graph_data'),
+    path('graph/<str:node_id>/expand/', views.expand_graph_node, name='expand_graph_node'),
+    path('person/<int:pk>/export/', views.export_subtree, name='export_subtree'),
     path('partnership/<int:pk>/edit/', views.edit_partnership, name='edit_partnership'),
     path('partnership/<int:pk>/delete/', views.delete_partnership, name="delete_partnership"),
 ]
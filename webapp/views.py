@@ -1,17 +1,23 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.handlers.wsgi import WSGIRequest
-from django.http import Http404, HttpResponseRedirect, HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.views import generic
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import condition, require_POST, require_GET
 
-from webapp import gedcom_generator
+from webapp import export_cache, export_formats, gedcom_generator, graph_frontier, graph_overview, layout_cache
+from webapp.export_formats import DEFAULT_FORMAT, FORMATS
 from webapp.forms import AddPersonForm, AddNameForm, AddTreeForm, AddPartnershipForm, AlternateNameFormSet, \
     NewPartnerFormSet, PartnershipChildFormSet, UploadFileForm
-from webapp.gedcom_parsing import parse_file
 from webapp.graphs import Graph
-from webapp.models import Person, Partnership, Location, Tree
+from webapp.kinship import get_kinship_index
+from webapp.location_resolver import LocationResolver
+from webapp.models import ImportJob, Person, Partnership, Tree
+from webapp.signals import deferred_version_bumps
 
 
 @login_required
@@ -106,28 +112,20 @@ def save_person(request, current_tree, template_name, current_person: Person = N
                         alt_name.tree = current_tree
                         alt_name.save()
 
-                # Check each location form's data and query for existing Location
-                # instances.
-                # If location exists, stores it in the corresponding location
-                # variable and sets location_created boolean to false
-                # If it doesn't exist, create a new instance from form's data and
-                # set location_created boolean to true
-                birth_location, birth_loc_was_created = Location.objects.get_or_create(
+                # Look up both locations from the form's data at once; any that
+                # don't exist yet are created together by save()
+                locations = LocationResolver()
+                birth_location = locations.resolve(
                     city=person_form.cleaned_data['birth_city'],
                     state=person_form.cleaned_data['birth_state'],
                     country=person_form.cleaned_data['birth_country'])
 
-                death_location, death_loc_was_created = Location.objects.get_or_create(
+                death_location = locations.resolve(
                     city=person_form.cleaned_data['death_city'],
                     state=person_form.cleaned_data['death_state'],
                     country=person_form.cleaned_data['death_country'])
 
-                # if new location instances were created, save them in the DB
-                if birth_loc_was_created:
-                    birth_location.save()
-
-                if death_loc_was_created:
-                    death_location.save()
+                locations.save()
 
                 # Assign the location instances as keys in Person instance
                 current_person.birth_location = birth_location
@@ -317,11 +315,12 @@ def delete_partnership(request: WSGIRequest, pk):
 @require_POST
 def delete_tree(request, pk):
     tree = Tree.objects.get(pk=pk)
-    people = Person.objects.filter(tree=tree)
-    for person in people:
-        delete_person(request, person.id)
-    partnerships = Partnership.objects.filter(tree=tree)
-    partnerships.delete()
+    with deferred_version_bumps():
+        people = Person.objects.filter(tree=tree)
+        for person in people:
+            delete_person(request, person.id)
+        partnerships = Partnership.objects.filter(tree=tree)
+        partnerships.delete()
     tree.delete()
     return redirect('tree')
 
@@ -383,53 +382,235 @@ class PersonDetailView(LoginRequiredMixin, generic.DetailView):
 
 def graph_person(request, pk):
     person = get_object_or_404(Person, pk=pk, tree__in=Tree.objects.filter(creator=request.user))
-    graph = Graph()
-
-    partnerships = person.partnerships.all()
-    if partnerships:
-        # TODO: add option to graph multiple partnerships
-        for partnership in partnerships[:1]:
-            graph.add_partnership(partnership, 50, 0)
-            if partnership.children.exists():
-                graph.add_children(partnership, depth=2)
-    else:
-        graph.add_person(person, 0, 0)
+    context = {
+        'person': person,
+        'data_url': reverse('person_graph_data', args=[person.pk]),
+        # With the id of a node in place of NODE_ID
+        'expand_url': reverse('expand_graph_node', args=['NODE_ID']),
+        'padding': Graph.padding,
+    }
+    return render(request, 'webapp/person_graph.html', context)
+
+
+def graph_data_etag(request, pk):
+    person = Person.objects.filter(pk=pk, tree__creator=request.user).select_related('tree').first()
+    if person is None:
+        return None
+    return layout_cache.etag(person, person.tree.version)
+
+
+@login_required
+@require_GET
+@condition(etag_func=graph_data_etag)
+def graph_person_data(request, pk):
+    """
+    The nodes and edges of the graph of a person, for the script of graph_person. The ETag changes with the tree's
+    version, so a browser that has the graph gets a 304 until the tree changes.
+    """
+    person = get_object_or_404(Person, pk=pk, tree__creator=request.user)
+    response = JsonResponse(layout_cache.get_person_graph(person))
+    # The graph is the user's own, and has to be checked against the ETag before a cached copy is used
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    if person.parents():
-        graph.add_parents(person, depth=2)
 
-    graph.normalize(extra_padding=50)
+@login_required
+@require_POST
+def expand_graph_node(request, node_id):
+    """
+    The relatives of a node of a person's graph that the client doesn't show yet; see graph_frontier.get_frontier.
+    Takes the depth, and as known the comma separated ids of the nodes that the client shows, with their positions
+    relative to the expanded node as parsed by graph_frontier.parse_known. They are posted rather than put in the query
+    string, which would grow with the graph.
+    """
+    try:
+        model_name, pk = Graph.parse_id(node_id)
+        depth = int(request.POST.get('depth', 1))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid node id or depth')
+    model = {'Person': Person, 'Partnership': Partnership}.get(model_name)
+    if model is None:
+        return HttpResponseBadRequest('Invalid node id')
+    if not 1 <= depth <= graph_frontier.MAX_DEPTH:
+        return HttpResponseBadRequest(f'The depth must be between 1 and {graph_frontier.MAX_DEPTH}')
+
+    tree_id = get_object_or_404(model, pk=pk, tree__creator=request.user).tree_id
+    kinship = get_kinship_index(tree_id)
+    model_object = (kinship.persons if model is Person else kinship.partnerships)[pk]
+    try:
+        known, occupied = graph_frontier.parse_known(kinship, request.POST.get('known', '').split(','))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid position of a known node')
+    return JsonResponse(graph_frontier.get_frontier(kinship, model_object, known, depth, occupied))
 
-    width = max(node.x for node in graph.nodes) + graph.padding
-    height = max(node.y for node in graph.nodes) + graph.padding
 
+@login_required
+def tree_overview(request, pk):
+    tree = get_object_or_404(Tree, pk=pk, creator=request.user)
     context = {
-        'person': person,
-        'data': graph.to_dict(),
-        'width': width,
-        'height': height,
+        'tree': tree,
+        'data_url': reverse('tree_overview_data', args=[tree.pk]),
+        'padding': Graph.padding,
     }
-    return render(request, 'webapp/person_graph.html', context)
+    return render(request, 'webapp/tree_overview.html', context)
+
+
+def get_overview_options(request):
+    """
+    :return: the node budget, viewport and level of detail of an overview, or None if they aren't valid
+    """
+    try:
+        budget = int(request.GET.get('budget', graph_overview.DEFAULT_BUDGET))
+        level = int(request.GET.get('level', 0))
+        viewport = request.GET.get('viewport')
+        viewport = tuple(float(value) for value in viewport.split(',')) if viewport else None
+    except ValueError:
+        return None
+    if not 1 <= budget <= graph_overview.MAX_BUDGET or not 0 <= level <= graph_overview.MAX_LEVEL or \
+            (viewport is not None and len(viewport) != 4):
+        return None
+    return budget, viewport, level
+
+
+def overview_etag(request, pk):
+    tree = Tree.objects.filter(pk=pk, creator=request.user).only('pk', 'version').first()
+    options = get_overview_options(request)
+    if tree is None or options is None:
+        return None
+    budget, viewport, level = options
+    viewport = '_'.join(f'{value:g}' for value in viewport) if viewport else 'all'
+    return f'"{tree.pk}-{tree.version}-overview-{budget}-{viewport}-{level}"'
+
+
+@login_required
+@require_GET
+@condition(etag_func=overview_etag)
+def tree_overview_data(request, pk):
+    """
+    The graph of a whole tree with nearby nodes merged into clusters; see graph_overview.get_overview. Takes the node
+    budget, the viewport as comma separated left, top, right and bottom, and the lowest level of detail.
+    """
+    tree = get_object_or_404(Tree, pk=pk, creator=request.user)
+    options = get_overview_options(request)
+    if options is None:
+        return HttpResponseBadRequest(f'The budget must be between 1 and {graph_overview.MAX_BUDGET}, the viewport '
+                                      f'four numbers and the level not negative')
+    budget, viewport, level = options
+    graph, fields = graph_overview.build_overview(get_kinship_index(tree.pk), budget, viewport, level)
+    # Overviews can have thousands of nodes, which Graph.to_json serializes faster than JsonResponse
+    response = HttpResponse(graph.to_json(**fields), content_type='application/json')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @login_required
 def import_gedcom(request):
     if request.method == 'POST':
-        form = UploadFileForm(request.POST, request.FILES)
-        print(form.is_valid())
+        form = UploadFileForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
-            parse_file(request.FILES['file'], request.user, form.cleaned_data['title'])
-            return HttpResponseRedirect('/')
+            merge_into = form.cleaned_data['merge_into']
+            # The upload is only stored here; the process_import_jobs command does the actual import
+            job = ImportJob.objects.create(creator=request.user, file=request.FILES['file'],
+                                           title=form.cleaned_data['title'] or merge_into.title,
+                                           tree=merge_into, merge=merge_into is not None)
+            return redirect('import_job', pk=job.pk)
     else:
-        form = UploadFileForm()
+        form = UploadFileForm(user=request.user)
     return render(request, 'webapp/tree_import.html', {'form': form})
 
 
 @login_required
 @require_GET
+def import_job(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk, creator=request.user)
+    return render(request, 'webapp/import_job.html', {'job': job})
+
+
+@login_required
+@require_GET
+def import_job_status(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk, creator=request.user)
+    return JsonResponse(job.to_dict())
+
+
+def get_export_format(request):
+    return FORMATS.get(request.GET.get('format', DEFAULT_FORMAT))
+
+
+def export_etag(request, pk):
+    tree = Tree.objects.filter(pk=pk, creator=request.user).only('pk', 'version').first()
+    export_format = get_export_format(request)
+    if tree is None or export_format is None:
+        return None
+    return export_cache.etag(tree, export_format.name)
+
+
+@login_required
+@require_GET
+@condition(etag_func=export_etag)
 def export_gedcom(request, pk):
     tree = Tree.objects.get(pk=pk, creator=request.user)
-    text_body = gedcom_generator.generate_file(tree).to_gedcom_string(recursive=True)
-    response = HttpResponse(text_body, content_type='text/plain')
-    response['Content-Disposition'] = f'attachment; filename="{tree.title}.ged"'
+    export_format = get_export_format(request)
+    if export_format is None:
+        return HttpResponseBadRequest(f'Unknown format, expected one of: {", ".join(FORMATS)}')
+
+    cached = export_cache.open_cached(tree)
+    if cached is not None and export_format.compress is None:
+        response = FileResponse(cached, content_type=export_format.content_type)
+    else:
+        # Records are sent as they are generated, so large trees don't have to fit in memory as one string
+        chunks = export_cache.stream_and_cache(tree) if cached is None else export_formats.read_chunks(cached)
+        if export_format.compress is not None:
+            chunks = export_format.compress(chunks)
+        response = StreamingHttpResponse(chunks, content_type=export_format.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{tree.title}.{export_format.extension}"'
+    return response
+
+
+def get_subtree_options(request):
+    """
+    :return: the direction and depth of a subtree export, or None if they aren't valid
+    """
+    direction = request.GET.get('direction', gedcom_generator.DESCENDANTS)
+    depth = request.GET.get('depth') or None
+    if direction not in (gedcom_generator.ANCESTORS, gedcom_generator.DESCENDANTS):
+        return None
+    if depth is not None:
+        if not depth.isdigit():
+            return None
+        depth = int(depth)
+    return direction, depth
+
+
+def export_subtree_etag(request, pk):
+    person = Person.objects.filter(pk=pk, tree__creator=request.user).select_related('tree').first()
+    export_format = get_export_format(request)
+    options = get_subtree_options(request)
+    if person is None or export_format is None or options is None:
+        return None
+    direction, depth = options
+    return f'"{person.tree.pk}-{person.tree.version}-{person.pk}-{direction}-{depth}-{export_format.name}"'
+
+
+@login_required
+@require_GET
+@condition(etag_func=export_subtree_etag)
+def export_subtree(request, pk):
+    person = get_object_or_404(Person, pk=pk, tree__in=Tree.objects.filter(creator=request.user))
+    export_format = get_export_format(request)
+    if export_format is None:
+        return HttpResponseBadRequest(f'Unknown format, expected one of: {", ".join(FORMATS)}')
+    options = get_subtree_options(request)
+    if options is None:
+        return HttpResponseBadRequest(f'Direction must be {gedcom_generator.ANCESTORS} or '
+                                      f'{gedcom_generator.DESCENDANTS}, and depth a number of generations')
+
+    direction, depth = options
+    subtree = gedcom_generator.Subtree(person, direction, depth)
+    chunks = gedcom_generator.stream_file(person.tree, subtree)
+    if export_format.compress is not None:
+        chunks = export_format.compress(chunks)
+    response = StreamingHttpResponse(chunks, content_type=export_format.content_type)
+    filename = f'{person.legal_name.full_name()} {direction}.{export_format.extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response